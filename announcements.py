@@ -0,0 +1,238 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import timedelta
+import logging
+
+import telegram
+from telegram.error import Forbidden
+
+import config
+import db
+import message_text
+import sender
+from sender import TokenBucket
+import snapshots
+import votings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AnnouncementStats:
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    # recipients of the page being sent right now
+    in_flight: int = 0
+
+
+_stats = AnnouncementStats()
+_task: asyncio.Task | None = None
+# set by stop(), workers finish their current message and take no more
+_stopping = False
+
+
+async def announce_votings(bot: telegram.Bot) -> None:
+    """Announce the actual voting once it opens and frozen results of
+    recently finished votings, then deliver whatever is pending."""
+    if not config.ANNOUNCE_VOTINGS:
+        return
+    actual_voting = await votings.get_actual_voting()
+    if actual_voting is not None:
+        await create("voting_opened", actual_voting.id, message_text.VOTING_OPENED.format(
+            start=actual_voting.voting_start, finish=actual_voting.voting_finish))
+    since = db.current_date() - timedelta(days=config.ANNOUNCE_CLOSED_DAYS)
+    rows = await db.fetchall(_RECENTLY_CLOSED_SQL, {"since": since.isoformat()})
+    for row in rows:
+        result = await snapshots.get_result(row["voting_id"])
+        leaders = "".join(
+            f"{index}. {book.book_name}\n"
+            for index, book in enumerate(result.leaders[:config.ANNOUNCE_LEADERS_COUNT], 1))
+        await create("voting_closed", result.voting.id, message_text.VOTING_CLOSED.format(
+            start=result.voting.voting_start, finish=result.voting.voting_finish,
+            leaders=leaders or message_text.EMPTY_LIST))
+    start(bot)
+
+
+async def create(kind: str, voting_id: int | None, text: str) -> None:
+    """Queue an announcement to every user, once per kind and voting"""
+    async with db.writer() as connection:
+        await connection.execute(_INSERT_ANNOUNCEMENT_SQL, {
+            "kind": kind, "voting_id": voting_id, "text": text})
+
+
+def start(bot: telegram.Bot) -> None:
+    """Deliver pending announcements in the background, unless already doing so"""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_run(bot))
+
+
+async def wait() -> None:
+    """Wait until the background delivery finishes"""
+    if _task is not None:
+        await asyncio.shield(_task)
+
+
+async def stop() -> None:
+    """Interrupt delivery, it resumes from the recorded state on next start.
+
+    Messages already being sent get config.ANNOUNCE_STOP_TIMEOUT seconds
+    to finish, so that their users are recorded and not messaged twice."""
+    global _task, _stopping
+    if _task is None:
+        return
+    _stopping = True
+    try:
+        await asyncio.wait_for(_task, config.ANNOUNCE_STOP_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+    finally:
+        _stopping = False
+        _task = None
+
+
+def get_announcement_stats() -> AnnouncementStats:
+    return _stats
+
+
+async def _run(bot: telegram.Bot) -> None:
+    try:
+        while not _stopping:
+            row = await db.fetchone(_NEXT_ANNOUNCEMENT_SQL)
+            if row is None:
+                return
+            await _deliver(bot, row["id"], row["text"], row["last_user_id"])
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Announcement delivery stopped")
+
+
+async def _deliver(bot: telegram.Bot, announcement_id: int, text: str,
+                   last_user_id: int) -> None:
+    """Send one announcement page by page of config.ANNOUNCE_BATCH_SIZE users.
+
+    Only one page is held in memory. Its delivery states and the page's
+    last user id are written together, so a restart continues with the
+    first user without a state."""
+    logger.info("Delivering announcement %s from user %s", announcement_id, last_user_id)
+    # keeps room under the global limit for replies to users
+    bucket = TokenBucket(config.ANNOUNCE_RATE, config.ANNOUNCE_RATE)
+    while not _stopping:
+        rows = await db.fetchall_tuples(_RECIPIENTS_SQL, {
+            "announcement_id": announcement_id,
+            "after": last_user_id,
+            "limit": config.ANNOUNCE_BATCH_SIZE,
+        })
+        if not rows:
+            async with db.writer() as connection:
+                await connection.execute(_FINISH_ANNOUNCEMENT_SQL, {"id": announcement_id})
+            logger.info("Announcement %s delivered", announcement_id)
+            return
+        recipients = asyncio.Queue()
+        for (user_id,) in rows:
+            recipients.put_nowait(user_id)
+        states: list[tuple[int, str]] = []
+        workers = [asyncio.create_task(_send_worker(bot, text, bucket, recipients, states))
+                   for _ in range(min(config.ANNOUNCE_CONCURRENCY, len(rows)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # what was sent before an interruption is recorded too
+            last_user_id = rows[-1][0] if len(states) == len(rows) else last_user_id
+            await _save_states(announcement_id, states, last_user_id)
+    logger.info("Announcement %s interrupted after user %s", announcement_id, last_user_id)
+
+
+async def _send_worker(bot: telegram.Bot, text: str, bucket: TokenBucket,
+                       recipients: asyncio.Queue, states: list[tuple[int, str]]) -> None:
+    while not recipients.empty() and not _stopping:
+        user_id = recipients.get_nowait()
+        await bucket.acquire()
+        if _stopping:
+            # not recorded, so the next run messages this user
+            return
+        _stats.in_flight += 1
+        try:
+            await sender.send_message(bot, user_id, text)
+        except Forbidden:
+            _stats.blocked += 1
+            states.append((user_id, "blocked"))
+        except telegram.error.TelegramError:
+            _stats.failed += 1
+            states.append((user_id, "failed"))
+        else:
+            _stats.sent += 1
+            states.append((user_id, "sent"))
+        finally:
+            _stats.in_flight -= 1
+
+
+async def _save_states(announcement_id: int, states: list[tuple[int, str]],
+                       last_user_id: int) -> None:
+    async with db.writer() as connection:
+        await connection.executemany(_INSERT_DELIVERY_SQL, (
+            {"announcement_id": announcement_id, "user_id": user_id, "status": status}
+            for user_id, status in states))
+        await connection.executemany(_MARK_BLOCKED_SQL, (
+            {"user_id": user_id} for user_id, status in states if status == "blocked"))
+        await connection.execute(_ADVANCE_ANNOUNCEMENT_SQL, {
+            "id": announcement_id, "last_user_id": last_user_id})
+
+
+_RECENTLY_CLOSED_SQL = """
+    select s.voting_id
+    from voting_snapshot s
+    join voting v on v.id = s.voting_id
+    where v.voting_finish >= :since
+    order by s.voting_id"""
+
+_INSERT_ANNOUNCEMENT_SQL = """
+    insert or ignore into announcement (kind, voting_id, text)
+    values (:kind, :voting_id, :text)"""
+
+_NEXT_ANNOUNCEMENT_SQL = """
+    select id, text, last_user_id
+    from announcement
+    where finished_at is null
+    order by id
+    limit 1"""
+
+# keyset pagination over bot_user, users with a state were reached before
+# an interruption in the middle of a page
+_RECIPIENTS_SQL = """
+    select u.telegram_id
+    from bot_user u
+    where u.telegram_id > :after
+    and u.blocked_at is null
+    and not exists (
+        select 1
+        from announcement_delivery d
+        where d.announcement_id = :announcement_id
+        and d.user_id = u.telegram_id
+    )
+    order by u.telegram_id
+    limit :limit"""
+
+_INSERT_DELIVERY_SQL = """
+    insert or replace into announcement_delivery (announcement_id, user_id, status)
+    values (:announcement_id, :user_id, :status)"""
+
+_MARK_BLOCKED_SQL = """
+    update bot_user
+    set blocked_at = current_timestamp
+    where telegram_id = :user_id"""
+
+_ADVANCE_ANNOUNCEMENT_SQL = """
+    update announcement
+    set last_user_id = :last_user_id
+    where id = :id"""
+
+_FINISH_ANNOUNCEMENT_SQL = """
+    update announcement
+    set finished_at = current_timestamp
+    where id = :id"""
@@ -0,0 +1,111 @@
+"""Deliver an announcement to every bot user through the fake Bot API.
+
+    python -m benchmarks.announce --users 100000 --rate 30
+    python -m benchmarks.announce --users 5000 --rate 1000 --interrupt-after 2
+
+Some users have blocked the bot. With --interrupt-after the delivery is
+stopped once and resumed, like a restarted bot would do. The report shows
+the achieved rate, how much the peak RSS grew while sending, and whether every user who has
+not blocked the bot got exactly one message."""
+import argparse
+import asyncio
+from collections import Counter
+import os
+import random
+import resource
+import tempfile
+import time
+
+import telegram
+from telegram.request import HTTPXRequest
+
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.common import write_results
+from benchmarks.generate import generate
+import config
+
+
+async def run(args: argparse.Namespace) -> dict:
+    config.SEND_GLOBAL_RATE = config.ANNOUNCE_RATE = args.rate
+    config.ANNOUNCE_CONCURRENCY = args.concurrency
+    # the sender reads its global rate on import
+    import announcements
+    import db
+
+    received = Counter()
+    api = FakeBotApi(latency=args.latency)
+    api.on_message = lambda method, parameters: received.update((int(parameters["chat_id"]),))
+    blocked = set(random.Random(1).sample(range(1, args.users + 1),
+                                          int(args.users * args.blocked_share)))
+    api.blocked = blocked
+    await api.start("127.0.0.1", args.port)
+    bot = telegram.Bot(
+        "123456:fake", base_url=f"http://127.0.0.1:{args.port}/bot",
+        request=HTTPXRequest(connection_pool_size=args.concurrency))
+    with tempfile.TemporaryDirectory() as directory:
+        config.SQLITE_DB_FILE = os.path.join(directory, "announce.sqlite3")
+        generate(config.SQLITE_DB_FILE, categories=10, books=100,
+                 users=args.users, votings=1)
+        await db.connect()
+        await bot.initialize()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            await announcements.create("benchmark", None, "Benchmark announcement")
+            started = time.perf_counter()
+            announcements.start(bot)
+            interrupted = False
+            if args.interrupt_after:
+                try:
+                    await asyncio.wait_for(announcements.wait(), args.interrupt_after)
+                except asyncio.TimeoutError:
+                    await announcements.stop()
+                    interrupted = True
+                    announcements.start(bot)
+            await announcements.wait()
+            elapsed = time.perf_counter() - started
+            rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+            blocked_marked = (await db.fetchone(
+                "select count(*) as count from bot_user where blocked_at is not null"))["count"]
+        finally:
+            await bot.shutdown()
+            await db.close()
+            await api.stop()
+    reachable = set(range(1, args.users + 1)) - blocked
+    stats = announcements.get_announcement_stats()
+    return {
+        "benchmark": "announce",
+        "users": args.users,
+        "rate_limit": args.rate,
+        "interrupted": interrupted,
+        "elapsed_seconds": elapsed,
+        "messages_per_second": stats.sent / elapsed,
+        "sent": stats.sent,
+        "blocked": stats.blocked,
+        "failed": stats.failed,
+        "blocked_marked": blocked_marked,
+        "duplicates": sum(1 for count in received.values() if count > 1),
+        "missing": len(reachable - received.keys()),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_growth_kb": rss_growth,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8083)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=30,
+                        help="messages per second, Telegram allows about 30")
+    parser.add_argument("--concurrency", type=int, default=config.ANNOUNCE_CONCURRENCY)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds the fake Bot API takes per message")
+    parser.add_argument("--blocked-share", type=float, default=0.05)
+    parser.add_argument("--interrupt-after", type=float,
+                        help="stop and resume delivery after this many seconds")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
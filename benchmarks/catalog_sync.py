@@ -0,0 +1,131 @@
+"""Time catalog_sync on a large generated catalog and check what it did.
+
+    python -m benchmarks.catalog_sync --books 100000 --format csv
+
+Generates a database, exports its catalog and then syncs edited copies of
+the export: unchanged, with renamed, moved and reordered books, categories
+in reverse order, new books and one new category. Every run checks that
+the books kept their ids, that foreign keys and unique orderings hold and
+that the catalog version changed only when something was written."""
+import argparse
+import asyncio
+import csv
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import write_results
+from benchmarks.generate import generate
+import catalog_sync
+import config
+import db
+
+
+def edit_catalog(rows: list[dict], rnd: random.Random, changes: int) -> list[dict]:
+    rows = [dict(row) for row in rows]
+    for row in rnd.sample(rows, changes):
+        row["name"] += " (2nd edition)"
+    # move books to other categories and shuffle some within theirs
+    categories = sorted({row["category"] for row in rows})
+    for row in rnd.sample(rows, changes):
+        row["category"] = rnd.choice(categories)
+    for index in rnd.sample(range(len(rows) - 1), changes):
+        rows[index], rows[index + 1] = rows[index + 1], rows[index]
+    rows.extend({"category": rnd.choice(categories), "name": f"New book {index}"}
+                for index in range(changes))
+    rows.extend({"category": "New category", "name": f"Newer book {index}"}
+                for index in range(10))
+    # the file lists categories in reverse and books grouped by category
+    order = {name: index for index, name in enumerate(reversed(categories))}
+    order["New category"] = len(order)
+    rows.sort(key=lambda row: order[row["category"]])
+    return rows
+
+
+def write_catalog(path: str, rows: list[dict]) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, catalog_sync.FILE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+async def check_catalog(expected_ids: set[int]) -> dict:
+    ids = {row[0] for row in await db.fetchall_tuples("select id from book")}
+    violations = await db.fetchall_tuples("pragma foreign_key_check")
+    duplicates = await db.fetchall_tuples("""
+        select category_id, ordering from book
+        group by category_id, ordering having count(*) > 1""")
+    return {
+        "ids_kept": expected_ids <= ids,
+        "foreign_key_violations": len(violations),
+        "duplicate_orderings": len(duplicates),
+    }
+
+
+async def get_catalog_version() -> int:
+    row = await db.fetchone("select version from catalog_version")
+    return row["version"]
+
+
+async def measure_sync(name: str, path: str, expected_ids: set[int]) -> dict:
+    version = await get_catalog_version()
+    started = time.perf_counter()
+    result = await catalog_sync.sync(catalog_sync.read_catalog_file(path))
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "seconds": elapsed,
+        "version_bumped": await get_catalog_version() != version,
+        **vars(result),
+        **await check_catalog(expected_ids),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rnd = random.Random(1)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.sqlite3")
+        generate(path, categories=max(1, args.books // 50), books=args.books,
+                 users=10, votings=1)
+        config.SQLITE_DB_FILE = path
+        await db.connect()
+        try:
+            export_path = os.path.join(directory, f"catalog.{args.format}")
+            started = time.perf_counter()
+            await catalog_sync.export(export_path)
+            results.append({"name": "export", "seconds": time.perf_counter() - started})
+            rows = list(catalog_sync.read_catalog_file(export_path))
+            ids = {int(row["id"]) for row in rows}
+            results.append(await measure_sync("unchanged", export_path, ids))
+
+            edited_path = os.path.join(directory, "edited.csv")
+            write_catalog(edited_path, edit_catalog(rows, rnd, args.changes))
+            results.append(await measure_sync("edited", edited_path, ids))
+            results.append(await measure_sync("edited_again", edited_path, ids))
+        finally:
+            await db.close()
+    return {
+        "benchmark": "catalog_sync",
+        "books": args.books,
+        "changes": args.changes,
+        "format": args.format,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--changes", type=int, default=1000,
+                        help="books renamed, moved, swapped and added")
+    parser.add_argument("--format", default="csv", choices=("csv", "jsonl", "json", "yaml"),
+                        help="format of the exported catalog")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
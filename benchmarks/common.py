@@ -0,0 +1,83 @@
+import json
+import statistics
+import time
+from typing import Awaitable, Callable
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    """Update JSON as Telegram sends it for a private text message"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{
+            "type": "bot_command",
+            "offset": 0,
+            "length": len(text.split()[0]),
+        }]
+    return {"update_id": update_id, "message": message}
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """Update JSON for a press on an inline button of a bot message"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "bot"},
+                "text": "page",
+            },
+        },
+    }
+
+
+async def measure(name: str,
+                  func: Callable[[], Awaitable],
+                  repeat: int,
+                  before_each: Callable[[], None] | None = None) -> dict:
+    timings = []
+    for _ in range(repeat):
+        if before_each is not None:
+            before_each()
+        started = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - started)
+    return summarize(name, timings)
+
+
+def summarize(name: str, timings: list[float]) -> dict:
+    timings = sorted(timings)
+    return {
+        "name": name,
+        "calls": len(timings),
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": _percentile(timings, 0.5) * 1000,
+        "p95_ms": _percentile(timings, 0.95) * 1000,
+        "p99_ms": _percentile(timings, 0.99) * 1000,
+        "max_ms": timings[-1] * 1000,
+    }
+
+
+def write_results(results: dict, output: str | None) -> None:
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if output is None:
+        print(text)
+        return
+    with open(output, "w", encoding="utf-8") as file:
+        file.write(text)
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
@@ -0,0 +1,148 @@
+"""Check per-user update ordering and measure concurrent update throughput.
+
+    python -m benchmarks.concurrency bench.sqlite3 --users 200 --levels 1,8,32
+
+The ordering check pushes interleaved updates of many users through the
+update processor with random handler delays and reports whether every
+user's updates finished in arrival order, with PTB's SimpleUpdateProcessor
+as a baseline that does reorder them.
+
+The throughput run feeds "/allbooks", "/vote" and a ballot from every user
+into the real application talking to the fake Bot API with a round trip
+latency per message. A ballot only counts if "/vote" was handled before
+it, so accepted ballots must equal the number of users."""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor, SimpleUpdateProcessor
+
+from benchmarks.common import make_update, write_results
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.handlers import _disable_rate_limits
+import books
+import config
+from update_processor import OrderedUpdateProcessor
+from vote_writer import get_vote_writer_stats
+
+
+async def check_ordering(processor: BaseUpdateProcessor,
+                         users: int, updates_per_user: int) -> bool:
+    """Whether every user's updates finished in the order they arrived"""
+    rnd = random.Random(1)
+    finished: dict[int, list[int]] = {user_id: [] for user_id in range(1, users + 1)}
+    arrivals = [user_id for user_id in finished for _ in range(updates_per_user)]
+    rnd.shuffle(arrivals)
+    update_ids = itertools.count(1)
+
+    async def handle(user_id: int, sequence: int) -> None:
+        await asyncio.sleep(rnd.random() / 100)
+        finished[user_id].append(sequence)
+
+    sequences = {user_id: itertools.count() for user_id in finished}
+    tasks = []
+    async with processor:
+        for user_id in arrivals:
+            update = Update.de_json(make_update(next(update_ids), user_id, "x"), None)
+            # one task per update in arrival order, as Application does
+            tasks.append(asyncio.create_task(processor.process_update(
+                update, handle(user_id, next(sequences[user_id])))))
+        await asyncio.gather(*tasks)
+    return all(values == sorted(values) for values in finished.values())
+
+
+async def measure_throughput(port: int, users: int, concurrency: int,
+                             user_ids: itertools.count) -> dict:
+    import main
+
+    application = main.build_application(
+        "123456:fake", f"http://127.0.0.1:{port}/bot", concurrency)
+    catalog = await books.get_catalog()
+    numbers = ", ".join(map(str, range(1, config.VOTE_ELEMENTS_COUNT + 1)))
+    if len(catalog.books_by_number) < config.VOTE_ELEMENTS_COUNT:
+        numbers = ""
+    update_ids = itertools.count(1)
+    ballots_before = get_vote_writer_stats().ballots
+    await application.initialize()
+    await application.start()
+    try:
+        session_users = [next(user_ids) for _ in range(users)]
+        started = time.perf_counter()
+        for text in ("/allbooks", "/vote", numbers):
+            for user_id in session_users:
+                await application.update_queue.put(Update.de_json(
+                    make_update(next(update_ids), user_id, text), application.bot))
+        await application.update_queue.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+    updates = users * 3
+    return {
+        "concurrency": concurrency,
+        "updates": updates,
+        "elapsed_seconds": elapsed,
+        "updates_per_second": updates / elapsed,
+        "ballots_accepted": get_vote_writer_stats().ballots - ballots_before,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    ordering = {
+        "ordered_update_processor": await check_ordering(
+            OrderedUpdateProcessor(args.levels[-1]), args.users, 5),
+        "simple_update_processor": await check_ordering(
+            SimpleUpdateProcessor(args.levels[-1]), args.users, 5),
+    }
+
+    config.SQLITE_DB_FILE = args.db
+    config.ANNOUNCE_VOTINGS = False
+    _disable_rate_limits()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:fake")
+    import main
+
+    api = FakeBotApi(latency=args.latency)
+    await api.start("127.0.0.1", args.port)
+    await main.post_init(SimpleNamespace(job_queue=None, bot=None))
+    user_ids = itertools.count(10 ** 12)
+    results = []
+    try:
+        for concurrency in args.levels:
+            result = await measure_throughput(args.port, args.users, concurrency, user_ids)
+            result["ordered"] = result["ballots_accepted"] == args.users
+            results.append(result)
+    finally:
+        await main.post_shutdown(SimpleNamespace())
+        await api.stop()
+    return {
+        "benchmark": "concurrency",
+        "db": args.db,
+        "users": args.users,
+        "latency_seconds": args.latency,
+        "ordering": ordering,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--levels", default="1,8,32",
+                        type=lambda value: [int(level) for level in value.split(",")],
+                        help="comma separated update concurrency limits")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds the fake Bot API takes per message")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
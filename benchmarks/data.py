@@ -0,0 +1,96 @@
+"""Time the data functions of books.py and votings.py against a database.
+
+    python -m benchmarks.generate bench.sqlite3
+    python -m benchmarks.data bench.sqlite3 --output data.json
+
+"cold" runs drop the in-memory caches before every call, "warm" runs
+measure the steady state."""
+import argparse
+import asyncio
+import random
+
+from benchmarks.common import measure, summarize, write_results
+import books
+import config
+import db
+import leaderboard
+import vote_writer
+import votings
+
+
+async def run(path: str, repeat: int, burst: int) -> dict:
+    config.SQLITE_DB_FILE = path
+    await db.connect()
+    try:
+        actual_voting = await votings.get_actual_voting()
+        catalog = await books.get_catalog()
+        numbers_count = len(catalog.books_by_number)
+        rnd = random.Random(1)
+
+        def random_books() -> list[books.Book]:
+            numbers = rnd.sample(range(1, numbers_count + 1), config.VOTE_ELEMENTS_COUNT)
+            return catalog.get_books_by_numbers(numbers)
+
+        def drop_tally() -> None:
+            leaderboard.discard(actual_voting.id)
+
+        results = []
+        for name, func in (
+                ("get_all_books", books.get_all_books),
+                ("get_not_started_books", books.get_not_started_books),
+                ("get_books_by_numbers", lambda: books.get_books_by_numbers(
+                    rnd.sample(range(1, numbers_count + 1), config.VOTE_ELEMENTS_COUNT)))):
+            results.append(await measure(
+                f"{name}/cold", func, repeat, books.invalidate_catalog))
+            results.append(await measure(f"{name}/warm", func, repeat))
+        for name, func in (
+                ("get_already_read_books", books.get_already_read_books),
+                ("get_now_reading_book", books.get_now_reading_book)):
+            results.append(await measure(name, func, repeat))
+        results.append(await measure(
+            "get_actual_voting/cold", votings.get_actual_voting, repeat,
+            votings.invalidate_actual_voting))
+        results.append(await measure(
+            "get_actual_voting/warm", votings.get_actual_voting, repeat))
+        results.append(await measure(
+            "get_leaders/cold", votings.get_leaders, max(1, repeat // 10), drop_tally))
+        results.append(await measure("get_leaders/warm", votings.get_leaders, repeat))
+
+        await leaderboard.get_tally(actual_voting.id)
+        user_ids = iter(range(10 ** 9, 10 ** 10))
+        results.append(await measure(
+            "save_vote/sequential",
+            lambda: votings.save_vote(next(user_ids), random_books(), actual_voting),
+            repeat))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(
+            votings.save_vote(next(user_ids), random_books(), actual_voting)
+            for _ in range(burst)))
+        elapsed = loop.time() - started
+        burst_result = summarize("save_vote/burst", [elapsed])
+        burst_result["ballots_per_second"] = burst / elapsed
+        results.append(burst_result)
+        return {
+            "benchmark": "data",
+            "db": path,
+            "books": len(catalog.books_by_id),
+            "results": results,
+        }
+    finally:
+        await vote_writer.stop()
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--burst", type=int, default=5000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args.db, args.repeat, args.burst)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Local stand-in for the Telegram Bot API, for load testing the bot.
+
+    python -m benchmarks.fake_bot_api --script updates.json
+    TELEGRAM_BOT_TOKEN=123456:fake TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot python main.py
+
+Serves getUpdates from pushed updates and accepts sendMessage and the
+other methods the bot calls, answering them like Telegram would."""
+import argparse
+import asyncio
+from dataclasses import dataclass
+import itertools
+import json
+import logging
+import time
+from typing import Callable
+from urllib.parse import parse_qsl
+
+from benchmarks.common import make_update
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ApiError:
+    code: int
+    description: str
+
+
+class FakeBotApi:
+    def __init__(self, latency: float = 0):
+        self.requests = 0
+        # seconds every sent or edited message takes, like a real round trip
+        self.latency = latency
+        # chats that blocked the bot, messages to them fail with 403
+        self.blocked: set[int] = set()
+        # called with (method, parameters) for every message the bot sends
+        self.on_message: Callable[[str, dict], None] | None = None
+        self._updates: list[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._server: asyncio.Server | None = None
+
+    def push_update(self, user_id: int, text: str) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append(make_update(update_id, user_id, text))
+        self._new_updates.set()
+        return update_id
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                result = await self._call(method, _parse_body(headers, body))
+                status = b"200 OK"
+                if isinstance(result, ApiError):
+                    status = str(result.code).encode() + b" Error"
+                    response = json.dumps({"ok": False, "error_code": result.code,
+                                           "description": result.description}).encode()
+                else:
+                    response = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 " + status + b"\r\n"
+                    b"Content-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(response)).encode() + b"\r\n\r\n"
+                    + response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _call(self, method: str, parameters: dict):
+        self.requests += 1
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "fake",
+                    "username": "fake_bot", "can_join_groups": True,
+                    "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "getUpdates":
+            return await self._get_updates(parameters)
+        if method in ("sendMessage", "editMessageText"):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            chat_id = int(parameters["chat_id"])
+            if chat_id in self.blocked:
+                return ApiError(403, "Forbidden: bot was blocked by the user")
+            if self.on_message is not None:
+                self.on_message(method, parameters)
+            return {
+                "message_id": int(parameters.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "text": parameters.get("text", ""),
+            }
+        if method in ("pinChatMessage", "unpinChatMessage") and self.on_message is not None:
+            self.on_message(method, parameters)
+        return True
+
+    async def _get_updates(self, parameters: dict) -> list[dict]:
+        offset = int(parameters.get("offset") or 0)
+        self._updates = [update for update in self._updates
+                         if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(),
+                                       float(parameters.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(parameters.get("limit") or 100)]
+
+
+def _parse_body(headers: dict, body: bytes) -> dict:
+    if not body:
+        return {}
+    if headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body)
+    return dict(parse_qsl(body.decode()))
+
+
+async def serve_script(host: str, port: int, script: str | None) -> None:
+    api = FakeBotApi()
+    await api.start(host, port)
+    if script:
+        with open(script, encoding="utf-8") as file:
+            for item in json.load(file):
+                api.push_update(item["user_id"], item["text"])
+    logger.info("Fake Bot API listening on http://%s:%s/bot", host, port)
+    await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--script",
+                        help='JSON list of {"user_id": ..., "text": ...} to serve')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve_script(args.host, args.port, args.script))
+
+
+if __name__ == "__main__":
+    main()
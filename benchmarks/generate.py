@@ -0,0 +1,101 @@
+"""Generate a synthetic book club database with the schema from db.sql.
+
+    python -m benchmarks.generate bench.sqlite3 --categories 200 --books 10000 --users 100000
+"""
+import argparse
+from datetime import timedelta
+import os
+from pathlib import Path
+import random
+import sqlite3
+
+import db
+
+
+SCHEMA_FILE = Path(__file__).parent.parent / "db.sql"
+
+
+def get_schema_statements() -> list[str]:
+    """create statements of db.sql, without the seed data"""
+    statements = SCHEMA_FILE.read_text(encoding="utf-8").split(";")
+    return [statement.strip() for statement in statements
+            if statement.strip().lower().startswith("create ")]
+
+
+def generate(path: str,
+             categories: int = 200,
+             books: int = 10000,
+             users: int = 100000,
+             votings: int = 3,
+             read_share: float = 0.1,
+             seed: int = 1) -> None:
+    rnd = random.Random(seed)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    connection = sqlite3.connect(path)
+    for statement in get_schema_statements():
+        connection.execute(statement)
+
+    connection.executemany(
+        "insert into book_category (id, name, ordering) values (?, ?, ?)",
+        ((category_id, f"Category {category_id}", category_id * 10)
+         for category_id in range(1, categories + 1)))
+
+    today = db.current_date()
+    read_count = int(books * read_share)
+    first_read_start = today - timedelta(days=30 * read_count)
+
+    def book_rows():
+        for book_id in range(1, books + 1):
+            category_id = (book_id - 1) % categories + 1
+            read_start = read_finish = None
+            if book_id <= read_count:
+                read_start = first_read_start + timedelta(days=30 * (book_id - 1))
+                read_finish = read_start + timedelta(days=30)
+            yield (book_id, f"Book {book_id} :: Author {rnd.randrange(books // 3 + 1)}",
+                   category_id, (book_id - 1) // categories + 1,
+                   read_start and read_start.isoformat(),
+                   read_finish and read_finish.isoformat())
+
+    connection.executemany(
+        """insert into book (id, name, category_id, ordering, read_start, read_finish)
+           values (?, ?, ?, ?, ?, ?)""",
+        book_rows())
+
+    connection.executemany(
+        "insert into bot_user (telegram_id) values (?)",
+        ((user_id,) for user_id in range(1, users + 1)))
+
+    # the last voting is the actual one, the others are finished
+    for voting_id in range(1, votings + 1):
+        start = today - timedelta(days=30 * (votings - voting_id) + 3)
+        connection.execute(
+            "insert into voting (id, voting_start, voting_finish) values (?, ?, ?)",
+            (voting_id, start.isoformat(), (start + timedelta(days=7)).isoformat()))
+        not_started = range(read_count + 1, books + 1)
+        connection.executemany(
+            """insert into vote (vote_id, user_id, first_book_id,
+                                 second_book_id, third_book_id)
+               values (?, ?, ?, ?, ?)""",
+            ((voting_id, user_id, *rnd.sample(not_started, 3))
+             for user_id in range(1, users + 1)))
+    connection.commit()
+    connection.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--votings", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, args.categories, args.books, args.users,
+             args.votings, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
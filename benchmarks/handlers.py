@@ -0,0 +1,148 @@
+"""Time every main.py handler end to end with a stub context.bot.
+
+    python -m benchmarks.handlers bench.sqlite3 --output handlers.json
+
+Also checks that "/vote", a ballot and "/voteresults" take no reader
+connection once the caches are warm, and exits with status 1 if they do.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+from types import SimpleNamespace
+
+from telegram import Update
+
+from benchmarks.common import (
+    make_callback_update,
+    make_update,
+    measure,
+    write_results
+)
+import books
+import config
+import db
+
+
+class StubBot:
+    """Accepts every request instantly and counts sent messages"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        self.sent += 1
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.sent += 1
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        pass
+
+
+async def count_steady_state_reads(context: SimpleNamespace, user_ids: itertools.count,
+                                   update_ids: itertools.count, numbers: str,
+                                   rounds: int = 5) -> int:
+    """Reader connections taken by "/vote", a ballot and "/voteresults"
+    of new users after one warm-up round"""
+    import main
+
+    async def vote_session() -> None:
+        user_id = next(user_ids)
+        for handler, text in ((main.vote, "/vote"),
+                              (main.vote_process, numbers),
+                              (main.vote_results, "/voteresults")):
+            update = Update.de_json(make_update(next(update_ids), user_id, text), context.bot)
+            await handler(update, context)
+
+    # the periodic catalog version check is not part of handling updates
+    check_interval, config.CATALOG_CHECK_INTERVAL = config.CATALOG_CHECK_INTERVAL, 10 ** 9
+    try:
+        await vote_session()
+        before = db.get_pool_stats()["reader"].acquired
+        for _ in range(rounds):
+            await vote_session()
+        return db.get_pool_stats()["reader"].acquired - before
+    finally:
+        config.CATALOG_CHECK_INTERVAL = check_interval
+
+
+def _disable_rate_limits() -> None:
+    config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = config.SEND_GROUP_RATE = 10 ** 9
+    config.SEND_CHAT_BURST = 10 ** 9
+
+
+async def run(path: str, repeat: int) -> dict:
+    config.SQLITE_DB_FILE = path
+    _disable_rate_limits()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    import main
+
+    config.ANNOUNCE_VOTINGS = False
+    bot = StubBot()
+    application = SimpleNamespace(job_queue=None, bot=bot)
+    await main.post_init(application)
+    context = SimpleNamespace(bot=bot)
+    update_ids = itertools.count(1)
+    user_ids = itertools.count(1)
+    catalog = await books.get_catalog()
+    numbers = ", ".join(map(str, range(1, config.VOTE_ELEMENTS_COUNT + 1)))
+    if len(catalog.books_by_number) < config.VOTE_ELEMENTS_COUNT:
+        numbers = ""
+
+    handlers = (
+        ("start", main.start, "/start"),
+        ("help", main.help, "/help"),
+        ("allbooks", main.all_books, "/allbooks"),
+        ("already", main.already, "/already"),
+        ("now", main.now, "/now"),
+        ("vote", main.vote, "/vote"),
+        ("vote_process/ballot", main.vote_process, numbers),
+        ("vote_process/chat", main.vote_process, "hello"),
+        ("voteresults", main.vote_results, "/voteresults"),
+        ("find", main.find, "/find книга"),
+        ("catalog_page", main.catalog_page, "page:allbooks:1"),
+    )
+    results = []
+    try:
+        for name, handler, text in handlers:
+            async def call(name=name, handler=handler, text=text):
+                user_id = next(user_ids)
+                if name == "vote_process/ballot":
+                    await main.vote_mode.enter(user_id)
+                if handler is main.catalog_page:
+                    update_json = make_callback_update(next(update_ids), user_id, text)
+                else:
+                    update_json = make_update(next(update_ids), user_id, text)
+                update = Update.de_json(update_json, bot)
+                context.args = text.split()[1:]
+                await handler(update, context)
+            results.append(await measure(name, call, repeat))
+        steady_state_reads = await count_steady_state_reads(
+            context, user_ids, update_ids, numbers)
+    finally:
+        await main.post_shutdown(application)
+    return {
+        "benchmark": "handlers",
+        "db": path,
+        "messages_sent": bot.sent,
+        "steady_state_reader_acquisitions": steady_state_reads,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    report = asyncio.run(run(args.db, args.repeat))
+    write_results(report, args.output)
+    if report["steady_state_reader_acquisitions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Count live results edits during bursts of votes.
+
+    python -m benchmarks.live_results bench.sqlite3 --users 300 --interval 1
+
+Runs the real application against the fake Bot API with one configured
+live results chat. Every user sends "/vote" and a ballot, spread over
+--duration seconds, then everybody sends the same ballot again, which
+must not change the standings. Reports how many messages the chat got
+compared with one /voteresults reply per ballot, the shortest gap
+between two edits, and whether the last edit shows the final standings."""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+
+from telegram import Update
+
+from benchmarks.common import make_update, write_results
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.handlers import _disable_rate_limits
+import books
+import config
+
+CHAT_ID = -1001
+
+
+async def vote_burst(application, user_ids: list[int], catalog: books.Catalog,
+                     duration: float, rnd: random.Random, update_ids: itertools.count,
+                     ballots: dict[int, str]) -> None:
+    for user_id in user_ids:
+        if user_id not in ballots:
+            # a few popular books, so the top changes often but not always
+            numbers = rnd.sample(range(1, min(30, len(catalog.books_by_number)) + 1),
+                                 config.VOTE_ELEMENTS_COUNT)
+            ballots[user_id] = ", ".join(map(str, numbers))
+        for text in ("/vote", ballots[user_id]):
+            await application.update_queue.put(Update.de_json(
+                make_update(next(update_ids), user_id, text), application.bot))
+        await asyncio.sleep(duration / len(user_ids))
+    await application.update_queue.join()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    config.SQLITE_DB_FILE = args.db
+    config.ANNOUNCE_VOTINGS = False
+    config.LIVE_RESULTS_CHAT_IDS = (CHAT_ID,)
+    config.LIVE_RESULTS_INTERVAL = args.interval
+    _disable_rate_limits()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:fake")
+    import live_results
+    import main
+    import responses
+    import votings
+
+    api = FakeBotApi(latency=args.latency)
+    calls: list[tuple[float, str, dict]] = []
+    api.on_message = lambda method, parameters: calls.append(
+        (time.monotonic(), method, parameters))
+    await api.start("127.0.0.1", args.port)
+    application = main.build_application(
+        "123456:fake", f"http://127.0.0.1:{args.port}/bot")
+    await application.initialize()
+    await application.start()
+    await main.post_init(application)
+    rnd = random.Random(1)
+    update_ids = itertools.count(1)
+    user_ids = [10 ** 12 + index for index in range(args.users)]
+    ballots: dict[int, str] = {}
+    phases = []
+    try:
+        catalog = await books.get_catalog()
+        for name in ("new_ballots", "same_ballots"):
+            before = len(calls)
+            stats_before = vars(live_results.get_live_results_stats()).copy()
+            await vote_burst(application, user_ids, catalog, args.duration, rnd,
+                             update_ids, ballots)
+            # the trailing refresh of the burst
+            await asyncio.sleep(args.interval + 0.5)
+            chat_calls = [call for call in calls[before:]
+                          if int(call[2]["chat_id"]) == CHAT_ID]
+            edits = [at for at, method, _ in chat_calls if method == "editMessageText"]
+            stats = vars(live_results.get_live_results_stats())
+            phases.append({
+                "name": name,
+                "ballots": len(user_ids),
+                "chat_messages": len(chat_calls),
+                "voteresults_messages": len(user_ids),
+                "edits": len(edits),
+                "min_edit_gap_seconds": min(
+                    (second - first for first, second in zip(edits, edits[1:])), default=None),
+                **{key: stats[key] - stats_before[key] for key in stats},
+            })
+        leaders = await votings.get_leaders()
+        last_text = next(parameters["text"] for _, method, parameters in reversed(calls)
+                         if int(parameters["chat_id"]) == CHAT_ID
+                         and method in ("sendMessage", "editMessageText"))
+        final_shown = last_text == responses.format_vote_results(leaders)
+        pins = sum(1 for _, method, _ in calls if method == "pinChatMessage")
+    finally:
+        await application.stop()
+        await main.post_shutdown(application)
+        await application.shutdown()
+        await api.stop()
+    return {
+        "benchmark": "live_results",
+        "db": args.db,
+        "users": args.users,
+        "interval_seconds": args.interval,
+        "duration_seconds": args.duration,
+        "pins": pins,
+        "final_standings_shown": final_shown,
+        "phases": phases,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db")
+    parser.add_argument("--port", type=int, default=8083)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="config.LIVE_RESULTS_INTERVAL for the run")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds over which each burst of ballots arrives")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="seconds the fake Bot API takes per message")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""End-to-end load test of the bot against the fake Bot API.
+
+    python -m benchmarks.load --spawn --users 5000 --rates 5,10,20,40
+
+Starts the fake Bot API, optionally the bot itself, and simulates users
+sending commands and ballots at increasing rates. For every rate it
+reports update -> first reply latency percentiles, and at the end the
+highest rate the bot sustained."""
+import argparse
+import asyncio
+from collections import deque
+import os
+from pathlib import Path
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.common import summarize, write_results
+from benchmarks.fake_bot_api import FakeBotApi
+
+
+SESSIONS = (
+    ("/allbooks",),
+    ("/now",),
+    ("/voteresults",),
+    ("/vote", "ballot"),
+)
+
+
+class LoadDriver:
+    def __init__(self, api: FakeBotApi, users: int, max_number: int,
+                 reply_timeout: float, settle: float):
+        self.api = api
+        self.max_number = max_number
+        self.reply_timeout = reply_timeout
+        self.settle = settle
+        user_ids = list(range(1, users + 1))
+        random.shuffle(user_ids)
+        self.idle_users = deque(user_ids)
+        self._waiting: dict[int, tuple[asyncio.Future, float]] = {}
+        api.on_message = self._on_message
+
+    async def run_step(self, rate: float, seconds: float) -> dict:
+        """Start user sessions at the given rate for the given time"""
+        latencies: dict[str, list[float]] = {}
+        lost = skipped = updates = 0
+        sessions = []
+
+        async def session(user_id: int, texts: tuple[str, ...]) -> None:
+            nonlocal lost, updates
+            for text in texts:
+                if text == "ballot":
+                    text = ", ".join(map(str, random.sample(range(1, self.max_number + 1), 3)))
+                    kind = "ballot"
+                else:
+                    kind = text
+                updates += 1
+                latency = await self._send(user_id, text)
+                if latency is None:
+                    lost += 1
+                    break
+                latencies.setdefault(kind, []).append(latency)
+                # let the rest of a multi-message reply arrive
+                await asyncio.sleep(self.settle)
+            self.idle_users.append(user_id)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for index in range(int(rate * seconds)):
+            await asyncio.sleep(max(0.0, started + index / rate - loop.time()))
+            if not self.idle_users:
+                skipped += 1
+                continue
+            sessions.append(asyncio.create_task(
+                session(self.idle_users.popleft(), random.choice(SESSIONS))))
+        await asyncio.gather(*sessions)
+        elapsed = loop.time() - started
+        all_latencies = [value for values in latencies.values() for value in values]
+        result = {
+            "sessions_per_second": rate,
+            "updates": updates,
+            "updates_per_second": updates / seconds,
+            "replied": len(all_latencies),
+            "lost": lost,
+            "skipped_sessions": skipped,
+            "elapsed_seconds": elapsed,
+            "bot_api_requests": self.api.requests,
+        }
+        if all_latencies:
+            result["latency"] = summarize("all", all_latencies)
+            result["latency_by_kind"] = [
+                summarize(kind, values) for kind, values in latencies.items()]
+        return result
+
+    async def _send(self, user_id: int, text: str) -> float | None:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[user_id] = (future, time.perf_counter())
+        self.api.push_update(user_id, text)
+        try:
+            return await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._waiting.pop(user_id, None)
+
+    def _on_message(self, method: str, parameters: dict) -> None:
+        if method != "sendMessage":
+            return
+        waiting = self._waiting.pop(int(parameters["chat_id"]), None)
+        if waiting is not None and not waiting[0].done():
+            waiting[0].set_result(time.perf_counter() - waiting[1])
+
+
+def is_sustained(step: dict, max_p95: float) -> bool:
+    return (step["updates"] > 0
+            and step["lost"] <= step["updates"] * 0.01
+            and step["skipped_sessions"] == 0
+            and step["latency"]["p95_ms"] <= max_p95 * 1000)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    api = FakeBotApi()
+    await api.start("127.0.0.1", args.port)
+    bot = None
+    if args.spawn:
+        env = dict(os.environ,
+                   TELEGRAM_BOT_TOKEN="123456:fake",
+                   TELEGRAM_BASE_URL=f"http://127.0.0.1:{args.port}/bot")
+        bot = subprocess.Popen([sys.executable, "main.py"], env=env,
+                               cwd=Path(__file__).parent.parent)
+        await asyncio.sleep(args.startup)
+    driver = LoadDriver(api, args.users, args.max_number,
+                        args.reply_timeout, args.settle)
+    steps = []
+    try:
+        for rate in map(float, args.rates.split(",")):
+            step = await driver.run_step(rate, args.step_seconds)
+            step["sustained"] = is_sustained(step, args.max_p95)
+            steps.append(step)
+            print(f"{rate:g} sessions/s: {step['updates_per_second']:.1f} updates/s, "
+                  f"lost {step['lost']}, sustained {step['sustained']}", file=sys.stderr)
+    finally:
+        if bot is not None:
+            bot.terminate()
+            bot.wait()
+        await api.stop()
+    sustained = [step["updates_per_second"] for step in steps if step["sustained"]]
+    return {
+        "benchmark": "load",
+        "users": args.users,
+        "max_sustained_updates_per_second": max(sustained, default=0),
+        "steps": steps,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--spawn", action="store_true",
+                        help="start main.py against the fake Bot API")
+    parser.add_argument("--startup", type=float, default=5,
+                        help="seconds to wait for the spawned bot")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--rates", default="5,10,20,40",
+                        help="comma separated user sessions per second")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--max-number", type=int, default=50,
+                        help="highest book number used in ballots")
+    parser.add_argument("--reply-timeout", type=float, default=10)
+    parser.add_argument("--settle", type=float, default=1)
+    parser.add_argument("--max-p95", type=float, default=2,
+                        help="p95 latency in seconds a sustained rate must stay under")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Per-row cost and memory of loading the catalog into Book objects.
+
+    python -m benchmarks.models --sizes 10000,100000
+
+Generates a database per catalog size and loads every book with the
+current slotted models and with the previous ones (plain dataclasses
+built from named row access, dates reformatted with strptime on every
+row), which are kept here as the baseline."""
+import argparse
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import summarize, write_results
+from benchmarks.generate import generate
+import books
+import config
+import db
+from storage import get_storage
+
+
+@dataclass
+class LegacyBook:
+    id: int
+    name: str
+    category_id: int
+    category_name: str
+    read_start: str | None
+    read_finish: str | None
+
+    def __post_init__(self):
+        for field in ("read_start", "read_finish"):
+            value = getattr(self, field)
+            if value is None: continue
+            value = datetime.strptime(value, "%Y-%m-%d").strftime(config.DATE_FORMAT)
+            setattr(self, field, value)
+
+
+_LEGACY_BOOKS_SQL = """
+    select b.id as book_id, b.name as book_name,
+           bc.id as category_id, bc.name as category_name,
+           b.read_start, b.read_finish
+    from book b
+      left join book_category bc on b.category_id = bc.id
+    order by bc.ordering, b.ordering"""
+
+async def load_legacy() -> list[LegacyBook]:
+    return [LegacyBook(
+        id=row["book_id"],
+        name=row["book_name"],
+        category_id=row["category_id"],
+        category_name=row["category_name"],
+        read_start=row["read_start"],
+        read_finish=row["read_finish"]
+    ) for row in await db.fetchall(_LEGACY_BOOKS_SQL)]
+
+
+async def load_current() -> list[books.Book]:
+    return [books.Book(*row) for row in await get_storage().get_books()]
+
+
+async def measure_loader(name: str, loader, size: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await loader()
+        timings.append(time.perf_counter() - started)
+    result = summarize(name, timings)
+    result["per_row_us"] = result["p50_ms"] * 1000 / size
+    tracemalloc.start()
+    loaded = await loader()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["retained_bytes_per_row"] = retained / size
+    result["peak_bytes_per_row"] = peak / size
+    started = time.perf_counter()
+    for book in loaded:
+        book.read_start, book.read_finish
+    result["display_dates_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def run(args: argparse.Namespace) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = os.path.join(directory, f"models-{size}.sqlite3")
+            generate(path, categories=max(1, size // 50), books=size, users=10,
+                     votings=1, read_share=args.read_share)
+            config.SQLITE_DB_FILE = path
+            await db.connect()
+            try:
+                for name, loader in (("legacy", load_legacy), ("current", load_current)):
+                    result = await measure_loader(
+                        f"{name}/{size}", loader, size, args.repeat)
+                    result["books"] = size
+                    results.append(result)
+                started = time.perf_counter()
+                await books._load_catalog(0)
+                results.append(summarize(
+                    f"load_catalog/{size}", [time.perf_counter() - started]))
+            finally:
+                await db.close()
+    return {
+        "benchmark": "models",
+        "read_share": args.read_share,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000",
+                        type=lambda value: [int(size) for size in value.split(",")])
+    parser.add_argument("--read-share", type=float, default=0.1,
+                        help="share of books with read dates")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Check both storage backends against one contract and time them alike.
+
+    python -m benchmarks.storage --backends sqlite
+    python -m benchmarks.storage --backends sqlite,postgres --dsn postgresql://localhost/bench
+
+Generates a database with benchmarks.generate and, for postgres, copies it
+into the database behind --dsn, wiping the storage tables there first.
+Every backend then has to return exactly what the generated data implies,
+computed here in plain Python, and to save, replace and roll back ballots
+the same way, and to freeze and replace voting snapshots. The timings run the same calls against every backend."""
+import argparse
+import asyncio
+from datetime import date, datetime, timezone
+import os
+import sqlite3
+import tempfile
+
+from benchmarks.common import measure, write_results
+from benchmarks.generate import generate
+import books
+import config
+from dates import to_day
+import db
+import storage
+
+
+_COPIED_COLUMNS = {
+    "bot_user": ("telegram_id",),
+    "book_category": ("id", "name", "ordering"),
+    "book": ("id", "name", "category_id", "ordering",
+             "read_start", "read_finish", "read_comments"),
+    "voting": ("id", "voting_start", "voting_finish"),
+    "vote": ("vote_id", "user_id", "first_book_id", "second_book_id", "third_book_id"),
+}
+_DATE_COLUMNS = {"read_start", "read_finish", "voting_start", "voting_finish"}
+
+
+class Reference:
+    """What every backend must return, read from the generated sqlite file"""
+
+    def __init__(self, path: str):
+        connection = sqlite3.connect(path)
+        self.books = [
+            (book_id, name, category_id, category_name, to_day(start), to_day(finish))
+            for book_id, name, category_id, category_name, start, finish in connection.execute("""
+                select b.id, b.name, bc.id, bc.name, b.read_start, b.read_finish
+                from book b left join book_category bc on bc.id = b.category_id
+                order by bc.ordering, b.ordering""")]
+        self.votings = [
+            (voting_id, date.fromisoformat(start), date.fromisoformat(finish))
+            for voting_id, start, finish in connection.execute(
+                "select id, voting_start, voting_finish from voting order by voting_start")]
+        self.tables = {
+            table: (columns, connection.execute(
+                f"select {', '.join(columns)} from {table}").fetchall())
+            for table, columns in _COPIED_COLUMNS.items()}
+        self.votes = self.tables["vote"][1]
+        connection.close()
+
+    def read_books(self, today: date, now: bool) -> list[tuple]:
+        day = today.toordinal()
+        if now:
+            rows = [row for row in self.books
+                    if row[4] is not None and row[4] <= day and row[5] >= day]
+        else:
+            rows = [row for row in self.books
+                    if row[4] is not None and row[4] < day and row[5] <= day]
+        return sorted(rows, key=lambda row: row[4])
+
+    def get_ballots(self, voting_id: int) -> set[tuple]:
+        return {tuple(row[1:]) for row in self.votes if row[0] == voting_id}
+
+
+async def copy_to_postgres(reference: Reference, dsn: str) -> None:
+    import asyncpg
+    from storage_postgres import SCHEMA_FILE
+
+    connection = await asyncpg.connect(dsn)
+    try:
+        await connection.execute("drop table if exists voting_snapshot_book, voting_snapshot, "
+                                 f"{', '.join(reversed(_COPIED_COLUMNS))}, "
+                                 "catalog_version cascade")
+        await connection.execute(SCHEMA_FILE.read_text(encoding="utf-8"))
+        for table, (columns, rows) in reference.tables.items():
+            await connection.copy_records_to_table(table, columns=columns, records=[
+                tuple(date.fromisoformat(value) if column in _DATE_COLUMNS and value else value
+                      for column, value in zip(columns, row))
+                for row in rows])
+        await connection.execute("analyze")
+    finally:
+        await connection.close()
+
+
+async def check_contract(backend: storage.Storage, reference: Reference) -> dict[str, bool]:
+    today = db.current_date()
+    actual = next((voting for voting in reference.votings
+                   if voting[1] <= today <= voting[2]), None)
+    next_start = min((voting[1] for voting in reference.votings if voting[1] > today),
+                     default=None)
+    voting_id = actual[0]
+    checks = {
+        "catalog_version": isinstance(await backend.get_catalog_version(), int),
+        "books": await backend.get_books() == reference.books,
+        "already_read_books": (await backend.get_already_read_books(today)
+                               == reference.read_books(today, now=False)),
+        "now_reading_books": (await backend.get_now_reading_books(today)
+                              == reference.read_books(today, now=True)),
+        "actual_voting": await backend.get_actual_voting(today) == actual,
+        "no_voting": await backend.get_actual_voting(date(1970, 1, 1)) is None,
+        "next_voting_start": await backend.get_next_voting_start(today) == next_start,
+        "ballots": set(await backend.get_ballots(voting_id)) == reference.get_ballots(voting_id),
+    }
+
+    wanted = reference.books[len(reference.books) // 2]
+    title = wanted[1].split(" :: ")[0]
+    found = await backend.search_books(books._get_trigrams(title), config.SEARCH_CANDIDATES)
+    checks["search_books"] = any(book_id == wanted[0] for book_id, _, _ in found)
+
+    scores: dict[int, int] = {}
+    for _, *book_ids in reference.get_ballots(voting_id):
+        for book_id, weight in zip(book_ids, config.VOTE_WEIGHTS):
+            scores[book_id] = scores.get(book_id, 0) + weight
+    checks["scores"] = await backend.get_scores(voting_id, config.VOTE_WEIGHTS) == scores
+
+    # a new user votes, then changes the ballot
+    user_id = max(row[0] for row in reference.tables["bot_user"][1]) + 1
+    not_started = [row[0] for row in reference.books if row[4] is None]
+    calls = []
+    await backend.save_ballots([(voting_id, user_id, tuple(not_started[:3]))],
+                               lambda: calls.append(1))
+    await backend.save_ballots([(voting_id, user_id, tuple(not_started[3:6]))],
+                               lambda: calls.append(1))
+    ballots = [row for row in await backend.get_ballots(voting_id) if row[0] == user_id]
+    checks["save_ballots"] = calls == [1, 1] and ballots == [(user_id, *not_started[3:6])]
+
+    # the later of two ballots of one user in a batch wins
+    await backend.save_ballots([(voting_id, user_id, tuple(not_started[:3])),
+                                (voting_id, user_id, tuple(not_started[6:9]))])
+    ballots = [row for row in await backend.get_ballots(voting_id) if row[0] == user_id]
+    checks["save_ballots_same_user"] = ballots == [(user_id, *not_started[6:9])]
+
+    # a ballot for a missing book rolls back the whole batch
+    try:
+        await backend.save_ballots([(voting_id, user_id + 1, tuple(not_started[:3])),
+                                    (voting_id, user_id + 2, (0, 0, 0))],
+                                   lambda: calls.append(1))
+        rolled_back = False
+    except Exception:
+        rolled_back = not any(row[0] in (user_id + 1, user_id + 2)
+                              for row in await backend.get_ballots(voting_id))
+    checks["save_ballots_rollback"] = rolled_back and len(calls) == 2
+
+    # the oldest finished voting is frozen, then frozen again with new results
+    finished = [voting for voting in reference.votings if voting[2] < today]
+    checks["unfrozen_votings"] = (await backend.get_unfrozen_votings(today)
+                                  == sorted(voting[0] for voting in finished))
+    frozen = finished[0]
+    first, second = reference.books[:2]
+    await backend.save_snapshot(frozen[0], "plurality", 1, datetime.now(timezone.utc),
+                                [(1, first[0], first[1], 1)])
+    await backend.save_snapshot(frozen[0], "borda", 2, datetime.now(timezone.utc),
+                                [(1, second[0], second[1], 5), (2, first[0], None, 3)])
+    snapshot = [(*frozen, 1, second[1], 5), (*frozen, 2, None, 3)]
+    checks["snapshot"] = (await backend.get_snapshot(frozen[0]) == snapshot
+                          and await backend.get_snapshot(actual[0]) == []
+                          and await backend.get_snapshots(1) == snapshot)
+    checks["frozen_voting"] = frozen[0] not in await backend.get_unfrozen_votings(today)
+    await backend.save_users([user_id, user_id + 3])
+    return checks
+
+
+async def measure_backend(backend: storage.Storage, reference: Reference,
+                          repeat: int, batches: int) -> list[dict]:
+    today = db.current_date()
+    voting_id = reference.votings[-1][0]
+    not_started = [row[0] for row in reference.books if row[4] is None]
+    user_ids = iter(range(10 ** 12, 10 ** 13))
+
+    async def save_batch():
+        await backend.save_ballots([
+            (voting_id, next(user_ids), tuple(not_started[index:index + 3]))
+            for index in range(config.VOTE_BATCH_SIZE)])
+
+    trigrams = books._get_trigrams("Book 12")
+    calls = [
+        ("get_catalog_version", backend.get_catalog_version, repeat),
+        ("get_books", backend.get_books, max(1, repeat // 10)),
+        ("get_now_reading_books", lambda: backend.get_now_reading_books(today), repeat),
+        ("get_actual_voting", lambda: backend.get_actual_voting(today), repeat),
+        ("search_books", lambda: backend.search_books(trigrams, config.SEARCH_CANDIDATES), repeat),
+        ("save_ballots", save_batch, batches),
+        ("get_ballots", lambda: backend.get_ballots(voting_id), max(1, repeat // 10)),
+        ("get_scores", lambda: backend.get_scores(voting_id, config.VOTE_WEIGHTS),
+         max(1, repeat // 10)),
+    ]
+    return [await measure(name, func, count) for name, func, count in calls]
+
+
+async def run(args: argparse.Namespace) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "storage.sqlite3")
+        generate(path, categories=max(1, args.books // 50), books=args.books,
+                 users=args.users, votings=3)
+        config.SQLITE_DB_FILE = path
+        # migrations add the columns the storage expects
+        await db.connect()
+        await db.close()
+        reference = Reference(path)
+        for name in args.backends:
+            config.STORAGE_BACKEND = name
+            if name == "postgres":
+                config.POSTGRES_DSN = args.dsn
+                await copy_to_postgres(reference, args.dsn)
+            storage._storage = None
+            backend = storage.get_storage()
+            await backend.connect()
+            try:
+                checks = await check_contract(backend, reference)
+                timings = await measure_backend(backend, reference, args.repeat, args.batches)
+            finally:
+                await backend.close()
+            results[name] = {
+                "contract_passed": all(checks.values()),
+                "contract": checks,
+                "timings": timings,
+            }
+    return {
+        "benchmark": "storage",
+        "books": args.books,
+        "users": args.users,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="sqlite",
+                        type=lambda value: value.split(","),
+                        help="comma separated: sqlite, postgres")
+    parser.add_argument("--dsn", default=config.POSTGRES_DSN)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--batches", type=int, default=20,
+                        help="ballot batches of config.VOTE_BATCH_SIZE to save")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
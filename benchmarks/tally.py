@@ -0,0 +1,141 @@
+"""Time the tally rules on synthetic ballots and check them against SQL.
+
+    python -m benchmarks.tally --ballots 1000000 --books 500 --ranks 5
+    python -m benchmarks.tally --db bench.sqlite3
+
+Synthetic ballots prefer low book numbers, like real votings prefer a
+few popular books. With --db the Borda count of the actual voting is
+also compared with the scores the vote table aggregates to in SQL, and
+so is the in-memory leaderboard after ballots of new and returning
+users are saved through the vote writer. The exit status is 1 if any
+of them differs."""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import measure, summarize, write_results
+import config
+import books
+import db
+import leaderboard
+from storage import get_storage
+import tally
+import vote_writer
+import votings
+
+
+def make_ballots(count: int, books: int, ranks: int, seed: int = 1) -> tally.Ballots:
+    rnd = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, books + 1)
+    draws = rnd.choice(books, size=(count, ranks * 3), p=popularity / popularity.sum()) + 1
+    # drop repeated books and keep the first distinct ones, short ballots
+    # are padded with empty ranks
+    repeated = np.zeros(draws.shape, dtype=bool)
+    for column in range(1, draws.shape[1]):
+        repeated[:, column] = (draws[:, :column] == draws[:, column:column + 1]).any(axis=1)
+    draws[repeated] = -1
+    order = np.argsort(repeated, axis=1, kind="stable")
+    return tally.Ballots.from_rows(np.take_along_axis(draws, order, axis=1)[:, :ranks])
+
+
+async def compare_with_sql(path: str) -> dict:
+    config.SQLITE_DB_FILE = path
+    await db.connect()
+    try:
+        actual_voting = await votings.get_actual_voting()
+        if actual_voting is None:
+            return {"db": path, "error": "no actual voting"}
+        started = time.perf_counter()
+        expected = await get_storage().get_scores(actual_voting.id, config.VOTE_WEIGHTS)
+        sql_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        ballots = await tally.load_ballots(actual_voting.id)
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        scores = dict(tally.borda(ballots))
+        borda_seconds = time.perf_counter() - started
+        return {
+            "db": path,
+            "ballots": len(ballots.ranks),
+            "matches_sql": scores == expected,
+            "leaderboard_matches_sql": await check_leaderboard(actual_voting),
+            "results": [
+                summarize("sql_scores", [sql_seconds]),
+                summarize("load_ballots", [load_seconds]),
+                summarize("borda", [borda_seconds]),
+            ],
+        }
+    finally:
+        await db.close()
+
+
+async def check_leaderboard(actual_voting: votings.Voting, count: int = 200) -> bool:
+    """Save ballots of new and returning users on top of a loaded tally,
+    then compare the tally with the vote table"""
+    loaded = await leaderboard.get_tally(actual_voting.id)
+    catalog = await books.get_catalog()
+    rnd = random.Random(1)
+    returning = list(loaded.ballots)[:count // 2]
+    new = [-user_id for user_id in range(1, count // 2 + 1)]
+    try:
+        await asyncio.gather(*(
+            votings.save_vote(user_id, rnd.sample(catalog.books_by_number,
+                                                  config.VOTE_ELEMENTS_COUNT), actual_voting)
+            for user_id in returning + new))
+    finally:
+        await vote_writer.stop()
+    return await leaderboard.verify(actual_voting.id)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    started = time.perf_counter()
+    ballots = make_ballots(args.ballots, args.books, args.ranks)
+    results = [summarize("make_ballots", [time.perf_counter() - started])]
+    weights = tuple(range(args.ranks, 0, -1))
+
+    async def count(rule) -> None:
+        rule()
+
+    rules = {
+        "borda": lambda: tally.borda(ballots, weights),
+        "plurality": lambda: tally.plurality(ballots),
+        "instant_runoff": lambda: tally.instant_runoff(ballots),
+        "schulze": lambda: tally.schulze(ballots),
+    }
+    for name, rule in rules.items():
+        results.append(await measure(name, lambda: count(rule), args.repeat))
+    report = {
+        "benchmark": "tally",
+        "ballots": args.ballots,
+        "books": args.books,
+        "ranks": args.ranks,
+        "results": results,
+    }
+    if args.db:
+        report["sql"] = await compare_with_sql(args.db)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, default=1_000_000)
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--ranks", type=int, default=config.VOTE_ELEMENTS_COUNT)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="database to compare the Borda count with")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    write_results(report, args.output)
+    sql = report.get("sql", {})
+    if sql.get("matches_sql") is False or sql.get("leaderboard_matches_sql") is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""POST recorded updates to a webhook and measure accepted updates/sec.
+
+    python -m benchmarks.webhook --serve
+    python -m benchmarks.webhook --url http://127.0.0.1:8443/telegram --secret ...
+
+With --serve the benchmark starts the same webhook server the bot uses in
+webhook mode, with updates drained from its queue instead of handled, so it
+measures decoding and accepting updates only."""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import httpx
+
+from benchmarks.common import make_update
+import config
+
+
+def make_updates(count: int, users: int = 1000) -> list[dict]:
+    texts = ("/allbooks", "/vote", "3, 1, 5", "/voteresults", "hello")
+    return [
+        make_update(update_id, update_id % users + 1, text)
+        for update_id, text in zip(range(1, count + 1), itertools.cycle(texts))
+    ]
+
+
+async def post_updates(url: str,
+                       secret: str | None,
+                       updates: list[dict],
+                       concurrency: int) -> dict:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    bodies = [json.dumps(update).encode() for update in updates]
+    next_body = iter(bodies)
+    failed = 0
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal failed
+        for body in next_body:
+            response = await client.post(url, content=body, headers=headers)
+            if response.status_code != 200:
+                failed += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {
+        "benchmark": "webhook",
+        "updates": len(bodies),
+        "failed": failed,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "updates_per_second": len(bodies) / elapsed,
+    }
+
+
+async def serve_and_post(args: argparse.Namespace, updates: list[dict]) -> dict:
+    from telegram import Bot
+    from telegram.ext._utils.webhookhandler import WebhookAppClass, WebhookServer
+
+    update_queue = asyncio.Queue()
+    secret = args.secret or "benchmark-secret"
+    app = WebhookAppClass("/" + config.WEBHOOK_PATH,
+                          Bot("123456:benchmark"), update_queue, secret)
+    server = WebhookServer("127.0.0.1", args.port, app, None, None)
+    ready = asyncio.Event()
+    serving = asyncio.create_task(server.serve_forever(ready=ready))
+    await ready.wait()
+
+    async def drain() -> None:
+        while True:
+            await update_queue.get()
+
+    draining = asyncio.create_task(drain())
+    try:
+        return await post_updates(
+            f"http://127.0.0.1:{args.port}/{config.WEBHOOK_PATH}",
+            secret, updates, args.concurrency)
+    finally:
+        draining.cancel()
+        await server.shutdown()
+        await serving
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="webhook url of a running bot")
+    parser.add_argument("--secret", help="value of TELEGRAM_WEBHOOK_SECRET")
+    parser.add_argument("--serve", action="store_true",
+                        help="start a local webhook server to post to")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--updates", help="JSON file with a list of updates")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=config.WEBHOOK_MAX_CONNECTIONS)
+    args = parser.parse_args()
+    if args.updates:
+        with open(args.updates, encoding="utf-8") as file:
+            updates = json.load(file)
+    else:
+        updates = make_updates(args.count)
+    if args.serve:
+        result = asyncio.run(serve_and_post(args, updates))
+    elif args.url:
+        result = asyncio.run(post_updates(args.url, args.secret, updates, args.concurrency))
+    else:
+        parser.error("pass --url or --serve")
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Measure how update throughput scales with the number of worker processes.
+
+    python -m benchmarks.workers bench.sqlite3 --users 1000 --workers 1,2,4
+
+For every worker count, starts the dispatcher, the workers and the writer
+process against the fake Bot API and pushes "/allbooks", "/vote", a
+ballot and "/voteresults" from every user through getUpdates. Reports
+updates/sec from the first pushed update to the last reply. A ballot only
+counts if "/vote" was handled before it, so accepted ballots must equal
+the number of users. Afterwards one user per worker asks for
+/voteresults, every worker's tally must match the vote table."""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+
+import telegram
+
+from benchmarks.common import write_results
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.handlers import _disable_rate_limits
+import books
+import config
+import leaderboard
+import storage
+import votings
+from workers import Dispatcher
+
+
+TOKEN = "123456:fake"
+
+
+async def wait_quiet(replies: list[float], quiet: float) -> None:
+    """Wait until no reply came for quiet seconds"""
+    while True:
+        idle = time.monotonic() - (replies[-1] if replies else 0)
+        if replies and idle >= quiet:
+            return
+        await asyncio.sleep(quiet / 4)
+
+
+async def wait_answered(texts: dict[int, list[str]], user_ids: list[int],
+                        replies: list[float], quiet: float) -> None:
+    """Wait until every user got a reply, or none came for quiet seconds
+    since now"""
+    pushed = time.monotonic()
+    while not all(user_id in texts for user_id in user_ids):
+        if time.monotonic() - max(pushed, replies[-1]) >= quiet:
+            return
+        await asyncio.sleep(quiet / 4)
+
+
+async def measure(api: FakeBotApi, base_url: str, workers: int, users: int,
+                  user_ids: itertools.count, catalog: books.Catalog,
+                  quiet: float) -> dict:
+    # not on top: spawned processes import this module before taking the
+    # dispatcher's config, and sender sizes its rate limits on import
+    import responses
+
+    replies: list[float] = []
+    texts: dict[int, list[str]] = {}
+
+    def on_message(method: str, parameters: dict) -> None:
+        replies.append(time.monotonic())
+        texts.setdefault(int(parameters["chat_id"]), []).append(parameters["text"])
+
+    api.on_message = on_message
+    dispatcher = Dispatcher(TOKEN, base_url, workers)
+    await dispatcher.start()
+    bot = telegram.Bot(TOKEN, base_url=base_url)
+    polling = asyncio.create_task(dispatcher.poll(bot))
+    rnd = random.Random(workers)
+    try:
+        session_users = [next(user_ids) for _ in range(users)]
+        started = time.monotonic()
+        for user_id in session_users:
+            numbers = rnd.sample(range(1, len(catalog.books_by_number) + 1),
+                                 config.VOTE_ELEMENTS_COUNT)
+            for text in ("/allbooks", "/vote", ", ".join(map(str, numbers)), "/voteresults"):
+                api.push_update(user_id, text)
+        await wait_quiet(replies, quiet)
+        elapsed = replies[-1] - started
+        accepted = sum(1 for user_id in session_users
+                       if any(text.startswith("Ура") for text in texts.get(user_id, ())))
+
+        # user ids next to each other are handled by different workers
+        checkers = [next(user_ids) for _ in range(workers)]
+        for user_id in checkers:
+            api.push_update(user_id, "/voteresults")
+        await wait_answered(texts, checkers, replies, quiet)
+        leaderboard.discard((await votings.get_actual_voting()).id)
+        expected = responses.format_vote_results(await votings.get_leaders())
+        consistent = all(texts.get(user_id) == [expected] for user_id in checkers)
+    finally:
+        polling.cancel()
+        try:
+            await polling
+        except asyncio.CancelledError:
+            pass
+        await bot.shutdown()
+        await dispatcher.stop()
+    updates = users * 4
+    return {
+        "workers": workers,
+        "updates": updates,
+        "replies": len(replies),
+        "elapsed_seconds": elapsed,
+        "updates_per_second": updates / elapsed,
+        "ballots_accepted": accepted,
+        "ordered": accepted == users,
+        "tallies_consistent": consistent,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    config.SQLITE_DB_FILE = args.db
+    config.ANNOUNCE_VOTINGS = False
+    config.METRICS_PORT = None
+    _disable_rate_limits()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", TOKEN)
+
+    api = FakeBotApi(latency=args.latency)
+    await api.start("127.0.0.1", args.port)
+    await storage.connect()
+    results = []
+    try:
+        if await votings.get_actual_voting() is None:
+            raise SystemExit("the database has no voting going on today")
+        catalog = await books.get_catalog()
+        user_ids = itertools.count(10 ** 12 + int(time.time()) * 10 ** 4)
+        for workers in args.workers:
+            results.append(await measure(
+                api, f"http://127.0.0.1:{args.port}/bot", workers, args.users,
+                user_ids, catalog, args.quiet))
+    finally:
+        await storage.close()
+        await api.stop()
+    single = results[0]["updates_per_second"]
+    for result in results:
+        result["speedup"] = result["updates_per_second"] / single
+    return {
+        "benchmark": "workers",
+        "db": args.db,
+        "users": args.users,
+        "latency_seconds": args.latency,
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db")
+    parser.add_argument("--port", type=int, default=8084)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", default="1,2,4",
+                        type=lambda value: [int(count) for count in value.split(",")])
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="seconds the fake Bot API takes per message")
+    parser.add_argument("--quiet", type=float, default=2.0,
+                        help="seconds without replies that end a run")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,149 @@
-from datetime import datetime
 from dataclasses import dataclass
-from typing import Iterable, Literal
+import time
+from typing import Iterable
 
-import aiosqlite
 import config
+from dates import format_day
+import db
+from storage import get_storage
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Book:
     id: int
     name: str
     category_id: int
     category_name: str
-    read_start: str | None
-    read_finish: str | None
+    # date ordinals, formatted only when a book is displayed
+    read_start_day: int | None
+    read_finish_day: int | None
 
-    def __post_init__(self):
-        """Set up read_start and read_finish to needed string format"""
-        for field in ("read_start", "read_finish"):
-            value = getattr(self, field)
-            if value is None: continue
-            value = datetime.strptime(value, "%Y-%m-%d").strftime(config.DATE_FORMAT)
-            setattr(self, field, value)
+    @property
+    def read_start(self) -> str | None:
+        """read_start in config.DATE_FORMAT"""
+        return format_day(self.read_start_day)
 
+    @property
+    def read_finish(self) -> str | None:
+        """read_finish in config.DATE_FORMAT"""
+        return format_day(self.read_finish_day)
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Category:
     id: int
     name: str
     books: Iterable[Book]
 
+
+@dataclass(frozen=True, slots=True)
+class Catalog:
+    """Snapshot of all categories with books, loaded once per catalog version"""
+    version: int
+    categories: Iterable[Category]
+    not_started: Iterable[Category]
+    books_by_number: list[Book]
+    books_by_id: dict[int, Book]
+    vote_numbers: dict[int, int]
+
+    def get_books_by_numbers(self, numbers: Iterable[int]) -> list[Book]:
+        """Map vote numbers to not started books, unknown numbers are skipped"""
+        books = []
+        for number in map(int, numbers):
+            if 1 <= number <= len(self.books_by_number):
+                books.append(self.books_by_number[number - 1])
+        return books
+
+
+_catalog: Catalog | None = None
+_catalog_checked_at = 0.0
+
+
+async def get_catalog() -> Catalog:
+    """Return cached catalog, reloading it when catalog_version changes.
+
+    The version row is checked at most once per config.CATALOG_CHECK_INTERVAL
+    seconds, so hot paths usually do not touch the database at all."""
+    global _catalog, _catalog_checked_at
+    now = time.monotonic()
+    if (_catalog is not None
+            and now - _catalog_checked_at < config.CATALOG_CHECK_INTERVAL):
+        return _catalog
+    version = await _get_catalog_version()
+    if _catalog is None or _catalog.version != version:
+        _catalog = await _load_catalog(version)
+    _catalog_checked_at = now
+    return _catalog
+
+
+def invalidate_catalog() -> None:
+    global _catalog
+    _catalog = None
+
+
 async def get_all_books() -> Iterable[Category]:
-    sql = _get_books_base_sql() + """
-        order by bc.ordering, b.ordering;
-    """
-    books = await _get_books_from_db(sql)
-    #books = []
-    # async with aiosqlite.connect(config.SQLITE_DB_FILE) as db:
-    #     db.row_factory = aiosqlite.Row
-    #     async with db.execute(sql) as cursor:
-    #          async for row in cursor:
-    #              books.append(Book(
-    #                  id=row["book_id"],
-    #                  name=row["book_name"],
-    #                  category_id=row["category_id"],
-    #                  category_name=row["category_name"],
-    #                  read_start=row["read_start"],
-    #                  read_finish=row["read_finish"]
-    #              ))
-    return _group_books_by_categories(books)
+    return (await get_catalog()).categories
+
+
+async def _load_catalog(version: int) -> Catalog:
+    books = [Book(*row) for row in await get_storage().get_books()]
+    not_started_books = [book for book in books if book.read_start_day is None]
+    return Catalog(
+        version=version,
+        categories=_group_books_by_categories(books),
+        not_started=_group_books_by_categories(not_started_books),
+        books_by_number=not_started_books,
+        books_by_id={book.id: book for book in books},
+        vote_numbers={book.id: number
+                      for number, book in enumerate(not_started_books, 1)}
+    )
+
+async def _get_catalog_version() -> int:
+    return await get_storage().get_catalog_version()
 
 async def get_not_started_books() -> Iterable[Category]:
-    sql = _get_books_base_sql() + """
-        where b.read_start is null
-        order by bc.ordering, b.ordering;
-    """
-    books = await _get_books_from_db(sql)
-    return _group_books_by_categories(books)
+    return (await get_catalog()).not_started
 
 
 async def get_already_read_books() -> Iterable[Book]:
-    sql = _get_books_base_sql() + """ 
-        where read_start < current_date	
-	        and read_finish <= current_date
-	    order by b.read_start;
-    """
-    return await _get_books_from_db(sql)
+    rows = await get_storage().get_already_read_books(db.current_date())
+    return [Book(*row) for row in rows]
 
 async def get_now_reading_book() -> Iterable[Book]:
-    sql = _get_books_base_sql() + """
-            where read_start <= current_date	
-    	        and read_finish >= current_date
-    	    order by b.read_start;
-        """
-    return await _get_books_from_db(sql)
+    rows = await get_storage().get_now_reading_books(db.current_date())
+    return [Book(*row) for row in rows]
 
 async def get_books_by_numbers(numbers: Iterable[int]) -> Iterable[Book]:
-    numbers_joined = ", ".join(map(str, map(int, numbers)))
-
-    hardcoded_sql_values = []
-    for index, number in enumerate(numbers, 1):
-        hardcoded_sql_values.append(f"({number}, {index})")
-
-    output_hardcoded_sql_values = ", ".join(hardcoded_sql_values)
-
-    sql = f"""
-        select t2.* from (
-            values {output_hardcoded_sql_values}
-        ) t0
-        inner join
-        (
-        select t.* from (
-            {_get_books_base_sql('row_number() over (order by bc."ordering", b."ordering") as idx')}
-        where read_start is null
-        ) t
-        where t.idx in ({numbers_joined})
-        ) t2
-        on t0.column1=t2.idx
-        order by t0.column2
-    """
-    books = await _get_books_from_db(sql)
-    return books
+    return (await get_catalog()).get_books_by_numbers(numbers)
+
+async def search_books(query: str, limit: int) -> list[Book]:
+    """Find books by title or author, tolerating typos.
+
+    Candidates sharing any trigram with the query come from the storage's
+    index, then are filtered and ranked by the share of query trigrams
+    their title or author contains."""
+    trigrams = _get_trigrams(query[:config.SEARCH_MAX_QUERY_LENGTH])
+    if not trigrams:
+        return []
+    rows = await get_storage().search_books(trigrams, config.SEARCH_CANDIDATES)
+    catalog = await get_catalog()
+    found = []
+    for position, (book_id, title, author) in enumerate(rows):
+        book = catalog.books_by_id.get(book_id)
+        if book is None:
+            continue
+        similarity = max(
+            len(trigrams & _get_trigrams(title)),
+            len(trigrams & _get_trigrams(author))
+        ) / len(trigrams)
+        if similarity >= config.SEARCH_MIN_SIMILARITY:
+            found.append((-similarity, position, book))
+    found.sort(key=lambda item: item[:2])
+    return [book for _, _, book in found[:limit]]
+
+def _get_trigrams(text: str) -> set[str]:
+    text = " ".join(text.lower().split())
+    return {text[index:index + 3] for index in range(len(text) - 2)}
 
 def _group_books_by_categories(books: Iterable[Book]) -> Iterable[Category]:
     categories = []
@@ -116,50 +159,3 @@ def _group_books_by_categories(books: Iterable[Book]) -> Iterable[Category]:
             continue
         categories[-1].books.append(book)
     return categories
-
-# def _get_books_base_sql(select_param: Literal[str] | None = None) -> Literal[str]:
-#     return f"""
-#         SELECT
-#             b.id as book_id,
-#             b.name as book_name,
-#             bc.id as category_id,
-#             bc.name as category_name,
-#             {select_param + "," if select_param else ""}
-#             b.read_start, b.read_finish,
-#             read_comments
-#         FROM book b
-#         LEFT JOIN book_category bc ON bc.id=b.category_id
-#     """
-
-def _get_books_base_sql(select_param: Literal[str] | None = None) -> Literal[str]:
-    return f"""
-        select b.id as book_id
-              ,b.name as book_name
-              ,bc.id as category_id
-              ,bc.name as category_name
-              ,{select_param + "," if select_param else ""}
-              b.read_start
-              ,b.read_finish
-        from book b
-          left join book_category bc
-            on b.category_id =bc.id
-        """
-
-
-async def _get_books_from_db(sql: Literal[str]) -> Iterable[Book]:
-    books = []
-    async with aiosqlite.connect(config.SQLITE_DB_FILE) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(sql) as cursor:
-            async for row in cursor:
-                books.append(Book(
-                    id=row["book_id"],
-                    name=row["book_name"],
-                    category_id=row["category_id"],
-                    category_name=row["category_name"],
-                    read_start=row["read_start"],
-                    read_finish=row["read_finish"]
-                ))
-    return books
-
-
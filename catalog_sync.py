@@ -0,0 +1,362 @@
+"""Sync the book catalog with a CSV, JSON or YAML file.
+
+    python -m catalog_sync catalog.csv
+    python -m catalog_sync catalog.yaml --dry-run
+    python -m catalog_sync --export catalog.csv
+
+The file lists books in catalog order, categories in the order they first
+appear. CSV files and JSON lines (.jsonl) have one book per row with the
+columns category, name and optionally id, read_start, read_finish and
+read_comments. JSON and YAML files hold either such a list or a mapping
+of category names to lists of books, a book being a name or a mapping.
+
+Books are matched by id when the file has one, otherwise by name, so
+their ids and votes survive renames and reorders. Columns missing from
+the file are left as they are. Only changed rows are written, all in one
+transaction, and the catalog_version triggers invalidate the bot's caches.
+Books missing from the file are kept at the end of their category, or
+deleted with --delete unless somebody voted for them."""
+import argparse
+import asyncio
+import csv
+from dataclasses import asdict, dataclass
+from datetime import date
+import json
+import logging
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import config
+import db
+
+
+logger = logging.getLogger(__name__)
+
+BOOK_COLUMNS = ("name", "category_id", "ordering",
+                "read_start", "read_finish", "read_comments")
+FILE_COLUMNS = ("category", "name", "id", "read_start", "read_finish", "read_comments")
+# category orderings are spaced like the ones in db.sql
+CATEGORY_ORDERING_STEP = 10
+
+
+class CatalogFileError(ValueError):
+    pass
+
+
+@dataclass
+class SyncResult:
+    categories_inserted: int = 0
+    categories_reordered: int = 0
+    books_inserted: int = 0
+    books_updated: int = 0
+    books_renamed: int = 0
+    books_unchanged: int = 0
+    books_kept: int = 0
+    books_deleted: int = 0
+
+
+def read_catalog_file(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Stream rows of a catalog file as dicts with FILE_COLUMNS keys"""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            for row in csv.DictReader(file):
+                yield {key: (value if value != "" else None)
+                       for key, value in row.items() if key in FILE_COLUMNS}
+    elif suffix == ".jsonl":
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    elif suffix == ".json":
+        with open(path, encoding="utf-8") as file:
+            yield from _iter_rows(json.load(file))
+    elif suffix in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise CatalogFileError("YAML catalogs need PyYAML installed")
+        with open(path, encoding="utf-8") as file:
+            yield from _iter_rows(yaml.safe_load(file))
+    else:
+        raise CatalogFileError(f"Unknown catalog file type: {path.name}")
+
+
+async def sync(rows: Iterable[dict[str, Any]],
+               delete: bool = False,
+               dry_run: bool = False) -> SyncResult:
+    """Apply the difference between rows and the book tables"""
+    result = SyncResult()
+    async with db.writer() as connection:
+        async with connection.execute(_SELECT_CATEGORIES_SQL) as cursor:
+            cursor.row_factory = None
+            categories = {name: [category_id, ordering]
+                          for category_id, name, ordering in await cursor.fetchall()}
+        async with connection.execute(_SELECT_BOOKS_SQL) as cursor:
+            cursor.row_factory = None
+            books = {row[0]: row[1:] for row in await cursor.fetchall()}
+        ids_by_name: dict[str, list[int]] = {}
+        for book_id, book in books.items():
+            ids_by_name.setdefault(book[0], []).append(book_id)
+
+        # positions the file asks for, categories and books in file order
+        next_ordering: dict[str, int] = {}
+        seen: set[int] = set()
+        inserts, updates = [], []
+        for line, row in enumerate(rows, 1):
+            category_name, name = row.get("category"), row.get("name")
+            if not category_name or not name:
+                raise CatalogFileError(f"Row {line} needs a category and a name")
+            ordering = next_ordering.setdefault(category_name, 1)
+            next_ordering[category_name] += 1
+            values = {key: _check_date(row[key], line)
+                      for key in ("read_start", "read_finish") if key in row}
+            if "read_comments" in row:
+                values["read_comments"] = row["read_comments"]
+            values.update(name=name, ordering=ordering, category=category_name)
+            book_id = _match_book(row, books, ids_by_name, seen, line)
+            if book_id is None:
+                inserts.append((row.get("id"), values))
+            else:
+                seen.add(book_id)
+                updates.append((book_id, values))
+
+        # categories missing from the file keep their order after the listed ones
+        category_names = list(next_ordering) + sorted(
+            (name for name in categories if name not in next_ordering),
+            key=lambda name: categories[name][1])
+        category_orderings = {name: index * CATEGORY_ORDERING_STEP
+                              for index, name in enumerate(category_names, 1)}
+        new_categories = [name for name in category_names if name not in categories]
+        result.categories_inserted = len(new_categories)
+        result.categories_reordered = sum(
+            1 for name, ordering in category_orderings.items()
+            if name in categories and categories[name][1] != ordering)
+        if not dry_run:
+            # new categories need ids before their books are compared, they
+            # start at free orderings above the current ones and move later
+            top = max((ordering for _, ordering in categories.values()), default=0)
+            for index, name in enumerate(new_categories, 1):
+                cursor = await connection.execute(
+                    _INSERT_CATEGORY_SQL, (name, top + index))
+                categories[name] = [cursor.lastrowid, top + index]
+        category_ids = {name: category[0] for name, category in categories.items()}
+        category_names_by_id = {category_id: name for name, category_id in category_ids.items()}
+
+        changed, moved, renames = [], [], []
+        for book_id, values in updates:
+            current = dict(zip(BOOK_COLUMNS, books[book_id]))
+            wanted = dict(current, category_id=category_ids.get(values["category"]))
+            wanted.update((key, value) for key, value in values.items() if key != "category")
+            if wanted == current:
+                result.books_unchanged += 1
+                continue
+            if wanted["name"] != current["name"]:
+                renames.append({"id": book_id, "name": wanted["name"]})
+            if (wanted["category_id"], wanted["ordering"]) != (
+                    current["category_id"], current["ordering"]):
+                moved.append(book_id)
+            changed.append(dict(wanted, id=book_id))
+
+        # books missing from the file go after the listed ones or away
+        missing = [book_id for book_id in books if book_id not in seen]
+        deleted = set(await _get_unvoted(connection, missing)) if delete and missing else set()
+        kept = sorted((book_id for book_id in missing if book_id not in deleted),
+                      key=lambda book_id: books[book_id][2])
+        for book_id in kept:
+            current = dict(zip(BOOK_COLUMNS, books[book_id]))
+            category_name = category_names_by_id.get(current["category_id"])
+            if category_name not in next_ordering:
+                continue
+            current["ordering"] = next_ordering[category_name]
+            next_ordering[category_name] += 1
+            if current["ordering"] != books[book_id][2]:
+                moved.append(book_id)
+                changed.append(dict(current, id=book_id))
+        result.books_inserted = len(inserts)
+        result.books_updated = len(changed)
+        result.books_renamed = len(renames)
+        result.books_kept = len(kept)
+        result.books_deleted = len(deleted)
+        if dry_run:
+            return result
+
+        await connection.executemany(_DELETE_BOOK_SQL, ((book_id,) for book_id in deleted))
+        # unique(category_id, ordering) and unique(ordering) hold after every
+        # statement, so moved rows first step aside to negative orderings
+        await connection.executemany(_PARK_BOOK_SQL, ((book_id,) for book_id in moved))
+        reordered = [(category_orderings[name], categories[name][0])
+                     for name in category_names
+                     if categories[name][1] != category_orderings[name]]
+        await connection.executemany(_PARK_CATEGORY_SQL, (
+            (category_id,) for _, category_id in reordered))
+        await connection.executemany(_UPDATE_CATEGORY_SQL, reordered)
+        await connection.executemany(_UPDATE_BOOK_SQL, changed)
+        await connection.executemany(_RENAME_BOOK_SQL, renames)
+        await connection.executemany(_INSERT_BOOK_SQL, (
+            {
+                "id": book_id,
+                "name": values["name"],
+                "category_id": category_ids[values["category"]],
+                "ordering": values["ordering"],
+                "read_start": values.get("read_start"),
+                "read_finish": values.get("read_finish"),
+                "read_comments": values.get("read_comments"),
+            }
+            for book_id, values in inserts))
+    return result
+
+
+async def export(path: str | Path) -> int:
+    """Write the current catalog in the format sync reads, return book count"""
+    path = Path(path)
+    rows = [dict(row) for row in await db.fetchall(_EXPORT_SQL)]
+    suffix = path.suffix.lower()
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if suffix == ".csv":
+            writer = csv.DictWriter(file, FILE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        elif suffix == ".jsonl":
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        elif suffix == ".json":
+            json.dump(rows, file, ensure_ascii=False, indent=1)
+        elif suffix in (".yaml", ".yml"):
+            import yaml
+            catalog: dict[str, list] = {}
+            for row in rows:
+                catalog.setdefault(row.pop("category"), []).append(
+                    {key: value for key, value in row.items() if value is not None})
+            yaml.safe_dump(catalog, file, allow_unicode=True, sort_keys=False)
+        else:
+            raise CatalogFileError(f"Unknown catalog file type: {path.name}")
+    return len(rows)
+
+
+def _iter_rows(data: Any) -> Iterator[dict[str, Any]]:
+    if isinstance(data, list):
+        yield from data
+        return
+    if not isinstance(data, dict):
+        raise CatalogFileError("Catalog must be a list of books or a mapping of categories")
+    for category_name, category_books in data.items():
+        for book in category_books or ():
+            if isinstance(book, str):
+                book = {"name": book}
+            yield dict(book, category=category_name)
+
+
+def _match_book(row: dict[str, Any], books: dict[int, tuple],
+                ids_by_name: dict[str, list[int]], seen: set[int],
+                line: int) -> int | None:
+    if row.get("id") is not None:
+        book_id = int(row["id"])
+        if book_id in seen:
+            raise CatalogFileError(f"Row {line} repeats book id {book_id}")
+        return book_id if book_id in books else None
+    # books with the same name are matched in catalog order
+    for book_id in ids_by_name.get(row["name"], ()):
+        if book_id not in seen:
+            return book_id
+    return None
+
+
+def _check_date(value: str | None, line: int) -> str | None:
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(str(value)).isoformat()
+    except ValueError:
+        raise CatalogFileError(f"Row {line} has a bad date: {value}")
+
+
+async def _get_unvoted(connection, book_ids: list[int]) -> list[int]:
+    voted = set()
+    async with connection.execute(_VOTED_BOOKS_SQL) as cursor:
+        cursor.row_factory = None
+        for row in await cursor.fetchall():
+            voted.update(row)
+    return [book_id for book_id in book_ids if book_id not in voted]
+
+
+_SELECT_CATEGORIES_SQL = "select id, name, ordering from book_category"
+
+_SELECT_BOOKS_SQL = """
+    select id, name, category_id, ordering, read_start, read_finish, read_comments
+    from book"""
+
+_VOTED_BOOKS_SQL = "select first_book_id, second_book_id, third_book_id from vote"
+
+_EXPORT_SQL = """
+    select bc.name as category, b.name, b.id,
+           b.read_start, b.read_finish, b.read_comments
+    from book b
+      join book_category bc on bc.id = b.category_id
+    order by bc.ordering, b.ordering"""
+
+_DELETE_BOOK_SQL = "delete from book where id = ?"
+
+_PARK_BOOK_SQL = "update book set ordering = -id where id = ?"
+
+_INSERT_CATEGORY_SQL = "insert into book_category (name, ordering) values (?, ?)"
+
+_PARK_CATEGORY_SQL = "update book_category set ordering = -id where id = ?"
+
+_UPDATE_CATEGORY_SQL = "update book_category set ordering = ? where id = ?"
+
+# name is changed separately, so that only renames refresh the search index
+_UPDATE_BOOK_SQL = """
+    update book
+    set category_id = :category_id,
+        ordering = :ordering,
+        read_start = :read_start,
+        read_finish = :read_finish,
+        read_comments = :read_comments
+    where id = :id"""
+
+_RENAME_BOOK_SQL = "update book set name = :name where id = :id"
+
+_INSERT_BOOK_SQL = """
+    insert into book (id, name, category_id, ordering,
+                      read_start, read_finish, read_comments)
+    values (:id, :name, :category_id, :ordering,
+            :read_start, :read_finish, :read_comments)"""
+
+
+async def _main(args: argparse.Namespace) -> None:
+    if args.db:
+        config.SQLITE_DB_FILE = args.db
+    await db.connect()
+    try:
+        if args.export:
+            count = await export(args.file)
+            logger.info("Exported %s books to %s", count, args.file)
+            return
+        result = await sync(read_catalog_file(args.file), args.delete, args.dry_run)
+        print(json.dumps(asdict(result), indent=2))
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file")
+    parser.add_argument("--db", help=f"database, {config.SQLITE_DB_FILE} by default")
+    parser.add_argument("--export", action="store_true",
+                        help="write the current catalog to the file instead")
+    parser.add_argument("--delete", action="store_true",
+                        help="delete books missing from the file nobody voted for")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report what would change")
+    args = parser.parse_args()
+    if config.STORAGE_BACKEND != "sqlite":
+        parser.error(f"the bot reads books from the {config.STORAGE_BACKEND} storage, "
+                     "this only syncs sqlite")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,110 @@
 SQLITE_DB_FILE = "db.sqlite3"
 DATE_FORMAT = "%Y-%m-%d"
 #DATE_FORMAT = "%d.%m.%Y"
-VOTE_ELEMENTS_COUNT = 3
\ No newline at end of file
+VOTE_ELEMENTS_COUNT = 3
+
+SQLITE_READERS_COUNT = 4
+SQLITE_CACHED_STATEMENTS = 256
+SQLITE_PRAGMAS = (
+    "pragma journal_mode=wal",
+    "pragma synchronous=normal",
+    "pragma foreign_keys=on",
+    "pragma temp_store=memory",
+    "pragma cache_size=-16000",
+    "pragma mmap_size=67108864",
+    "pragma busy_timeout=5000",
+)
+
+# where books, votings, votes, users and voting snapshots live: "sqlite" or
+# "postgres", see storage.py; announcements, live results and persisted vote
+# mode keep their data in SQLITE_DB_FILE and refuse to run with "postgres"
+STORAGE_BACKEND = "sqlite"
+POSTGRES_DSN = "postgresql://localhost/book_club"
+POSTGRES_POOL_MIN_SIZE = 2
+POSTGRES_POOL_MAX_SIZE = 10
+# prepared statements kept per pooled connection
+POSTGRES_CACHED_STATEMENTS = 256
+
+CATALOG_CHECK_INTERVAL = 5
+RENDER_CACHE_SIZE = 64
+
+VOTE_QUEUE_SIZE = 1000
+VOTE_BATCH_SIZE = 200
+# score for the first, second and third book of a ballot
+VOTE_WEIGHTS = (3, 2, 2)
+# how /voteresults ranks books: "borda" with VOTE_WEIGHTS, "plurality",
+# "instant_runoff" or "schulze", see tally.RULES
+VOTE_RULE = "borda"
+# Schulze compares every pair of books, so only the best Borda books compete
+SCHULZE_MAX_CANDIDATES = 100
+
+ADMIN_TELEGRAM_IDS = ()
+
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1
+SEND_GROUP_RATE = 20 / 60
+SEND_CHAT_BURST = 3
+SEND_MAX_RETRIES = 3
+SEND_BACKOFF_BASE = 0.5
+
+# set to the public https url, e.g. "https://bot.example.com/telegram",
+# to receive updates via webhook instead of long polling
+WEBHOOK_URL = None
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+# limits how many update requests Telegram keeps in flight at once
+WEBHOOK_MAX_CONNECTIONS = 40
+# updates handled at once, one user's or chat's updates always in order
+UPDATE_CONCURRENCY = 32
+# set to run one process polling for updates, this many worker processes
+# handling them, each user's always in the same one, and one process doing
+# every database write; long polling only
+WORKER_PROCESSES = 0
+
+# set METRICS_PORT to None to disable the Prometheus metrics endpoint
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9108
+# queries slower than this are logged with their sql, None disables the log
+SLOW_QUERY_SECONDS = 0.1
+# refuse to start when a hot query's plan scans a whole table, otherwise
+# such plans are only logged
+QUERY_PLANS_STRICT = False
+
+# seconds after /vote during which text messages are read as ballots
+VOTE_MODE_TIMEOUT = 30 * 60
+# keep vote mode in bot_user_in_vote_mode to survive restarts
+VOTE_MODE_PERSIST = False
+
+SEARCH_RESULTS_COUNT = 10
+SEARCH_CANDIDATES = 50
+SEARCH_MAX_QUERY_LENGTH = 64
+# share of query trigrams a title or author must contain to be found
+SEARCH_MIN_SIMILARITY = 0.5
+
+# send /allbooks and /vote as one message with page buttons
+CATALOG_PAGED = True
+CATALOG_PAGE_LENGTH = 1500
+
+# how often finished votings are frozen and votings are announced
+SNAPSHOT_INTERVAL = 60 * 60
+SNAPSHOT_LEADERS_COUNT = 10
+# how many past votings /history shows
+HISTORY_VOTINGS_COUNT = 5
+
+# message every bot user when a voting opens and when its results are frozen
+ANNOUNCE_VOTINGS = True
+# closed votings older than this many days are not announced any more
+ANNOUNCE_CLOSED_DAYS = 2
+ANNOUNCE_LEADERS_COUNT = 3
+# announcement messages per second, below SEND_GLOBAL_RATE to leave room
+# for replies
+ANNOUNCE_RATE = 20
+ANNOUNCE_CONCURRENCY = 20
+ANNOUNCE_BATCH_SIZE = 500
+ANNOUNCE_STOP_TIMEOUT = 10
+
+# chats with a pinned message showing the actual voting's standings, edited
+# as votes arrive, at most once per LIVE_RESULTS_INTERVAL seconds
+LIVE_RESULTS_CHAT_IDS = ()
+LIVE_RESULTS_INTERVAL = 15
@@ -0,0 +1,28 @@
+from datetime import date
+from functools import lru_cache
+
+import config
+
+
+# julianday() of 0001-01-01 minus one, turns sqlite dates into ordinals
+JULIAN_DAY_OFFSET = 1721424.5
+
+
+def to_day(value: str | None) -> int | None:
+    """Ordinal of an ISO date as the database stores it"""
+    if value is None:
+        return None
+    return date.fromisoformat(value).toordinal()
+
+
+def format_day(day: int | None) -> str | None:
+    """Day ordinal in config.DATE_FORMAT, None stays None"""
+    if day is None:
+        return None
+    return _format_day(day, config.DATE_FORMAT)
+
+
+@lru_cache(maxsize=4096)
+def _format_day(day: int, date_format: str) -> str:
+    # few distinct dates repeat across many rows, each is formatted once
+    return date.fromordinal(day).strftime(date_format)
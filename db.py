@@ -0,0 +1,156 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+import logging
+import time
+from typing import Any, AsyncIterator, Iterable, Literal, Mapping
+
+import aiosqlite
+import config
+from metrics import QueryTimer
+import migrations
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolStats:
+    acquired: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.acquired if self.acquired else 0.0
+
+
+_writer: aiosqlite.Connection | None = None
+_writer_lock = asyncio.Lock()
+_readers: asyncio.Queue | None = None
+_connect_lock = asyncio.Lock()
+_reader_stats = PoolStats()
+_writer_stats = PoolStats()
+
+
+async def connect() -> None:
+    """Open one writer and config.SQLITE_READERS_COUNT reader connections"""
+    global _writer, _readers
+    async with _connect_lock:
+        if _writer is not None:
+            return
+        writer = await _open_connection()
+        await migrations.migrate(writer)
+        readers = asyncio.Queue()
+        for _ in range(config.SQLITE_READERS_COUNT):
+            readers.put_nowait(await _open_connection())
+        _writer, _readers = writer, readers
+        logger.info("SQLite pool opened: 1 writer, %s readers",
+                    config.SQLITE_READERS_COUNT)
+
+
+async def close() -> None:
+    global _writer, _readers
+    async with _connect_lock:
+        if _writer is None:
+            return
+        async with _writer_lock:
+            await _writer.close()
+        while not _readers.empty():
+            await _readers.get_nowait().close()
+        _writer, _readers = None, None
+        logger.info("SQLite pool closed, reader wait avg %.2f ms, "
+                    "writer wait avg %.2f ms",
+                    _reader_stats.avg_wait * 1000,
+                    _writer_stats.avg_wait * 1000)
+
+
+@asynccontextmanager
+async def reader() -> AsyncIterator[aiosqlite.Connection]:
+    if _writer is None:
+        await connect()
+    started = time.perf_counter()
+    connection = await _readers.get()
+    _account_wait(_reader_stats, started)
+    try:
+        yield connection
+    finally:
+        _readers.put_nowait(connection)
+
+
+@asynccontextmanager
+async def writer() -> AsyncIterator[aiosqlite.Connection]:
+    """Exclusive access to the writer connection, commits on success"""
+    if _writer is None:
+        await connect()
+    started = time.perf_counter()
+    async with _writer_lock:
+        _account_wait(_writer_stats, started)
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
+
+
+async def fetchall(sql: Literal[str],
+                   params: Mapping[str, Any] | Iterable[Any] | None = None
+                   ) -> Iterable[aiosqlite.Row]:
+    async with reader() as db:
+        with QueryTimer(sql) as timer:
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+            timer.rows = len(rows)
+    return rows
+
+
+async def fetchall_tuples(sql: Literal[str],
+                          params: Mapping[str, Any] | Iterable[Any] | None = None
+                          ) -> list[tuple]:
+    """fetchall returning plain tuples, cheaper for large positional reads"""
+    async with reader() as db:
+        with QueryTimer(sql) as timer:
+            async with db.execute(sql, params) as cursor:
+                cursor.row_factory = None
+                rows = await cursor.fetchall()
+            timer.rows = len(rows)
+    return rows
+
+
+async def fetchone(sql: Literal[str],
+                   params: Mapping[str, Any] | Iterable[Any] | None = None
+                   ) -> aiosqlite.Row | None:
+    async with reader() as db:
+        with QueryTimer(sql) as timer:
+            async with db.execute(sql, params) as cursor:
+                row = await cursor.fetchone()
+            timer.rows = int(row is not None)
+    return row
+
+
+def current_date() -> date:
+    """Date in UTC, the same one sqlite's current_date returns"""
+    return datetime.now(timezone.utc).date()
+
+
+def get_pool_stats() -> dict[str, PoolStats]:
+    return {"reader": _reader_stats, "writer": _writer_stats}
+
+
+async def _open_connection() -> aiosqlite.Connection:
+    connection = await aiosqlite.connect(
+        config.SQLITE_DB_FILE,
+        cached_statements=config.SQLITE_CACHED_STATEMENTS)
+    connection.row_factory = aiosqlite.Row
+    for pragma in config.SQLITE_PRAGMAS:
+        await connection.execute(pragma)
+    return connection
+
+
+def _account_wait(stats: PoolStats, started: float) -> None:
+    waited = time.perf_counter() - started
+    stats.acquired += 1
+    stats.total_wait += waited
+    stats.max_wait = max(stats.max_wait, waited)
@@ -0,0 +1,150 @@
+import asyncio
+from dataclasses import dataclass, field
+import heapq
+import logging
+from typing import Iterable
+
+import numpy as np
+
+import config
+from storage import get_storage
+
+
+logger = logging.getLogger(__name__)
+
+_INITIAL_ROWS = 1024
+
+
+@dataclass
+class Tally:
+    """Running per-book scores of one voting"""
+    voting_id: int
+    ballots: dict[int, tuple[int, ...]] = field(default_factory=dict)
+    scores: dict[int, int] = field(default_factory=dict)
+    # bumped on every applied ballot, lets derived rankings notice changes
+    revision: int = 0
+    # the ballots as indexes into _book_ids, one row per user, built by
+    # the first get_ranks and then updated in place; -1 is an empty rank
+    _ranks: np.ndarray | None = None
+    _rows: dict[int, int] = field(default_factory=dict)
+    _book_ids: list[int] = field(default_factory=list)
+    _book_indexes: dict[int, int] = field(default_factory=dict)
+
+    def apply(self, user_id: int, book_ids: tuple[int, ...]) -> None:
+        """Replace user's previous ballot with the new one"""
+        old_book_ids = self.ballots.get(user_id)
+        if old_book_ids is not None:
+            self._add(old_book_ids, -1)
+        self.ballots[user_id] = book_ids
+        self._add(book_ids, 1)
+        if self._ranks is not None:
+            self._set_row(user_id, book_ids)
+        self.revision += 1
+
+    def top(self, count: int) -> list[tuple[int, int]]:
+        """(book_id, score) pairs of the count best books"""
+        return heapq.nlargest(count, self.scores.items(), key=lambda item: item[1])
+
+    def get_ranks(self) -> tuple[np.ndarray, np.ndarray]:
+        """(book_ids, ranks) of the ballots: a users x ranks matrix of
+        indexes into book_ids, -1 marking an empty rank. Books nobody
+        ranks any more may stay in book_ids"""
+        if self._ranks is None:
+            count = len(self.ballots)
+            widths = set(map(len, self.ballots.values()))
+            width = max(widths, default=config.VOTE_ELEMENTS_COUNT)
+            rows = list(self.ballots.values())
+            if len(widths) > 1:
+                rows = [[*book_ids] + [None] * (width - len(book_ids)) for book_ids in rows]
+            # None becomes NaN on the way in and an empty rank on the way out
+            matrix = np.array(rows, dtype=np.float64).reshape(count, width)
+            ranked = ~np.isnan(matrix)
+            book_ids, indexes = np.unique(matrix[ranked].astype(np.int64), return_inverse=True)
+            self._book_ids = book_ids.tolist()
+            self._book_indexes = {book_id: index for index, book_id in enumerate(self._book_ids)}
+            self._rows = {user_id: row for row, user_id in enumerate(self.ballots)}
+            self._ranks = np.full((max(count * 2, _INITIAL_ROWS), width), -1, dtype=np.int32)
+            self._ranks[:count][ranked] = indexes
+        return (np.array(self._book_ids, dtype=np.int64),
+                self._ranks[:len(self._rows)])
+
+    def _set_row(self, user_id: int, book_ids: tuple[int, ...]) -> None:
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._rows[user_id] = len(self._rows)
+        rows, width = self._ranks.shape
+        if row >= rows or len(book_ids) > width:
+            ranks = np.full((rows * 2 if row >= rows else rows,
+                             max(width, len(book_ids))), -1, dtype=np.int32)
+            ranks[:rows, :width] = self._ranks
+            self._ranks = ranks
+        cells = self._ranks[row]
+        cells[:] = -1
+        for rank, book_id in enumerate(book_ids):
+            if book_id is not None:
+                cells[rank] = self._get_book_index(book_id)
+
+    def _get_book_index(self, book_id: int) -> int:
+        index = self._book_indexes.get(book_id)
+        if index is None:
+            index = self._book_indexes[book_id] = len(self._book_ids)
+            self._book_ids.append(book_id)
+        return index
+
+    def _add(self, book_ids: tuple[int, ...], sign: int) -> None:
+        for book_id, weight in zip(book_ids, config.VOTE_WEIGHTS):
+            score = self.scores.get(book_id, 0) + sign * weight
+            if score:
+                self.scores[book_id] = score
+            else:
+                self.scores.pop(book_id, None)
+
+
+_tallies: dict[int, Tally] = {}
+_load_lock = asyncio.Lock()
+
+
+async def get_tally(voting_id: int) -> Tally:
+    tally = _tallies.get(voting_id)
+    if tally is not None:
+        return tally
+    async with _load_lock:
+        if voting_id not in _tallies:
+            _tallies[voting_id] = await _load_tally(voting_id)
+        return _tallies[voting_id]
+
+
+def apply_ballots(ballots: Iterable[tuple[int, int, tuple[int, ...]]]) -> None:
+    """Apply (voting_id, user_id, book_ids) ballots to already loaded tallies.
+
+    Must be called by the writer within the transaction saving the ballots,
+    so that no tally is loaded between the commit and this call."""
+    for voting_id, user_id, book_ids in ballots:
+        tally = _tallies.get(voting_id)
+        if tally is not None:
+            tally.apply(user_id, book_ids)
+
+
+def discard(voting_id: int) -> None:
+    _tallies.pop(voting_id, None)
+
+
+async def verify(voting_id: int) -> bool:
+    """Compare in-memory tally with scores aggregated from the vote table"""
+    tally = await get_tally(voting_id)
+    expected = await get_storage().get_scores(voting_id, config.VOTE_WEIGHTS)
+    if expected == tally.scores:
+        return True
+    logger.error("Tally of voting %s diverged from vote table, rebuilding",
+                 voting_id)
+    _tallies[voting_id] = await _load_tally(voting_id)
+    return False
+
+
+async def _load_tally(voting_id: int) -> Tally:
+    # storage never reads ballots between saving and applying a batch, and
+    # callers publish the tally before their next await, so none is missed
+    tally = Tally(voting_id)
+    for row in await get_storage().get_ballots(voting_id):
+        tally.apply(row[0], tuple(row[1:]))
+    return tally
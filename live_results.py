@@ -0,0 +1,164 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+
+import telegram
+from telegram.error import BadRequest, TelegramError
+
+import config
+import db
+import responses
+import sender
+from sender import OutgoingMessage
+import votings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LiveResultsStats:
+    refreshes: int = 0
+    edits: int = 0
+    # chats whose message already showed the same standings
+    skipped: int = 0
+    # notify() calls folded into an already pending refresh
+    coalesced: int = 0
+    failed: int = 0
+
+
+@dataclass
+class _LiveMessage:
+    voting_id: int
+    message_id: int
+    text: str
+
+
+_stats = LiveResultsStats()
+_messages: dict[int, _LiveMessage] | None = None
+_task: asyncio.Task | None = None
+# set by notify() while a refresh is pending or running
+_dirty = False
+_refreshed_at = float("-inf")
+
+
+def notify(bot: telegram.Bot) -> None:
+    """Refresh the live results messages soon.
+
+    A burst of calls results in one refresh per config.LIVE_RESULTS_INTERVAL
+    seconds, the first one right away."""
+    global _task, _dirty
+    if not config.LIVE_RESULTS_CHAT_IDS:
+        return
+    if _task is not None and not _task.done():
+        _dirty = True
+        _stats.coalesced += 1
+        return
+    _task = asyncio.create_task(_run(bot))
+
+
+async def stop() -> None:
+    """Drop a pending refresh, the next notify() after a restart catches up"""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+
+
+async def refresh(bot: telegram.Bot) -> None:
+    """Show the actual voting's standings in every configured chat"""
+    global _messages
+    _stats.refreshes += 1
+    if _messages is None:
+        _messages = {row["chat_id"]: _LiveMessage(row["voting_id"], row["message_id"], row["text"])
+                     for row in await db.fetchall(_SELECT_MESSAGES_SQL)}
+    leaders = await votings.get_leaders()
+    if leaders is None:
+        return
+    text = responses.format_vote_results(leaders)
+    for chat_id in config.LIVE_RESULTS_CHAT_IDS:
+        try:
+            await _show(bot, chat_id, leaders.voting.id, text)
+        except TelegramError as error:
+            _stats.failed += 1
+            logger.warning("Failed to update live results in %s: %s", chat_id, error)
+
+
+def get_live_results_stats() -> LiveResultsStats:
+    return _stats
+
+
+async def _run(bot: telegram.Bot) -> None:
+    global _dirty, _refreshed_at
+    while True:
+        delay = _refreshed_at + config.LIVE_RESULTS_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # votes arriving from now on need another refresh
+        _dirty = False
+        _refreshed_at = time.monotonic()
+        try:
+            await refresh(bot)
+        except Exception:
+            logger.exception("Live results refresh failed")
+        if not _dirty:
+            return
+
+
+async def _show(bot: telegram.Bot, chat_id: int, voting_id: int, text: str) -> None:
+    message = _messages.get(chat_id)
+    if message is not None and message.voting_id == voting_id:
+        if message.text == text:
+            _stats.skipped += 1
+            return
+        try:
+            await sender.edit_message(bot, chat_id, message.message_id, OutgoingMessage(
+                text, telegram.constants.ParseMode.MARKDOWN))
+        except BadRequest as error:
+            # deleted by an admin, a new message is posted and pinned instead
+            if "not found" not in str(error).lower():
+                raise
+            logger.info("Live results message in %s is gone: %s", chat_id, error)
+        else:
+            _stats.edits += 1
+            await _save(chat_id, _LiveMessage(voting_id, message.message_id, text))
+            return
+    if message is not None:
+        # the previous voting's standings stay in the chat, just not pinned
+        try:
+            await sender.unpin_message(bot, chat_id, message.message_id)
+        except TelegramError as error:
+            logger.info("Could not unpin live results in %s: %s", chat_id, error)
+    sent = await sender.send(bot, chat_id, (OutgoingMessage(
+        text, telegram.constants.ParseMode.MARKDOWN),))
+    await _save(chat_id, _LiveMessage(voting_id, sent[0].message_id, text))
+    try:
+        await sender.pin_message(bot, chat_id, sent[0].message_id)
+    except TelegramError as error:
+        logger.warning("Could not pin live results in %s: %s", chat_id, error)
+
+
+async def _save(chat_id: int, message: _LiveMessage) -> None:
+    _messages[chat_id] = message
+    async with db.writer() as connection:
+        await connection.execute(_SAVE_MESSAGE_SQL, {
+            "chat_id": chat_id,
+            "voting_id": message.voting_id,
+            "message_id": message.message_id,
+            "text": message.text,
+        })
+
+
+_SELECT_MESSAGES_SQL = """
+    select chat_id, voting_id, message_id, text
+    from live_results_message"""
+
+_SAVE_MESSAGE_SQL = """
+    insert or replace into live_results_message (chat_id, voting_id, message_id, text)
+    values (:chat_id, :voting_id, :message_id, :text)"""
@@ -7,27 +7,45 @@ import logging
 import telegram
 from telegram import Update
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    CallbackQueryHandler,
     MessageHandler,
     ContextTypes,
     CommandHandler,
     filters
 )
 
+import announcements
 import config
+import db
 from books import (
-    get_all_books,
-    get_already_read_books,
-    get_now_reading_book,
-    get_not_started_books,
-    get_books_by_numbers
+    get_books_by_numbers,
+    get_catalog,
+    invalidate_catalog,
+    search_books
 )
 from votings import (
     get_actual_voting,
+    invalidate_actual_voting,
     save_vote,
-    get_leaders
+    get_leaders,
+    verify_actual_tally
 )
+import live_results
 import message_text
+import metrics
+import metrics_server
+import query_plans
+import responses
+import sender
+import snapshots
+import storage
+from update_processor import OrderedUpdateProcessor
+from sender import OutgoingMessage
+import vote_mode
+import vote_writer
+import workers
 
 
 logging.basicConfig(
@@ -38,16 +56,31 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# e.g. http://127.0.0.1:8081/bot for benchmarks/fake_bot_api.py
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL")
 
 if not TELEGRAM_BOT_TOKEN:
     exit('specify TELEGRAM_BOT_TOKEN')
 
+if config.WEBHOOK_URL and not TELEGRAM_WEBHOOK_SECRET:
+    exit('specify TELEGRAM_WEBHOOK_SECRET for webhook mode')
+
+if config.WEBHOOK_URL and config.WORKER_PROCESSES:
+    exit('worker processes get updates by long polling, unset WEBHOOK_URL')
+
+if config.STORAGE_BACKEND != "sqlite" and (
+        config.ANNOUNCE_VOTINGS or config.LIVE_RESULTS_CHAT_IDS or config.VOTE_MODE_PERSIST):
+    exit('announcements, live results and persisted vote mode need the sqlite storage, '
+         'unset ANNOUNCE_VOTINGS, LIVE_RESULTS_CHAT_IDS and VOTE_MODE_PERSIST')
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     effective_chat = update.effective_chat
     if not effective_chat:
         logger.warning("effective_chat is None in /start")
         return
-    await context.bot.send_message(
+    await sender.send_message(
+        context.bot,
         chat_id=effective_chat.id,
         text=message_text.GREETINGS)
 
@@ -56,7 +89,8 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not effective_chat:
         logger.warning("effective_chat is None in /help")
         return
-    await context.bot.send_message(
+    await sender.send_message(
+        context.bot,
         chat_id=effective_chat.id,
         text=message_text.HELP)
 
@@ -65,72 +99,54 @@ async def all_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not effective_chat:
         logger.warning("effective_chat is None in /allbooks")
         return
-    categories_with_books = await get_all_books()
-    for category in categories_with_books:
-        response = "*" + category.name + "*\n\n"
-        for index, book in enumerate(category.books,1):
-            response += f"{index}. {book.name}\n"
-        await context.bot.send_message(
-            chat_id=effective_chat.id,
-            text=response,
-            parse_mode=telegram.constants.ParseMode.MARKDOWN)
+    if config.CATALOG_PAGED:
+        await sender.send(
+            context.bot,
+            effective_chat.id,
+            (await responses.render_page("allbooks", 0),))
+        return
+    await _send_rendered(context, effective_chat.id, "allbooks")
 
 async def already(update: Update, context: ContextTypes.DEFAULT_TYPE):
     effective_chat = update.effective_chat
     if not effective_chat:
         logger.warning("effective_chat is None in /help")
         return
-    already_read_books = await get_already_read_books()
-    response = "Прочитанные книги:\n\n"
-    for index, book in enumerate(already_read_books, 1):
-        response += (f"{index}. {book.name} "
-                     f"(читали с {book.read_start} по {book.read_finish})\n")
-    await context.bot.send_message(
-            chat_id=effective_chat.id,
-            text=response)
+    await _send_rendered(context, effective_chat.id, "already")
 
 async def now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     effective_chat = update.effective_chat
     if not effective_chat:
         logger.warning("effective_chat is None in /help")
         return
-    now_read_books = await get_now_reading_book()
-    response = "Сейчас мы читаем:\n\n"
-    just_one_book = len(now_read_books) == 1
-    for index, book in enumerate(now_read_books, 1):
-        response += (f"{str(index) + '. ' if just_one_book else ''}. {book.name} "
-                     f"(читали с {book.read_start} по {book.read_finish})\n")
-        await context.bot.send_message(
-            chat_id=effective_chat.id,
-            text=response)
+    await _send_rendered(context, effective_chat.id, "now")
 
 async def vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     effective_chat = update.effective_chat
     if not effective_chat:
         logger.warning("effective_chat is None in /allbooks")
         return
+    # channel posts and anonymous group admins have no user to vote
+    effective_user = update.effective_user
+    if effective_user is None:
+        logger.warning("effective_user is None in /vote")
+        return
     if await get_actual_voting() is None:
-        await context.bot.send_message(
+        await sender.send_message(
+            context.bot,
             chat_id=effective_chat.id,
             text=message_text.NO_ACTUAL_VOTING,
             parse_mode=telegram.constants.ParseMode.MARKDOWN)
         return
 
-    categories_with_books = await get_not_started_books()
-    index = 1
-    for category in categories_with_books:
-        response = "*" + category.name + "*\n\n"
-        for book in category.books:
-            response += f"{index}. {book.name}\n"
-            index += 1
-        await context.bot.send_message(
-            chat_id=effective_chat.id,
-            text=response,
-            parse_mode=telegram.constants.ParseMode.MARKDOWN)
-    await context.bot.send_message(
-        chat_id=effective_chat.id,
-        text=message_text.VOTE,
-        parse_mode=telegram.constants.ParseMode.MARKDOWN)
+    await vote_mode.enter(effective_user.id)
+    if config.CATALOG_PAGED:
+        await sender.send(context.bot, effective_chat.id, (
+            await responses.render_page("vote", 0),
+            OutgoingMessage(message_text.VOTE_PAGED,
+                            telegram.constants.ParseMode.MARKDOWN)))
+        return
+    await _send_rendered(context, effective_chat.id, "vote")
 
 
 async def vote_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -139,8 +155,15 @@ async def vote_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning("effective_chat is None in /allbooks")
         return
 
-    if await get_actual_voting() is None:
-        await context.bot.send_message(
+    # ordinary chat messages of users who did not ask to /vote
+    effective_user = update.effective_user
+    if effective_user is None or not vote_mode.is_active(effective_user.id):
+        return
+
+    actual_voting = await get_actual_voting()
+    if actual_voting is None:
+        await sender.send_message(
+            context.bot,
             chat_id=effective_chat.id,
             text=message_text.NO_ACTUAL_VOTING,
             parse_mode=telegram.constants.ParseMode.MARKDOWN)
@@ -149,25 +172,30 @@ async def vote_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_message = update.message.text
     numbers = re.findall(r"\d+", user_message)
     if len(tuple(set(map(int, numbers)))) != config.VOTE_ELEMENTS_COUNT:
-        await context.bot.send_message(
+        await sender.send_message(
+            context.bot,
             chat_id=effective_chat.id,
             text=message_text.VOTE_PROCESS_INCORRECT_INPUT,
             parse_mode=telegram.constants.ParseMode.MARKDOWN)
         return
     books = await get_books_by_numbers(numbers)
     if len(books) != config.VOTE_ELEMENTS_COUNT:
-        await context.bot.send_message(
+        await sender.send_message(
+            context.bot,
             chat_id=effective_chat.id,
             text=message_text.VOTE_PROCESS_INCORRECT_BOOKS,
             parse_mode=telegram.constants.ParseMode.MARKDOWN)
         return
 
-    await save_vote(update.effective_user.id, books)
+    await save_vote(effective_user.id, books, actual_voting)
+    await vote_mode.leave(effective_user.id)
+    live_results.notify(context.bot)
 
     response = "Ура, ты выбрал три книги:\n\n"
     for index, book in enumerate(books, 1):
         response += f"{index}. {book.name}\n"
-    await context.bot.send_message(
+    await sender.send_message(
+        context.bot,
         chat_id=effective_chat.id,
         text=response,
         parse_mode=telegram.constants.ParseMode.MARKDOWN)
@@ -180,24 +208,180 @@ async def vote_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     leaders = await get_leaders()
     if leaders is None:
-        await context.bot.send_message(
+        await sender.send_message(
+            context.bot,
             chat_id=effective_chat.id,
             text=message_text.NO_VOTE_RESULT,
             parse_mode=telegram.constants.ParseMode.MARKDOWN)
         return
 
-    response = "ТОП 10 книг голосования:\n\n"
-    for index, book in enumerate(leaders.leaders, 1):
-        response += f"{index}. {book.book_name} с рейтингом {book.score}\n"
-    response += f"\nДаты голосования: с {leaders.voting.voting_start} по {leaders.voting.voting_finish}"
-    await context.bot.send_message(
+    await sender.send_message(
+        context.bot,
         chat_id=effective_chat.id,
-        text=response,
+        text=responses.format_vote_results(leaders),
         parse_mode=telegram.constants.ParseMode.MARKDOWN)
 
 
-if __name__ == "__main__":
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    effective_chat = update.effective_chat
+    if not effective_chat:
+        logger.warning("effective_chat is None in /history")
+        return
+    results = await snapshots.get_history()
+    if not results:
+        await sender.send_message(
+            context.bot,
+            chat_id=effective_chat.id,
+            text=message_text.NO_HISTORY)
+        return
+
+    messages = []
+    for result in results:
+        response = (f"Голосование с {result.voting.voting_start} "
+                    f"по {result.voting.voting_finish}:\n\n")
+        for index, book in enumerate(result.leaders, 1):
+            response += f"{index}. {book.book_name} с рейтингом {book.score:g}\n"
+        messages.append(OutgoingMessage(response + "\n"))
+    await sender.send(context.bot, effective_chat.id, sender.pack(messages))
+
+
+async def update_votings(context: ContextTypes.DEFAULT_TYPE):
+    await snapshots.freeze_closed_votings()
+    await announcements.announce_votings(context.bot)
+    await verify_actual_tally()
+    # a voting that just opened gets its live results message
+    live_results.notify(context.bot)
+
+
+async def catalog_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show another page of /allbooks or /vote in the same message"""
+    query = update.callback_query
+    await query.answer()
+    _, kind, *page = query.data.split(":")
+    if (not page or kind not in responses.get_page_kinds()
+            or not page[0].isdigit() or query.message is None):
+        return
+    await sender.edit_message(
+        context.bot,
+        query.message.chat.id,
+        query.message.message_id,
+        await responses.render_page(kind, int(page[0])))
+
+
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    effective_chat = update.effective_chat
+    if not effective_chat:
+        logger.warning("effective_chat is None in /find")
+        return
+    query = " ".join(context.args or ())
+    if len(query.strip()) < 3:
+        await sender.send_message(
+            context.bot,
+            chat_id=effective_chat.id,
+            text=message_text.FIND_USAGE)
+        return
+    found_books = await search_books(query, config.SEARCH_RESULTS_COUNT)
+    if not found_books:
+        await sender.send_message(
+            context.bot,
+            chat_id=effective_chat.id,
+            text=message_text.FIND_NOTHING)
+        return
+
+    catalog = await get_catalog()
+    response = "Нашел такие книги:\n\n"
+    for book in found_books:
+        vote_number = catalog.vote_numbers.get(book.id)
+        if vote_number is None:
+            response += f"— {book.name} (уже читали)\n"
+        else:
+            response += f"{vote_number}. {book.name}\n"
+    response += "\nНомера можно использовать в /vote"
+    await sender.send_message(
+        context.bot,
+        chat_id=effective_chat.id,
+        text=response)
+
+
+async def reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop cached catalog and voting after the database was edited by hand"""
+    effective_chat = update.effective_chat
+    if not effective_chat:
+        logger.warning("effective_chat is None in /reload")
+        return
+    effective_user = update.effective_user
+    if effective_user is None or effective_user.id not in config.ADMIN_TELEGRAM_IDS:
+        return
+    invalidate_catalog()
+    invalidate_actual_voting()
+    await storage.get_storage().notify_reload()
+    await sender.send_message(
+        context.bot,
+        chat_id=effective_chat.id,
+        text=message_text.RELOADED)
+
+
+async def _send_rendered(context: ContextTypes.DEFAULT_TYPE,
+                         chat_id: int,
+                         command: str):
+    await sender.send(context.bot, chat_id, await responses.render(command))
+
+
+_update_votings_task: asyncio.Task | None = None
+
+
+async def post_init(application: Application):
+    global _update_votings_task
+    # the sqlite storage opens the db pool, postgres leaves it closed
+    await storage.connect()
+    if config.STORAGE_BACKEND == "sqlite":
+        await query_plans.check_query_plans()
+    await responses.warm_up()
+    await vote_writer.start()
+    await vote_mode.load()
+    await metrics_server.start()
+    live_results.notify(application.bot)
+    if application.job_queue is None:
+        # without python-telegram-bot[job-queue] a plain task does the job
+        _update_votings_task = asyncio.create_task(
+            workers.update_votings_periodically(application.bot))
+    else:
+        application.job_queue.run_repeating(
+            update_votings, interval=config.SNAPSHOT_INTERVAL, first=0)
+
+
+async def post_shutdown(application: Application):
+    global _update_votings_task
+    if _update_votings_task is not None:
+        _update_votings_task.cancel()
+        await asyncio.gather(_update_votings_task, return_exceptions=True)
+        _update_votings_task = None
+    await announcements.stop()
+    await live_results.stop()
+    await metrics_server.stop()
+    await vote_writer.stop()
+    await storage.close()
+    await db.close()
+
+
+def build_application(token: str,
+                      base_url: str | None = None,
+                      concurrent_updates: int = config.UPDATE_CONCURRENCY
+                      ) -> Application:
+    """Application with every handler registered and instrumented.
+
+    Updates of different users are handled concurrently, up to
+    concurrent_updates at once, each user's and chat's in order."""
+    application_builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(OrderedUpdateProcessor(concurrent_updates))
+    )
+    if base_url:
+        application_builder = application_builder.base_url(base_url)
+    application = application_builder.build()
 
     start_handler = CommandHandler("start", start)
     application.add_handler(start_handler)
@@ -226,7 +410,43 @@ if __name__ == "__main__":
     vote_results_handler = CommandHandler("voteresults", vote_results)
     application.add_handler(vote_results_handler)
 
-    application.run_polling()
+    catalog_page_handler = CallbackQueryHandler(catalog_page, pattern=r"^page:")
+    application.add_handler(catalog_page_handler)
+
+    history_handler = CommandHandler("history", history)
+    application.add_handler(history_handler)
+
+    find_handler = CommandHandler("find", find)
+    application.add_handler(find_handler)
+
+    reload_handler = CommandHandler("reload", reload)
+    application.add_handler(reload_handler)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = metrics.instrument_handler(handler.callback)
+
+    return application
+
+
+if __name__ == "__main__":
+    if config.WORKER_PROCESSES:
+        workers.run(TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL, config.WORKER_PROCESSES)
+    else:
+        application = build_application(TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL)
+
+        if config.WEBHOOK_URL:
+            # updates are queued as soon as they are decoded, handlers run
+            # separately, so Telegram's requests never wait for a reply
+            application.run_webhook(
+                listen=config.WEBHOOK_LISTEN,
+                port=config.WEBHOOK_PORT,
+                url_path=config.WEBHOOK_PATH,
+                webhook_url=config.WEBHOOK_URL,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS)
+        else:
+            application.run_polling()
 
 
 #TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
@@ -14,7 +14,9 @@ GREETINGS = """Привет!
 /already - прочитанные книги
 /now - книга, которую сейчас читаем
 /vote - проголосовать за следующую книгу 
+/find - найти книгу по названию или автору
 /voteresults - результат ткущего голосования
+/history - результаты прошлых голосований
 """
 
 HELP = """Наш книжный клуб работает по ежемесячной подписке, которая \
@@ -56,3 +58,42 @@ NO_ACTUAL_VOTING = """"Сейчас нет активного голосован
 NO_VOTE_RESULT = """Сейчас нет активного голосования, поэтому нет его результатов :)
 """
 
+
+NO_HISTORY = """Пока нет завершенных голосований.
+"""
+
+VOTING_OPENED = """Началось голосование за следующую книгу! Оно идет с {start} по {finish}.
+
+Чтобы проголосовать, отправь /vote
+"""
+
+VOTING_CLOSED = """Голосование с {start} по {finish} завершилось. Лидеры:
+
+{leaders}
+Подробнее: /history
+"""
+
+RELOADED = """Кэш каталога и голосования сброшен.
+"""
+
+FIND_USAGE = """Напиши, что искать, например так:
+/find чистый код
+"""
+
+FIND_NOTHING = """Не нашел таких книг, попробуй написать по-другому.
+"""
+
+VOTE_PAGED = """Выше список книг, за которые можно проголосовать, \
+листай его кнопками под сообщением.
+
+Тебе нужно выбрать три книги.
+
+Пришли в ответном сообщении номера книг, которые ты хочешь прочитать. 
+Номера можно разделить пробелами, запятыми или переносом строк.
+
+Обрати внимание, что порядок важен - на первом месте книга, которую \
+ты максимально хочешь прочесть сейчас.
+"""
+
+EMPTY_LIST = """Список пуст.
+"""
@@ -0,0 +1,134 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable
+import zlib
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclass
+class Histogram:
+    counts: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    total: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+@dataclass
+class Series:
+    latency: Histogram = field(default_factory=Histogram)
+    errors: int = 0
+    rows: int = 0
+
+
+handlers: dict[str, Series] = {}
+queries: dict[str, Series] = {}
+_query_labels: dict[str, str] = {}
+
+
+def instrument_handler(callback: Callable[..., Awaitable[Any]]
+                       ) -> Callable[..., Awaitable[Any]]:
+    """Wrap a handler callback to record its latency and errors"""
+    series = handlers.setdefault(callback.__name__, Series())
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            series.errors += 1
+            raise
+        finally:
+            series.latency.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class QueryTimer:
+    """Context manager recording latency, errors and rows of one SQL execution.
+
+    Set .rows inside the block when the statement returns rows."""
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.rows = 0
+
+    def __enter__(self) -> "QueryTimer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        elapsed = time.perf_counter() - self._started
+        label = get_query_label(self.sql)
+        series = queries.get(label)
+        if series is None:
+            series = queries[label] = Series()
+        series.latency.observe(elapsed)
+        series.rows += self.rows
+        if exc_type is not None:
+            series.errors += 1
+        if (config.SLOW_QUERY_SECONDS is not None
+                and elapsed >= config.SLOW_QUERY_SECONDS):
+            logger.warning("Slow query took %.1f ms: %s",
+                           elapsed * 1000, " ".join(self.sql.split()))
+
+
+def get_query_label(sql: str) -> str:
+    """Short stable label for a SQL text: its first words and a checksum,
+    as queries built on the same base sql share their first words"""
+    label = _query_labels.get(sql)
+    if label is None:
+        text = " ".join(sql.split())
+        label = _query_labels[sql] = f"{text[:60]} [{zlib.crc32(text.encode()):08x}]"
+    return label
+
+
+def render_prometheus(gauges: dict[str, float] | None = None) -> str:
+    lines = []
+    _render_series(lines, "bot_handler", "handler", handlers)
+    _render_series(lines, "bot_query", "query", queries)
+    for name, value in (gauges or {}).items():
+        # by Prometheus naming, *_total values only ever grow
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _render_series(lines: list[str], prefix: str, label: str,
+                   series_by_name: dict[str, Series]) -> None:
+    lines.append(f"# TYPE {prefix}_seconds histogram")
+    for name, series in series_by_name.items():
+        labels = f'{label}="{_escape(name)}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), series.latency.counts):
+            cumulative += count
+            lines.append(f'{prefix}_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{prefix}_seconds_sum{{{labels}}} {series.latency.total}")
+        lines.append(f"{prefix}_seconds_count{{{labels}}} {series.latency.count}")
+    lines.append(f"# TYPE {prefix}_errors_total counter")
+    for name, series in series_by_name.items():
+        lines.append(f'{prefix}_errors_total{{{label}="{_escape(name)}"}} {series.errors}')
+    if prefix == "bot_query":
+        lines.append(f"# TYPE {prefix}_rows_total counter")
+        for name, series in series_by_name.items():
+            lines.append(f'{prefix}_rows_total{{{label}="{_escape(name)}"}} {series.rows}')
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+
+from announcements import get_announcement_stats
+import config
+import db
+from live_results import get_live_results_stats
+import metrics
+from responses import get_render_cache_stats
+from sender import get_sender_stats
+from update_processor import get_update_processor_stats
+from vote_mode import get_vote_mode_stats
+from vote_writer import get_vote_writer_stats
+
+
+logger = logging.getLogger(__name__)
+
+_server: asyncio.Server | None = None
+
+
+def get_gauges() -> dict[str, float]:
+    gauges = {}
+    for name, stats in db.get_pool_stats().items():
+        gauges[f"bot_db_{name}_acquired_total"] = stats.acquired
+        gauges[f"bot_db_{name}_wait_seconds_total"] = stats.total_wait
+        gauges[f"bot_db_{name}_wait_seconds_max"] = stats.max_wait
+    render_cache = get_render_cache_stats()
+    gauges["bot_render_cache_hits_total"] = render_cache.hits
+    gauges["bot_render_cache_misses_total"] = render_cache.misses
+    sender = get_sender_stats()
+    gauges["bot_sender_queue_depth"] = sender.queue_depth
+    gauges["bot_sender_sent_total"] = sender.sent
+    gauges["bot_sender_failed_total"] = sender.failed
+    gauges["bot_sender_retries_total"] = sender.retries
+    gauges["bot_sender_latency_seconds_total"] = sender.total_latency
+    vote_writer = get_vote_writer_stats()
+    gauges["bot_vote_writer_ballots_total"] = vote_writer.ballots
+    gauges["bot_vote_writer_batches_total"] = vote_writer.batches
+    gauges["bot_vote_writer_ballots_per_second"] = vote_writer.ballots_per_second
+    updates = get_update_processor_stats()
+    gauges["bot_updates_processed_total"] = updates.processed
+    gauges["bot_updates_ordered_waits_total"] = updates.ordered_waits
+    gauges["bot_updates_in_flight"] = updates.in_flight
+    announcements = get_announcement_stats()
+    gauges["bot_announcement_sent_total"] = announcements.sent
+    gauges["bot_announcement_blocked_total"] = announcements.blocked
+    gauges["bot_announcement_failed_total"] = announcements.failed
+    gauges["bot_announcement_in_flight"] = announcements.in_flight
+    live = get_live_results_stats()
+    gauges["bot_live_results_refreshes_total"] = live.refreshes
+    gauges["bot_live_results_edits_total"] = live.edits
+    gauges["bot_live_results_skipped_total"] = live.skipped
+    gauges["bot_live_results_coalesced_total"] = live.coalesced
+    gauges["bot_live_results_failed_total"] = live.failed
+    vote_mode = get_vote_mode_stats()
+    gauges["bot_vote_mode_entered_total"] = vote_mode.entered
+    gauges["bot_vote_mode_fast_path_total"] = vote_mode.fast_path
+    gauges["bot_vote_mode_messages_total"] = vote_mode.vote_mode
+    return gauges
+
+
+async def start() -> None:
+    """Serve Prometheus text metrics on config.METRICS_PORT, if it is set"""
+    global _server
+    if config.METRICS_PORT is None or _server is not None:
+        return
+    _server = await asyncio.start_server(
+        _handle, config.METRICS_LISTEN, config.METRICS_PORT)
+    logger.info("Serving metrics on %s:%s", config.METRICS_LISTEN, config.METRICS_PORT)
+
+
+async def stop() -> None:
+    global _server
+    if _server is None:
+        return
+    _server.close()
+    await _server.wait_closed()
+    _server = None
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        # any request gets the metrics, the request itself is not inspected
+        while (await reader.readline()).strip():
+            pass
+        body = metrics.render_prometheus(get_gauges()).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
@@ -0,0 +1,42 @@
+import logging
+from pathlib import Path
+import re
+
+import aiosqlite
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+
+async def migrate(connection: aiosqlite.Connection) -> int:
+    """Apply numbered migrations newer than the database's user_version.
+
+    Every migration runs in its own transaction together with the
+    user_version bump, so a failed migration leaves nothing behind."""
+    async with connection.execute("pragma user_version") as cursor:
+        current_version = (await cursor.fetchone())[0]
+    for version, path in _get_migrations():
+        if version <= current_version:
+            continue
+        logger.info("Applying migration %s", path.name)
+        try:
+            await connection.executescript(
+                f"begin;\n{path.read_text(encoding='utf-8')}\n"
+                f"pragma user_version = {version};\ncommit;")
+        except Exception:
+            await connection.rollback()
+            raise
+        current_version = version
+    return current_version
+
+
+def _get_migrations() -> list[tuple[int, Path]]:
+    migrations = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        match = re.match(r"(\d+)_", path.name)
+        if match is None:
+            continue
+        migrations.append((int(match.group(1)), path))
+    return sorted(migrations)
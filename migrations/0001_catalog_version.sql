@@ -0,0 +1,42 @@
+create table if not exists catalog_version (
+  id integer primary key check (id = 1),
+  version integer not null
+);
+
+insert or ignore into catalog_version (id, version) values (1, 0);
+
+create trigger if not exists book_category_after_insert_catalog_version
+after insert on book_category
+begin
+  update catalog_version set version = version + 1;
+end;
+
+create trigger if not exists book_category_after_update_catalog_version
+after update on book_category
+begin
+  update catalog_version set version = version + 1;
+end;
+
+create trigger if not exists book_category_after_delete_catalog_version
+after delete on book_category
+begin
+  update catalog_version set version = version + 1;
+end;
+
+create trigger if not exists book_after_insert_catalog_version
+after insert on book
+begin
+  update catalog_version set version = version + 1;
+end;
+
+create trigger if not exists book_after_update_catalog_version
+after update on book
+begin
+  update catalog_version set version = version + 1;
+end;
+
+create trigger if not exists book_after_delete_catalog_version
+after delete on book
+begin
+  update catalog_version set version = version + 1;
+end;
@@ -0,0 +1,11 @@
+-- /already and /now: range on read_start, covering the selected book columns
+create index if not exists book_read_dates_idx
+  on book(read_start, read_finish, category_id, name);
+
+-- actual voting lookup and next voting start
+create index if not exists voting_dates_idx
+  on voting(voting_start, voting_finish);
+
+-- tally load and verification read all ballots of one voting
+create index if not exists vote_ballots_idx
+  on vote(vote_id, user_id, first_book_id, second_book_id, third_book_id);
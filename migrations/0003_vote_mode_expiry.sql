@@ -0,0 +1,6 @@
+drop table if exists bot_user_in_vote_mode;
+
+create table bot_user_in_vote_mode (
+  user_id bigint primary key,
+  expires_at integer not null
+);
@@ -0,0 +1,44 @@
+create virtual table book_fts using fts5(title, author, tokenize='trigram');
+
+insert into book_fts (rowid, title, author)
+select id,
+       case when instr(name, ' :: ') > 0
+            then substr(name, 1, instr(name, ' :: ') - 1)
+            else coalesce(name, '') end,
+       case when instr(name, ' :: ') > 0
+            then substr(name, instr(name, ' :: ') + 4)
+            else '' end
+from book;
+
+create trigger book_after_insert_fts
+after insert on book
+begin
+  insert into book_fts (rowid, title, author)
+  values (new.id,
+          case when instr(new.name, ' :: ') > 0
+               then substr(new.name, 1, instr(new.name, ' :: ') - 1)
+               else coalesce(new.name, '') end,
+          case when instr(new.name, ' :: ') > 0
+               then substr(new.name, instr(new.name, ' :: ') + 4)
+               else '' end);
+end;
+
+create trigger book_after_update_fts
+after update of id, name on book
+begin
+  delete from book_fts where rowid = old.id;
+  insert into book_fts (rowid, title, author)
+  values (new.id,
+          case when instr(new.name, ' :: ') > 0
+               then substr(new.name, 1, instr(new.name, ' :: ') - 1)
+               else coalesce(new.name, '') end,
+          case when instr(new.name, ' :: ') > 0
+               then substr(new.name, instr(new.name, ' :: ') + 4)
+               else '' end);
+end;
+
+create trigger book_after_delete_fts
+after delete on book
+begin
+  delete from book_fts where rowid = old.id;
+end;
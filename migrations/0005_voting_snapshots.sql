@@ -0,0 +1,17 @@
+create table if not exists voting_snapshot (
+  voting_id integer primary key,
+  rule text not null,
+  ballots integer not null,
+  frozen_at text not null,
+  foreign key(voting_id) references voting(id)
+);
+
+create table if not exists voting_snapshot_book (
+  voting_id integer not null,
+  place integer not null,
+  book_id integer,
+  book_name text,
+  score real not null,
+  foreign key(voting_id) references voting_snapshot(voting_id),
+  primary key(voting_id, place)
+) without rowid;
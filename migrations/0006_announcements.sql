@@ -0,0 +1,23 @@
+-- set when a message to the user fails with Forbidden, cleared when they vote again
+alter table bot_user add column blocked_at timestamp;
+
+create table if not exists announcement (
+  id integer primary key,
+  kind text not null,
+  voting_id integer,
+  text text not null,
+  created_at timestamp default current_timestamp not null,
+  -- every bot_user up to this telegram_id has a delivery row
+  last_user_id bigint not null default 0,
+  finished_at timestamp,
+  foreign key(voting_id) references voting(id),
+  unique(kind, voting_id)
+);
+
+create table if not exists announcement_delivery (
+  announcement_id integer not null,
+  user_id bigint not null,
+  status text not null,
+  foreign key(announcement_id) references announcement(id),
+  primary key(announcement_id, user_id)
+) without rowid;
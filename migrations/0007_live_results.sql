@@ -0,0 +1,9 @@
+-- the live results message of every configured chat, edited as votes arrive
+create table if not exists live_results_message (
+  chat_id bigint primary key,
+  voting_id integer not null,
+  message_id integer not null,
+  -- text last shown, an edit is skipped while the standings render the same
+  text text not null,
+  updated_at timestamp default current_timestamp not null
+);
@@ -0,0 +1,129 @@
+-- schema of the postgres storage, applied by storage_postgres on connect
+create table if not exists bot_user (
+  telegram_id bigint primary key,
+  created_at timestamp default current_timestamp not null,
+  blocked_at timestamp
+);
+
+create table if not exists book_category (
+  id integer generated by default as identity primary key,
+  created_at timestamp default current_timestamp not null,
+  name varchar(60) not null unique,
+  ordering integer not null unique
+);
+
+create table if not exists book (
+  id integer generated by default as identity primary key,
+  created_at timestamp default current_timestamp not null,
+  name text,
+  category_id integer references book_category(id),
+  ordering integer not null,
+  read_start date,
+  read_finish date,
+  read_comments text,
+  check (
+    (
+      read_finish > read_start
+      and read_finish is not null
+      and read_start is not null
+    ) or (
+      read_finish is null or read_start is null
+    )
+  ),
+  unique(category_id, ordering)
+);
+
+create table if not exists voting (
+  id integer generated by default as identity primary key,
+  voting_start date not null unique,
+  voting_finish date not null unique,
+  check (voting_finish > voting_start)
+);
+
+create table if not exists vote (
+  vote_id integer references voting(id),
+  user_id bigint references bot_user(telegram_id),
+  first_book_id integer references book(id),
+  second_book_id integer references book(id),
+  third_book_id integer references book(id),
+  primary key(vote_id, user_id)
+);
+
+create table if not exists voting_snapshot (
+  voting_id integer primary key references voting(id),
+  rule text not null,
+  ballots integer not null,
+  frozen_at timestamptz not null
+);
+
+create table if not exists voting_snapshot_book (
+  voting_id integer not null references voting_snapshot(voting_id),
+  place integer not null,
+  book_id integer,
+  book_name text,
+  score real not null,
+  primary key(voting_id, place)
+);
+
+create index if not exists book_read_dates_idx
+  on book(read_start, read_finish, category_id, name);
+
+create index if not exists voting_dates_idx
+  on voting(voting_start, voting_finish);
+
+-- trigrams of book titles and authors, what book_fts is in sqlite,
+-- weight 2 for a trigram of the title and 1 of the author
+create table if not exists book_trigram (
+  trigram text not null,
+  book_id integer not null references book(id) on update cascade on delete cascade,
+  weight integer not null,
+  primary key(trigram, book_id)
+);
+
+create or replace function index_book_trigrams() returns trigger as $$
+begin
+  delete from book_trigram where book_id = new.id;
+  insert into book_trigram (trigram, book_id, weight)
+  select trigram, new.id, sum(weight)
+  from (
+    select distinct substr(t.text, i, 3) as trigram, t.weight
+    from (values
+           (lower(split_part(coalesce(new.name, ''), ' :: ', 1)), 2),
+           (lower(case when strpos(new.name, ' :: ') > 0
+                       then substr(new.name, strpos(new.name, ' :: ') + 4)
+                       else '' end), 1)
+         ) as t(text, weight),
+         generate_series(1, length(t.text) - 2) as i
+  ) trigrams
+  group by trigram;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace trigger book_trigram_index
+after insert or update of name on book
+for each row execute function index_book_trigrams();
+
+create table if not exists catalog_version (
+  id integer primary key check (id = 1),
+  version integer not null
+);
+
+insert into catalog_version (id, version) values (1, 0)
+on conflict do nothing;
+
+-- once per statement, a bulk catalog change bumps the version once
+create or replace function bump_catalog_version() returns trigger as $$
+begin
+  update catalog_version set version = version + 1 where id = 1;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace trigger book_category_catalog_version
+after insert or update or delete on book_category
+for each statement execute function bump_catalog_version();
+
+create or replace trigger book_catalog_version
+after insert or update or delete on book
+for each statement execute function bump_catalog_version();
@@ -0,0 +1,93 @@
+"""EXPLAIN QUERY PLAN checks of the hot queries.
+
+    python -m query_plans --db bench.sqlite3
+
+exits with status 1 if any of them scans a table without an index."""
+import argparse
+import asyncio
+import logging
+import sys
+
+import config
+import db
+import storage
+
+
+logger = logging.getLogger(__name__)
+
+HOT_QUERIES = {
+    "already_read_books": storage._ALREADY_READ_BOOKS_SQL,
+    "now_reading_books": storage._NOW_READING_BOOKS_SQL,
+    "actual_voting": storage._ACTUAL_VOTING_SQL,
+    "next_voting_start": storage._NEXT_VOTING_START_SQL,
+    "load_tally": storage._LOAD_BALLOTS_SQL,
+    "tally_scores": storage._SCORES_SQL,
+    "history": storage._HISTORY_SQL,
+}
+
+_PARAMS = {
+    "today": "2000-01-01",
+    "voting_id": 0,
+    "count": 0,
+    "weight_0": 0,
+    "weight_1": 0,
+    "weight_2": 0,
+}
+
+
+async def get_table_scans() -> dict[str, list[str]]:
+    """Return plan lines of hot queries that scan a table without an index"""
+    scans = {}
+    for name, sql in HOT_QUERIES.items():
+        rows = await db.fetchall("explain query plan " + sql, _PARAMS)
+        # subqueries show up as "SCAN <alias>" too, they are not tables
+        subqueries = {row["detail"].split()[-1] for row in rows
+                      if row["detail"].startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+        details = [row["detail"] for row in rows
+                   if row["detail"].startswith("SCAN ")
+                   and " USING " not in row["detail"]
+                   and row["detail"].split()[1] not in subqueries]
+        if details:
+            scans[name] = details
+    return scans
+
+
+class QueryPlanError(Exception):
+    pass
+
+
+async def check_query_plans(strict: bool | None = None) -> bool:
+    """Log hot queries doing full table scans, raise QueryPlanError if
+    strict, config.QUERY_PLANS_STRICT by default"""
+    if strict is None:
+        strict = config.QUERY_PLANS_STRICT
+    scans = await get_table_scans()
+    for name, details in scans.items():
+        logger.warning("Hot query %s does a full table scan: %s",
+                       name, "; ".join(details))
+    if scans and strict:
+        raise QueryPlanError(f"Full table scans in hot queries: {', '.join(scans)}")
+    return not scans
+
+
+async def _main(args: argparse.Namespace) -> bool:
+    if args.db:
+        config.SQLITE_DB_FILE = args.db
+    await db.connect()
+    try:
+        return await check_query_plans(strict=False)
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help=f"database, {config.SQLITE_DB_FILE} by default")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if not asyncio.run(_main(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+from typing import Awaitable, Callable, Hashable, Iterable
+
+import telegram
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import config
+import db
+from books import (
+    Catalog,
+    get_catalog,
+    get_already_read_books,
+    get_now_reading_book
+)
+import message_text
+from sender import OutgoingMessage, pack
+from votings import VoteResult
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RenderCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class RenderCache:
+    """LRU cache of rendered messages keyed by (command, catalog version, date)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.stats = RenderCacheStats()
+        self._items: OrderedDict[Hashable, tuple[OutgoingMessage, ...]] = OrderedDict()
+
+    def get(self, key: Hashable) -> tuple[OutgoingMessage, ...] | None:
+        messages = self._items.get(key)
+        if messages is None:
+            self.stats.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.stats.hits += 1
+        return messages
+
+    def put(self, key: Hashable, messages: Iterable[OutgoingMessage]) -> None:
+        self._items[key] = tuple(messages)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+_cache = RenderCache(config.RENDER_CACHE_SIZE)
+
+
+async def render(command: str) -> tuple[OutgoingMessage, ...]:
+    catalog = await get_catalog()
+    key = (command, catalog.version, db.current_date())
+    messages = _cache.get(key)
+    if messages is None:
+        messages = tuple(pack(await _RENDERERS[command](catalog)))
+        _cache.put(key, messages)
+    return messages
+
+
+async def render_page(kind: str, page: int) -> OutgoingMessage:
+    """One page of a catalog listing with its navigation keyboard"""
+    catalog = await get_catalog()
+    key = (kind + "/pages", catalog.version, db.current_date())
+    pages = _cache.get(key)
+    if pages is None:
+        pages = _paginate(kind, await _PAGE_RENDERERS[kind](catalog))
+        _cache.put(key, pages)
+    return pages[min(max(page, 0), len(pages) - 1)]
+
+
+async def warm_up() -> None:
+    for command in _RENDERERS:
+        await render(command)
+    for kind in _PAGE_RENDERERS:
+        await render_page(kind, 0)
+    logger.info("Render cache warmed up with %s commands",
+                len(_RENDERERS) + len(_PAGE_RENDERERS))
+
+
+def format_vote_results(result: VoteResult) -> str:
+    """Standings of a voting, for /voteresults and the live results message"""
+    response = "ТОП 10 книг голосования:\n\n"
+    for index, book in enumerate(result.leaders, 1):
+        response += f"{index}. {book.book_name} с рейтингом {book.score:g}\n"
+    response += f"\nДаты голосования: с {result.voting.voting_start} по {result.voting.voting_finish}"
+    return response
+
+
+def get_page_kinds() -> Iterable[str]:
+    return _PAGE_RENDERERS.keys()
+
+
+def get_render_cache_stats() -> RenderCacheStats:
+    return _cache.stats
+
+
+def _paginate(kind: str, sections: list[OutgoingMessage]) -> list[OutgoingMessage]:
+    pages = pack(sections, config.CATALOG_PAGE_LENGTH) or [
+        OutgoingMessage(message_text.EMPTY_LIST)]
+    paginated = []
+    for page, message in enumerate(pages):
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton(
+                "◀", callback_data=f"page:{kind}:{page - 1}"))
+        buttons.append(InlineKeyboardButton(
+            f"{page + 1}/{len(pages)}", callback_data="page:noop"))
+        if page < len(pages) - 1:
+            buttons.append(InlineKeyboardButton(
+                "▶", callback_data=f"page:{kind}:{page + 1}"))
+        paginated.append(OutgoingMessage(
+            message.text, message.parse_mode, InlineKeyboardMarkup([buttons])))
+    return paginated
+
+
+async def _render_all_books(catalog: Catalog) -> list[OutgoingMessage]:
+    messages = []
+    for category in catalog.categories:
+        lines = [f"*{category.name}*\n\n"]
+        for index, book in enumerate(category.books, 1):
+            lines.append(f"{index}. {book.name}\n")
+        messages.append(OutgoingMessage(
+            "".join(lines), telegram.constants.ParseMode.MARKDOWN))
+    return messages
+
+
+async def _render_already(catalog: Catalog) -> list[OutgoingMessage]:
+    lines = ["Прочитанные книги:\n\n"]
+    for index, book in enumerate(await get_already_read_books(), 1):
+        lines.append(f"{index}. {book.name} "
+                     f"(читали с {book.read_start} по {book.read_finish})\n")
+    return [OutgoingMessage("".join(lines))]
+
+
+async def _render_now(catalog: Catalog) -> list[OutgoingMessage]:
+    now_read_books = await get_now_reading_book()
+    if not now_read_books:
+        return []
+    lines = ["Сейчас мы читаем:\n\n"]
+    just_one_book = len(now_read_books) == 1
+    for index, book in enumerate(now_read_books, 1):
+        lines.append(f"{str(index) + '. ' if just_one_book else ''}. {book.name} "
+                     f"(читали с {book.read_start} по {book.read_finish})\n")
+    return [OutgoingMessage("".join(lines))]
+
+
+async def _render_vote(catalog: Catalog) -> list[OutgoingMessage]:
+    messages = await _render_not_started_books(catalog)
+    messages.append(OutgoingMessage(
+        message_text.VOTE, telegram.constants.ParseMode.MARKDOWN))
+    return messages
+
+
+async def _render_not_started_books(catalog: Catalog) -> list[OutgoingMessage]:
+    messages = []
+    index = 1
+    for category in catalog.not_started:
+        lines = [f"*{category.name}*\n\n"]
+        for book in category.books:
+            lines.append(f"{index}. {book.name}\n")
+            index += 1
+        messages.append(OutgoingMessage(
+            "".join(lines), telegram.constants.ParseMode.MARKDOWN))
+    return messages
+
+
+_RENDERERS: dict[str, Callable[[Catalog], Awaitable[list[OutgoingMessage]]]] = {
+    "allbooks": _render_all_books,
+    "already": _render_already,
+    "now": _render_now,
+    "vote": _render_vote,
+}
+
+_PAGE_RENDERERS: dict[str, Callable[[Catalog], Awaitable[list[OutgoingMessage]]]] = {
+    "allbooks": _render_all_books,
+    "vote": _render_not_started_books,
+}
@@ -0,0 +1,295 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+import functools
+import logging
+import time
+from typing import Awaitable, Callable, Iterable
+
+import telegram
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class OutgoingMessage:
+    text: str
+    parse_mode: str | None = None
+    reply_markup: telegram.InlineKeyboardMarkup | None = None
+
+
+@dataclass
+class SenderStats:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.sent if self.sent else 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(chat.jobs) for chat in _chats.values())
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def get_refill_delay(self) -> float:
+        """Seconds until the bucket is full again"""
+        self._refill()
+        return max(0.0, (self.capacity - self._tokens) / self.rate)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+@dataclass
+class _Job:
+    request: Callable[[], Awaitable]
+    done: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    jobs: deque[_Job] = field(default_factory=deque)
+    task: asyncio.Task | None = None
+
+
+_chats: dict[int, _Chat] = {}
+_global_bucket = TokenBucket(config.SEND_GLOBAL_RATE, config.SEND_GLOBAL_RATE)
+_stats = SenderStats()
+
+
+def pack(messages: Iterable[OutgoingMessage],
+         limit: int = MessageLimit.MAX_TEXT_LENGTH) -> list[OutgoingMessage]:
+    """Join consecutive messages with the same parse mode into as few
+    messages as fit into the text length limit"""
+    packed = []
+    for message in messages:
+        for text in _split(message.text, limit):
+            if (packed
+                    and packed[-1].parse_mode == message.parse_mode
+                    and packed[-1].reply_markup is None
+                    and message.reply_markup is None
+                    and len(packed[-1].text) + 1 + len(text) <= limit):
+                packed[-1] = OutgoingMessage(
+                    packed[-1].text + "\n" + text, message.parse_mode)
+                continue
+            packed.append(OutgoingMessage(
+                text, message.parse_mode, message.reply_markup))
+    return packed
+
+
+async def send(bot: telegram.Bot,
+               chat_id: int,
+               messages: Iterable[OutgoingMessage]) -> list[telegram.Message]:
+    """Queue messages for the chat and wait until all of them are sent.
+
+    Messages of one chat are sent strictly in order, respecting both the
+    per-chat and the global rate limits."""
+    return await _enqueue(chat_id, (
+        functools.partial(
+            bot.send_message,
+            chat_id=chat_id,
+            text=message.text,
+            parse_mode=message.parse_mode,
+            reply_markup=message.reply_markup)
+        for message in messages
+    ))
+
+
+async def send_message(bot: telegram.Bot,
+                       chat_id: int,
+                       text: str,
+                       parse_mode: str | None = None) -> None:
+    await send(bot, chat_id, (OutgoingMessage(text, parse_mode),))
+
+
+async def edit_message(bot: telegram.Bot,
+                       chat_id: int,
+                       message_id: int,
+                       message: OutgoingMessage) -> None:
+    """Replace text of an already sent message, in order with the chat's sends.
+
+    An edit to the text and buttons the message already has succeeds."""
+    await _enqueue(chat_id, (functools.partial(
+        _edit_message_text,
+        bot,
+        chat_id=chat_id,
+        message_id=message_id,
+        text=message.text,
+        parse_mode=message.parse_mode,
+        reply_markup=message.reply_markup),))
+
+
+async def pin_message(bot: telegram.Bot, chat_id: int, message_id: int) -> None:
+    """Pin a message silently, in order with the chat's sends"""
+    await _enqueue(chat_id, (functools.partial(
+        bot.pin_chat_message,
+        chat_id=chat_id,
+        message_id=message_id,
+        disable_notification=True),))
+
+
+async def unpin_message(bot: telegram.Bot, chat_id: int, message_id: int) -> None:
+    await _enqueue(chat_id, (functools.partial(
+        bot.unpin_chat_message,
+        chat_id=chat_id,
+        message_id=message_id),))
+
+
+def get_sender_stats() -> SenderStats:
+    return _stats
+
+
+async def _enqueue(chat_id: int, requests: Iterable[Callable[[], Awaitable]]) -> list:
+    """Run requests in the chat's queue, return their results in order"""
+    chat = _chats.get(chat_id)
+    if chat is None:
+        chat = _chats[chat_id] = _Chat(_get_chat_bucket(chat_id))
+    loop = asyncio.get_running_loop()
+    futures = []
+    for request in requests:
+        future = loop.create_future()
+        chat.jobs.append(_Job(request, future))
+        futures.append(future)
+    if chat.task is None:
+        chat.task = asyncio.create_task(_run_chat(chat_id, chat))
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def _get_chat_bucket(chat_id: int) -> TokenBucket:
+    # negative ids belong to groups and channels, which have stricter limits
+    if chat_id < 0:
+        return TokenBucket(config.SEND_GROUP_RATE, config.SEND_CHAT_BURST)
+    return TokenBucket(config.SEND_CHAT_RATE, config.SEND_CHAT_BURST)
+
+
+async def _run_chat(chat_id: int, chat: _Chat) -> None:
+    try:
+        while chat.jobs:
+            job = chat.jobs.popleft()
+            await chat.bucket.acquire()
+            await _global_bucket.acquire()
+            await _send_with_retry(chat_id, job)
+    finally:
+        chat.task = None
+        # keep the chat while its bucket refills, so bursts stay limited,
+        # then forget it so one-off chats do not pile up
+        if not chat.jobs:
+            asyncio.get_running_loop().call_later(
+                chat.bucket.get_refill_delay(), _forget_chat, chat_id, chat)
+
+
+async def _edit_message_text(bot: telegram.Bot, **kwargs):
+    try:
+        return await bot.edit_message_text(**kwargs)
+    except BadRequest as error:
+        # e.g. a page button pressed again before the page was replaced
+        if "message is not modified" not in str(error).lower():
+            raise
+        return True
+
+
+def _forget_chat(chat_id: int, chat: _Chat) -> None:
+    if _chats.get(chat_id) is chat and chat.task is None and not chat.jobs:
+        del _chats[chat_id]
+
+
+async def _send_with_retry(chat_id: int, job: _Job) -> None:
+    error = None
+    for attempt in range(config.SEND_MAX_RETRIES + 1):
+        try:
+            result = await job.request()
+        except RetryAfter as retry_error:
+            error = retry_error
+            delay = _get_seconds(retry_error.retry_after)
+        except BadRequest as bad_request:
+            error = bad_request
+            break
+        except Forbidden as forbidden:
+            # the user blocked the bot, it is not worth an error
+            _stats.failed += 1
+            logger.info("Not allowed to message %s: %s", chat_id, forbidden)
+            if not job.done.done():
+                job.done.set_exception(forbidden)
+            return
+        except NetworkError as network_error:
+            error = network_error
+            delay = config.SEND_BACKOFF_BASE * 2 ** attempt
+        except Exception as unexpected_error:
+            error = unexpected_error
+            break
+        else:
+            latency = time.monotonic() - job.queued_at
+            _stats.sent += 1
+            _stats.total_latency += latency
+            _stats.max_latency = max(_stats.max_latency, latency)
+            if not job.done.done():
+                job.done.set_result(result)
+            return
+        if attempt < config.SEND_MAX_RETRIES:
+            _stats.retries += 1
+            logger.warning("Retrying message to %s in %.1f s: %s",
+                           chat_id, delay, error)
+            await asyncio.sleep(delay)
+    _stats.failed += 1
+    logger.error("Failed to send message to %s: %s", chat_id, error)
+    if not job.done.done():
+        job.done.set_exception(error)
+
+
+def _get_seconds(retry_after: int | timedelta) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+def _split(text: str, limit: int) -> list[str]:
+    """Split text longer than the limit on line boundaries"""
+    if len(text) <= limit:
+        return [text]
+    parts = [""]
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(parts[-1]) + len(line) > limit:
+            parts.append("")
+        parts[-1] += line
+    return [part for part in parts if part]
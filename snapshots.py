@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+import logging
+
+from books import get_catalog
+import config
+import db
+import leaderboard
+from storage import SnapshotRow, get_storage
+import tally
+from votings import BookVoteResult, Voting, VoteResult
+
+
+logger = logging.getLogger(__name__)
+
+
+async def freeze_closed_votings() -> int:
+    """Snapshot final results of every finished voting without one yet.
+
+    The vote table of a voting is read once here, history is served from
+    the snapshot afterwards. Returns how many votings were frozen."""
+    voting_ids = await get_storage().get_unfrozen_votings(db.current_date())
+    for voting_id in voting_ids:
+        await _freeze(voting_id)
+    if voting_ids:
+        logger.info("Froze results of %s closed votings", len(voting_ids))
+    return len(voting_ids)
+
+
+async def get_history(count: int | None = None) -> list[VoteResult]:
+    """Results of the latest frozen votings, newest first"""
+    if count is None:
+        count = config.HISTORY_VOTINGS_COUNT
+    return _group_results(await get_storage().get_snapshots(count))
+
+
+async def get_result(voting_id: int) -> VoteResult | None:
+    """Frozen result of one voting, None until it is frozen"""
+    results = _group_results(await get_storage().get_snapshot(voting_id))
+    return results[0] if results else None
+
+
+def _group_results(rows: list[SnapshotRow]) -> list[VoteResult]:
+    results: dict[int, VoteResult] = {}
+    for voting_id, voting_start, voting_finish, place, book_name, score in rows:
+        result = results.get(voting_id)
+        if result is None:
+            result = results[voting_id] = VoteResult(
+                voting = Voting(
+                    id = voting_id,
+                    voting_start_day = voting_start.toordinal(),
+                    voting_finish_day = voting_finish.toordinal()
+                ),
+                leaders = []
+            )
+        if place is not None:
+            result.leaders.append(BookVoteResult(
+                book_name = book_name,
+                score = score
+            ))
+    return list(results.values())
+
+
+async def _freeze(voting_id: int) -> None:
+    ballots = await tally.load_ballots(voting_id)
+    ranking = tally.RULES[config.VOTE_RULE](ballots)[:config.SNAPSHOT_LEADERS_COUNT]
+    catalog = await get_catalog()
+    await get_storage().save_snapshot(
+        voting_id, config.VOTE_RULE, len(ballots.ranks), datetime.now(timezone.utc), [
+            (place, book_id,
+             catalog.books_by_id[book_id].name if book_id in catalog.books_by_id else None,
+             score)
+            for place, (book_id, score) in enumerate(ranking, 1)])
+    # nobody votes in a closed voting, its running tally is dead weight now
+    leaderboard.discard(voting_id)
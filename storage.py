@@ -0,0 +1,380 @@
+"""Storage of books, votings, votes and users behind one interface.
+
+config.STORAGE_BACKEND picks the implementation: "sqlite" keeps everything
+in config.SQLITE_DB_FILE through the db pool, "postgres" talks to
+config.POSTGRES_DSN through storage_postgres. Callers pass today's date
+in, so no query depends on the database's idea of current_date."""
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from typing import Callable, Iterable, Sequence
+
+import config
+from dates import JULIAN_DAY_OFFSET
+import db
+from metrics import QueryTimer
+
+
+# (voting_id, user_id, book_ids)
+BallotRow = tuple[int, int, tuple[int, ...]]
+# (voting_id, voting_start, voting_finish, place, book_name, score), place
+# and the rest None for a snapshot without books
+SnapshotRow = tuple[int, date, date, int | None, str | None, float | None]
+# (place, book_id, book_name, score)
+SnapshotBook = tuple[int, int, str | None, float]
+
+
+class Storage(ABC):
+    @abstractmethod
+    async def connect(self) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get_catalog_version(self) -> int:
+        """Number bumped on every change of books or categories"""
+
+    @abstractmethod
+    async def get_books(self) -> list[tuple]:
+        """Rows in books.Book field order, in catalog order"""
+
+    @abstractmethod
+    async def get_already_read_books(self, today: date) -> list[tuple]:
+        """Rows in books.Book field order of books finished by today"""
+
+    @abstractmethod
+    async def get_now_reading_books(self, today: date) -> list[tuple]:
+        """Rows in books.Book field order of books being read today"""
+
+    @abstractmethod
+    async def search_books(self, trigrams: set[str], limit: int) -> list[tuple[int, str, str]]:
+        """(book_id, title, author) of books sharing a trigram with the
+        query, best matches first"""
+
+    @abstractmethod
+    async def get_actual_voting(self, today: date) -> tuple[int, date, date] | None:
+        """(id, voting_start, voting_finish) of the voting going on today"""
+
+    @abstractmethod
+    async def get_next_voting_start(self, today: date) -> date | None:
+        pass
+
+    @abstractmethod
+    async def save_users(self, user_ids: Iterable[int]) -> None:
+        """Add users, marking users who had blocked the bot as reachable"""
+
+    @abstractmethod
+    async def save_ballots(self, ballots: Sequence[BallotRow],
+                           on_saved: Callable[[], None] | None = None) -> None:
+        """Save ballots and their users in one transaction, replacing the
+        users' previous ballots in the same voting.
+
+        on_saved is called before the commit, get_ballots cannot run
+        between the two."""
+
+    @abstractmethod
+    async def get_ballots(self, voting_id: int) -> list[tuple[int, ...]]:
+        """(user_id, *book_ids) of every ballot of the voting"""
+
+    @abstractmethod
+    async def get_scores(self, voting_id: int, weights: Sequence[int]) -> dict[int, int]:
+        """Non-zero weighted scores of books, aggregated by the database.
+
+        Like get_ballots, never runs between saving ballots and on_saved."""
+
+    @abstractmethod
+    async def get_unfrozen_votings(self, today: date) -> list[int]:
+        """Ids of votings finished before today without a snapshot"""
+
+    @abstractmethod
+    async def get_snapshots(self, count: int) -> list[SnapshotRow]:
+        """Books of the latest count snapshots, newest voting first"""
+
+    @abstractmethod
+    async def get_snapshot(self, voting_id: int) -> list[SnapshotRow]:
+        """Books of the voting's snapshot, nothing until it is frozen"""
+
+    @abstractmethod
+    async def save_snapshot(self, voting_id: int, rule: str, ballots: int,
+                            frozen_at: datetime, books: Sequence[SnapshotBook]) -> None:
+        """Save the final results of a voting in one transaction"""
+
+    async def notify_reload(self) -> None:
+        """Make other processes using this storage drop their cached
+        catalog and voting, as /reload does in this one"""
+
+
+class SqliteStorage(Storage):
+    async def connect(self) -> None:
+        await db.connect()
+
+    async def close(self) -> None:
+        await db.close()
+
+    async def get_catalog_version(self) -> int:
+        row = await db.fetchone(_CATALOG_VERSION_SQL)
+        return row["version"]
+
+    async def get_books(self) -> list[tuple]:
+        return await db.fetchall_tuples(_BOOKS_SQL)
+
+    async def get_already_read_books(self, today: date) -> list[tuple]:
+        return await db.fetchall_tuples(_ALREADY_READ_BOOKS_SQL, {"today": today.isoformat()})
+
+    async def get_now_reading_books(self, today: date) -> list[tuple]:
+        return await db.fetchall_tuples(_NOW_READING_BOOKS_SQL, {"today": today.isoformat()})
+
+    async def search_books(self, trigrams: set[str], limit: int) -> list[tuple[int, str, str]]:
+        match = " OR ".join(
+            '"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+        return await db.fetchall_tuples(_SEARCH_BOOKS_SQL, {"match": match, "limit": limit})
+
+    async def get_actual_voting(self, today: date) -> tuple[int, date, date] | None:
+        row = await db.fetchone(_ACTUAL_VOTING_SQL, {"today": today.isoformat()})
+        if row is None:
+            return None
+        return (row["id"], date.fromisoformat(row["voting_start"]),
+                date.fromisoformat(row["voting_finish"]))
+
+    async def get_next_voting_start(self, today: date) -> date | None:
+        row = await db.fetchone(_NEXT_VOTING_START_SQL, {"today": today.isoformat()})
+        if row["voting_start"] is None:
+            return None
+        return date.fromisoformat(row["voting_start"])
+
+    async def save_users(self, user_ids: Iterable[int]) -> None:
+        async with db.writer() as connection:
+            await _insert_users(connection, user_ids)
+
+    async def save_ballots(self, ballots: Sequence[BallotRow],
+                           on_saved: Callable[[], None] | None = None) -> None:
+        async with db.writer() as connection:
+            await _insert_users(connection, (user_id for _, user_id, _ in ballots))
+            with QueryTimer(_SAVE_VOTE_SQL):
+                await connection.executemany(_SAVE_VOTE_SQL, (
+                    (voting_id, user_id, *book_ids)
+                    for voting_id, user_id, book_ids in ballots))
+            if on_saved is not None:
+                on_saved()
+
+    async def get_ballots(self, voting_id: int) -> list[tuple[int, ...]]:
+        # the writer connection serializes this with save_ballots
+        async with db.writer() as connection:
+            with QueryTimer(_LOAD_BALLOTS_SQL) as timer:
+                async with connection.execute(_LOAD_BALLOTS_SQL, {"voting_id": voting_id}) as cursor:
+                    cursor.row_factory = None
+                    rows = await cursor.fetchall()
+                timer.rows = len(rows)
+        return rows
+
+    async def get_scores(self, voting_id: int, weights: Sequence[int]) -> dict[int, int]:
+        params = {"voting_id": voting_id}
+        for place, weight in enumerate(weights):
+            params[f"weight_{place}"] = weight
+        async with db.writer() as connection:
+            with QueryTimer(_SCORES_SQL) as timer:
+                async with connection.execute(_SCORES_SQL, params) as cursor:
+                    cursor.row_factory = None
+                    rows = await cursor.fetchall()
+                timer.rows = len(rows)
+        return {book_id: score for book_id, score in rows if score}
+
+    async def get_unfrozen_votings(self, today: date) -> list[int]:
+        rows = await db.fetchall_tuples(_UNFROZEN_VOTINGS_SQL, {"today": today.isoformat()})
+        return [voting_id for voting_id, in rows]
+
+    async def get_snapshots(self, count: int) -> list[SnapshotRow]:
+        return _parse_snapshot_rows(
+            await db.fetchall_tuples(_HISTORY_SQL, {"count": count}))
+
+    async def get_snapshot(self, voting_id: int) -> list[SnapshotRow]:
+        return _parse_snapshot_rows(
+            await db.fetchall_tuples(_RESULT_SQL, {"voting_id": voting_id}))
+
+    async def save_snapshot(self, voting_id: int, rule: str, ballots: int,
+                            frozen_at: datetime, books: Sequence[SnapshotBook]) -> None:
+        async with db.writer() as connection:
+            await connection.execute(_INSERT_SNAPSHOT_SQL, {
+                "voting_id": voting_id,
+                "rule": rule,
+                "ballots": ballots,
+                "frozen_at": frozen_at.isoformat(timespec="seconds"),
+            })
+            await connection.executemany(_INSERT_SNAPSHOT_BOOK_SQL, (
+                (voting_id, *book) for book in books))
+
+
+_storage: Storage | None = None
+
+
+def get_storage() -> Storage:
+    """The storage selected by config.STORAGE_BACKEND"""
+    global _storage
+    if _storage is None:
+        if config.STORAGE_BACKEND == "sqlite":
+            _storage = SqliteStorage()
+        elif config.STORAGE_BACKEND == "postgres":
+            from storage_postgres import PostgresStorage
+            _storage = PostgresStorage(config.POSTGRES_DSN)
+        else:
+            raise ValueError(f"Unknown storage backend: {config.STORAGE_BACKEND}")
+    return _storage
+
+
+def set_storage(new_storage: Storage) -> None:
+    """Use new_storage instead of the one config.STORAGE_BACKEND selects"""
+    global _storage
+    _storage = new_storage
+
+
+async def connect() -> None:
+    await get_storage().connect()
+
+
+async def close() -> None:
+    if _storage is not None:
+        await _storage.close()
+
+
+async def _insert_users(connection, user_ids: Iterable[int]) -> None:
+    with QueryTimer(_INSERT_USER_SQL):
+        await connection.executemany(
+            _INSERT_USER_SQL, ((user_id,) for user_id in user_ids))
+
+
+def _parse_snapshot_rows(rows: list[tuple]) -> list[SnapshotRow]:
+    return [(voting_id, date.fromisoformat(voting_start),
+             date.fromisoformat(voting_finish), *book)
+            for voting_id, voting_start, voting_finish, *book in rows]
+
+
+def _get_books_base_sql() -> str:
+    return f"""
+        select b.id as book_id
+              ,b.name as book_name
+              ,bc.id as category_id
+              ,bc.name as category_name
+              ,cast(julianday(b.read_start) - {JULIAN_DAY_OFFSET} as integer) as read_start_day
+              ,cast(julianday(b.read_finish) - {JULIAN_DAY_OFFSET} as integer) as read_finish_day
+        from book b
+          left join book_category bc
+            on b.category_id =bc.id
+        """
+
+
+_CATALOG_VERSION_SQL = "select version from catalog_version where id=1"
+
+_BOOKS_SQL = _get_books_base_sql() + """
+    order by bc.ordering, b.ordering"""
+
+_ALREADY_READ_BOOKS_SQL = _get_books_base_sql() + """
+    where read_start < :today
+        and read_finish <= :today
+    order by b.read_start"""
+
+_NOW_READING_BOOKS_SQL = _get_books_base_sql() + """
+    where read_start <= :today
+        and read_finish >= :today
+    order by b.read_start"""
+
+_SEARCH_BOOKS_SQL = """
+    select rowid, title, author
+    from book_fts
+    where book_fts match :match
+    order by bm25(book_fts, 2.0, 1.0)
+    limit :limit"""
+
+_ACTUAL_VOTING_SQL = """
+    select id, voting_start, voting_finish
+    from voting
+    where voting_start <= :today
+    and voting_finish >= :today
+    order by voting_start
+    limit 1"""
+
+_NEXT_VOTING_START_SQL = """
+    select min(voting_start) as voting_start
+    from voting
+    where voting_start > :today"""
+
+# a user who votes again has evidently unblocked the bot
+_INSERT_USER_SQL = """
+    insert into bot_user(telegram_id) values(?)
+    on conflict(telegram_id) do update set blocked_at = null
+    where blocked_at is not null"""
+
+_SAVE_VOTE_SQL = """
+    insert or replace into vote (
+                    vote_id,
+                    user_id,
+                    first_book_id,
+                    second_book_id,
+                    third_book_id)
+                values (?, ?, ?, ?, ?)"""
+
+_LOAD_BALLOTS_SQL = """
+    select user_id, first_book_id, second_book_id, third_book_id
+    from vote
+    where vote_id=:voting_id"""
+
+_SCORES_SQL = """
+    select t.book_id, sum(t.score) as score
+    from (
+        select first_book_id as book_id, :weight_0 as score
+        from vote
+        where vote_id=:voting_id
+
+        union all
+
+        select second_book_id as book_id, :weight_1 as score
+        from vote
+        where vote_id=:voting_id
+
+        union all
+
+        select third_book_id as book_id, :weight_2 as score
+        from vote
+        where vote_id=:voting_id
+    ) t
+    group by t.book_id"""
+
+_UNFROZEN_VOTINGS_SQL = """
+    select v.id
+    from voting v
+    left join voting_snapshot s on s.voting_id = v.id
+    where v.voting_finish < :today
+    and s.voting_id is null
+    order by v.id"""
+
+_HISTORY_SQL = """
+    select v.id as voting_id, v.voting_start, v.voting_finish,
+           b.place, b.book_name, b.score
+    from (
+        select v.id, v.voting_start, v.voting_finish
+        from voting v
+        join voting_snapshot s on s.voting_id = v.id
+        order by v.voting_start desc
+        limit :count
+    ) v
+    left join voting_snapshot_book b on b.voting_id = v.id
+    order by v.voting_start desc, b.place"""
+
+_RESULT_SQL = """
+    select s.voting_id, v.voting_start, v.voting_finish,
+           b.place, b.book_name, b.score
+    from voting_snapshot s
+    join voting v on v.id = s.voting_id
+    left join voting_snapshot_book b on b.voting_id = s.voting_id
+    where s.voting_id = :voting_id
+    order by b.place"""
+
+_INSERT_SNAPSHOT_SQL = """
+    insert or replace into voting_snapshot (voting_id, rule, ballots, frozen_at)
+    values (:voting_id, :rule, :ballots, :frozen_at)"""
+
+_INSERT_SNAPSHOT_BOOK_SQL = """
+    insert or replace into voting_snapshot_book
+        (voting_id, place, book_id, book_name, score)
+    values (?, ?, ?, ?, ?)"""
@@ -0,0 +1,294 @@
+import asyncio
+from datetime import date, datetime
+import logging
+from pathlib import Path
+from typing import Callable, Iterable, Sequence
+
+import asyncpg
+
+import config
+from metrics import QueryTimer
+from storage import BallotRow, SnapshotBook, SnapshotRow, Storage
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILE = Path(__file__).parent / "postgres.sql"
+# any constant, held while the schema is applied by one of several bots
+_SCHEMA_LOCK_ID = 0x626f6f6b
+
+
+class PostgresStorage(Storage):
+    """Storage in PostgreSQL through an asyncpg pool.
+
+    asyncpg prepares every statement on the server once per pooled
+    connection and keeps up to config.POSTGRES_CACHED_STATEMENTS of them,
+    so the hot queries are parsed and planned only once."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._pool: asyncpg.Pool | None = None
+        # the same guarantee sqlite's single writer connection gives
+        self._ballots_lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        if self._pool is not None:
+            return
+        pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=config.POSTGRES_POOL_MIN_SIZE,
+            max_size=config.POSTGRES_POOL_MAX_SIZE,
+            statement_cache_size=config.POSTGRES_CACHED_STATEMENTS)
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute("select pg_advisory_xact_lock($1)", _SCHEMA_LOCK_ID)
+                await connection.execute(SCHEMA_FILE.read_text(encoding="utf-8"))
+        self._pool = pool
+        logger.info("PostgreSQL pool opened: %s to %s connections",
+                    config.POSTGRES_POOL_MIN_SIZE, config.POSTGRES_POOL_MAX_SIZE)
+
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+        await self._pool.close()
+        self._pool = None
+        logger.info("PostgreSQL pool closed")
+
+    async def get_catalog_version(self) -> int:
+        return await self._fetchval(_CATALOG_VERSION_SQL)
+
+    async def get_books(self) -> list[tuple]:
+        return await self._fetch(_BOOKS_SQL)
+
+    async def get_already_read_books(self, today: date) -> list[tuple]:
+        return await self._fetch(_ALREADY_READ_BOOKS_SQL, today)
+
+    async def get_now_reading_books(self, today: date) -> list[tuple]:
+        return await self._fetch(_NOW_READING_BOOKS_SQL, today)
+
+    async def search_books(self, trigrams: set[str], limit: int) -> list[tuple[int, str, str]]:
+        return await self._fetch(_SEARCH_BOOKS_SQL, list(trigrams), limit)
+
+    async def get_actual_voting(self, today: date) -> tuple[int, date, date] | None:
+        rows = await self._fetch(_ACTUAL_VOTING_SQL, today)
+        return rows[0] if rows else None
+
+    async def get_next_voting_start(self, today: date) -> date | None:
+        return await self._fetchval(_NEXT_VOTING_START_SQL, today)
+
+    async def save_users(self, user_ids: Iterable[int]) -> None:
+        await self._ensure_pool()
+        async with self._pool.acquire() as connection:
+            with QueryTimer(_INSERT_USER_SQL):
+                await connection.executemany(
+                    _INSERT_USER_SQL, [(user_id,) for user_id in user_ids])
+
+    async def save_ballots(self, ballots: Sequence[BallotRow],
+                           on_saved: Callable[[], None] | None = None) -> None:
+        await self._ensure_pool()
+        async with self._ballots_lock, self._pool.acquire() as connection:
+            async with connection.transaction():
+                with QueryTimer(_INSERT_USER_SQL):
+                    await connection.executemany(_INSERT_USER_SQL, [
+                        (user_id,) for _, user_id, _ in ballots])
+                with QueryTimer(_SAVE_VOTE_SQL):
+                    await connection.executemany(_SAVE_VOTE_SQL, [
+                        (voting_id, user_id, *book_ids)
+                        for voting_id, user_id, book_ids in ballots])
+                if on_saved is not None:
+                    on_saved()
+
+    async def get_ballots(self, voting_id: int) -> list[tuple[int, ...]]:
+        async with self._ballots_lock:
+            return await self._fetch(_LOAD_BALLOTS_SQL, voting_id)
+
+    async def get_scores(self, voting_id: int, weights: Sequence[int]) -> dict[int, int]:
+        async with self._ballots_lock:
+            rows = await self._fetch(_SCORES_SQL, voting_id, *weights)
+        return {book_id: score for book_id, score in rows if score}
+
+    async def get_unfrozen_votings(self, today: date) -> list[int]:
+        return [voting_id for voting_id, in await self._fetch(_UNFROZEN_VOTINGS_SQL, today)]
+
+    async def get_snapshots(self, count: int) -> list[SnapshotRow]:
+        return await self._fetch(_HISTORY_SQL, count)
+
+    async def get_snapshot(self, voting_id: int) -> list[SnapshotRow]:
+        return await self._fetch(_RESULT_SQL, voting_id)
+
+    async def save_snapshot(self, voting_id: int, rule: str, ballots: int,
+                            frozen_at: datetime, books: Sequence[SnapshotBook]) -> None:
+        await self._ensure_pool()
+        async with self._pool.acquire() as connection:
+            async with connection.transaction():
+                with QueryTimer(_INSERT_SNAPSHOT_SQL):
+                    await connection.execute(
+                        _INSERT_SNAPSHOT_SQL, voting_id, rule, ballots, frozen_at)
+                with QueryTimer(_INSERT_SNAPSHOT_BOOK_SQL):
+                    await connection.executemany(_INSERT_SNAPSHOT_BOOK_SQL, [
+                        (voting_id, *book) for book in books])
+
+    async def _ensure_pool(self) -> None:
+        if self._pool is None:
+            await self.connect()
+
+    async def _fetch(self, sql: str, *args) -> list[tuple]:
+        await self._ensure_pool()
+        with QueryTimer(sql) as timer:
+            async with self._pool.acquire() as connection:
+                rows = await connection.fetch(sql, *args)
+            timer.rows = len(rows)
+        return [tuple(row) for row in rows]
+
+    async def _fetchval(self, sql: str, *args):
+        await self._ensure_pool()
+        with QueryTimer(sql) as timer:
+            async with self._pool.acquire() as connection:
+                value = await connection.fetchval(sql, *args)
+            timer.rows = 1
+        return value
+
+
+# dates minus date '0001-01-01' plus one are date.toordinal() values
+_BOOKS_BASE_SQL = """
+    select b.id as book_id
+          ,b.name as book_name
+          ,bc.id as category_id
+          ,bc.name as category_name
+          ,b.read_start - date '0001-01-01' + 1 as read_start_day
+          ,b.read_finish - date '0001-01-01' + 1 as read_finish_day
+    from book b
+      left join book_category bc
+        on b.category_id = bc.id
+    """
+
+_CATALOG_VERSION_SQL = "select version from catalog_version where id = 1"
+
+_BOOKS_SQL = _BOOKS_BASE_SQL + """
+    order by bc.ordering, b.ordering"""
+
+_ALREADY_READ_BOOKS_SQL = _BOOKS_BASE_SQL + """
+    where read_start < $1
+        and read_finish <= $1
+    order by b.read_start"""
+
+_NOW_READING_BOOKS_SQL = _BOOKS_BASE_SQL + """
+    where read_start <= $1
+        and read_finish >= $1
+    order by b.read_start"""
+
+_SEARCH_BOOKS_SQL = """
+    select b.id
+          ,split_part(coalesce(b.name, ''), ' :: ', 1) as title
+          ,case when strpos(b.name, ' :: ') > 0
+                then substr(b.name, strpos(b.name, ' :: ') + 4)
+                else '' end as author
+    from (
+        select book_id, sum(weight) as matches
+        from book_trigram
+        where trigram = any($1::text[])
+        group by book_id
+        order by matches desc, book_id
+        limit $2
+    ) m
+    join book b on b.id = m.book_id
+    order by m.matches desc, m.book_id"""
+
+_ACTUAL_VOTING_SQL = """
+    select id, voting_start, voting_finish
+    from voting
+    where voting_start <= $1
+    and voting_finish >= $1
+    order by voting_start
+    limit 1"""
+
+_NEXT_VOTING_START_SQL = """
+    select min(voting_start)
+    from voting
+    where voting_start > $1"""
+
+# a user who votes again has evidently unblocked the bot
+_INSERT_USER_SQL = """
+    insert into bot_user (telegram_id) values ($1)
+    on conflict (telegram_id) do update set blocked_at = null
+    where bot_user.blocked_at is not null"""
+
+_SAVE_VOTE_SQL = """
+    insert into vote (vote_id, user_id, first_book_id, second_book_id, third_book_id)
+    values ($1, $2, $3, $4, $5)
+    on conflict (vote_id, user_id) do update
+    set first_book_id = excluded.first_book_id,
+        second_book_id = excluded.second_book_id,
+        third_book_id = excluded.third_book_id"""
+
+_LOAD_BALLOTS_SQL = """
+    select user_id, first_book_id, second_book_id, third_book_id
+    from vote
+    where vote_id = $1"""
+
+_SCORES_SQL = """
+    select t.book_id, sum(t.score)::integer as score
+    from (
+        select first_book_id as book_id, $2::integer as score
+        from vote
+        where vote_id = $1
+
+        union all
+
+        select second_book_id as book_id, $3::integer as score
+        from vote
+        where vote_id = $1
+
+        union all
+
+        select third_book_id as book_id, $4::integer as score
+        from vote
+        where vote_id = $1
+    ) t
+    group by t.book_id"""
+
+_UNFROZEN_VOTINGS_SQL = """
+    select v.id
+    from voting v
+    left join voting_snapshot s on s.voting_id = v.id
+    where v.voting_finish < $1
+    and s.voting_id is null
+    order by v.id"""
+
+_HISTORY_SQL = """
+    select v.id as voting_id, v.voting_start, v.voting_finish,
+           b.place, b.book_name, b.score
+    from (
+        select v.id, v.voting_start, v.voting_finish
+        from voting v
+        join voting_snapshot s on s.voting_id = v.id
+        order by v.voting_start desc
+        limit $1
+    ) v
+    left join voting_snapshot_book b on b.voting_id = v.id
+    order by v.voting_start desc, b.place"""
+
+_RESULT_SQL = """
+    select s.voting_id, v.voting_start, v.voting_finish,
+           b.place, b.book_name, b.score
+    from voting_snapshot s
+    join voting v on v.id = s.voting_id
+    left join voting_snapshot_book b on b.voting_id = s.voting_id
+    where s.voting_id = $1
+    order by b.place"""
+
+_INSERT_SNAPSHOT_SQL = """
+    insert into voting_snapshot (voting_id, rule, ballots, frozen_at)
+    values ($1, $2, $3, $4)
+    on conflict (voting_id) do update
+    set rule = excluded.rule,
+        ballots = excluded.ballots,
+        frozen_at = excluded.frozen_at"""
+
+_INSERT_SNAPSHOT_BOOK_SQL = """
+    insert into voting_snapshot_book (voting_id, place, book_id, book_name, score)
+    values ($1, $2, $3, $4, $5)
+    on conflict (voting_id, place) do update
+    set book_id = excluded.book_id,
+        book_name = excluded.book_name,
+        score = excluded.score"""
@@ -0,0 +1,221 @@
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+import numpy as np
+
+import config
+from leaderboard import Tally
+from storage import get_storage
+
+
+@dataclass
+class Ballots:
+    """Ballots of one voting as a users x ranks matrix.
+
+    Cells hold indexes into book_ids, -1 marks an empty rank, so ballots
+    of any length fit into one matrix."""
+    book_ids: np.ndarray
+    ranks: np.ndarray
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Iterable[int | None]] | np.ndarray) -> "Ballots":
+        """Rows of book ids by rank, None or -1 for an empty rank"""
+        if isinstance(rows, np.ndarray):
+            matrix = rows.astype(np.int64)
+        else:
+            # None becomes NaN on the way in and an empty rank on the way out
+            matrix = np.array(list(rows), dtype=np.float64)
+            matrix = np.nan_to_num(matrix, nan=-1).astype(np.int64)
+        if matrix.size == 0:
+            return cls(np.empty(0, dtype=np.int64),
+                       np.empty((0, config.VOTE_ELEMENTS_COUNT), dtype=np.int32))
+        book_ids, inverse = np.unique(matrix, return_inverse=True)
+        ranks = inverse.reshape(matrix.shape).astype(np.int32)
+        if book_ids[0] == -1:
+            book_ids = book_ids[1:]
+            ranks -= 1
+        return cls(book_ids, ranks)
+
+    @classmethod
+    def from_indexes(cls, book_ids: np.ndarray, ranks: np.ndarray) -> "Ballots":
+        """Ballots of a matrix of indexes into book_ids, as from_rows would
+        make them: only ranked books, ordered by id"""
+        ranked = ranks >= 0
+        used = np.zeros(len(book_ids), dtype=bool)
+        used[ranks[ranked]] = True
+        order = np.flatnonzero(used)
+        order = order[np.argsort(book_ids[order], kind="stable")]
+        position = np.full(len(book_ids), -1, dtype=np.int32)
+        position[order] = np.arange(len(order), dtype=np.int32)
+        mapped = np.full(ranks.shape, -1, dtype=np.int32)
+        mapped[ranked] = position[ranks[ranked]]
+        return cls(book_ids[order], mapped)
+
+    @property
+    def candidates_count(self) -> int:
+        return len(self.book_ids)
+
+
+def borda(ballots: Ballots,
+          weights: Iterable[float] | None = None) -> list[tuple[int, float]]:
+    """Weighted positional count, config.VOTE_WEIGHTS by default"""
+    if weights is None:
+        weights = config.VOTE_WEIGHTS
+    return _ranking(ballots, _borda_scores(ballots, weights))
+
+
+def plurality(ballots: Ballots) -> list[tuple[int, float]]:
+    return borda(ballots, (1,))
+
+
+def instant_runoff(ballots: Ballots) -> list[tuple[int, float]]:
+    """Eliminate the weakest book until one has a majority of first choices.
+
+    Books are ordered by the round they were eliminated in, scores are
+    their first-choice counts in that round. Every round only moves the
+    ballots of the eliminated book to their next active choice."""
+    count = ballots.candidates_count
+    if count == 0:
+        return []
+    ranks = ballots.ranks
+    width = ranks.shape[1]
+    active = np.ones(count, dtype=bool)
+    votes = np.zeros(count, dtype=np.int64)
+    # holders[book] lists index arrays of ballots currently counted for it
+    holders: list[list[np.ndarray]] = [[] for _ in range(count)]
+    positions = np.zeros(len(ranks), dtype=np.int64)
+
+    def hand_over(indexes: np.ndarray) -> int:
+        """Count ballots for their current choice, return how many have one"""
+        valid = positions[indexes] < width
+        indexes = indexes[valid]
+        choices = ranks[indexes, positions[indexes]]
+        while True:
+            stale = (choices < 0) | ~active[np.maximum(choices, 0)]
+            if not stale.any():
+                break
+            positions[indexes[stale]] += 1
+            keep = ~stale | (positions[indexes] < width)
+            indexes, stale = indexes[keep], stale[keep]
+            choices = choices[keep]
+            choices[stale] = ranks[indexes[stale], positions[indexes[stale]]]
+        order = np.argsort(choices, kind="stable")
+        indexes, choices = indexes[order], choices[order]
+        books, starts, counts = np.unique(choices, return_index=True, return_counts=True)
+        votes[books] += counts
+        for book, start, size in zip(books, starts, counts):
+            holders[book].append(indexes[start:start + size])
+        return len(indexes)
+
+    counted = hand_over(np.arange(len(ranks)))
+    eliminated = []
+    while active.sum() > 1:
+        candidates = np.flatnonzero(active)
+        if votes[candidates].max() * 2 > counted:
+            break
+        loser = candidates[votes[candidates].argmin()]
+        active[loser] = False
+        eliminated.append((loser, votes[loser]))
+        moved = holders[loser]
+        holders[loser] = []
+        if moved:
+            indexes = np.concatenate(moved)
+            positions[indexes] += 1
+            counted += hand_over(indexes) - len(indexes)
+    remaining = np.flatnonzero(active)
+    remaining = remaining[np.argsort(-votes[remaining], kind="stable")]
+    order = [(book, votes[book]) for book in remaining] + eliminated[::-1]
+    return [(int(ballots.book_ids[book]), float(score)) for book, score in order]
+
+
+def schulze(ballots: Ballots) -> list[tuple[int, float]]:
+    """Schulze method among the config.SCHULZE_MAX_CANDIDATES books ranked
+    on most ballots, at any rank, the Borda count breaking ties.
+
+    Ranked books are preferred to unranked ones. Scores are the number of
+    other candidates a book beats by strongest path."""
+    ranked = ballots.ranks[ballots.ranks >= 0]
+    appearances = np.bincount(ranked, minlength=ballots.candidates_count)
+    order = np.lexsort((-_borda_scores(ballots, config.VOTE_WEIGHTS), -appearances))
+    order = order[appearances[order] > 0][:config.SCHULZE_MAX_CANDIDATES]
+    count = len(order)
+    if count == 0:
+        return []
+    candidates = [int(book_id) for book_id in ballots.book_ids[order]]
+    # map ballots to candidate positions, other books become empty ranks
+    position = np.full(ballots.candidates_count, -1, dtype=np.int64)
+    position[order] = np.arange(count)
+    ranks = np.where(ballots.ranks >= 0, position[ballots.ranks], -1)
+
+    appearances = np.bincount(ranks[ranks >= 0], minlength=count)
+    # ordered[i, j]: ballots ranking both books with i above j
+    ordered = np.zeros(count * count, dtype=np.int64)
+    width = ranks.shape[1]
+    for upper in range(width):
+        for lower in range(upper + 1, width):
+            both = (ranks[:, upper] >= 0) & (ranks[:, lower] >= 0)
+            ordered += np.bincount(
+                ranks[both, upper] * count + ranks[both, lower],
+                minlength=count * count)
+    ordered = ordered.reshape(count, count)
+    # i beats j on every ballot ranking i, except where j is ranked above i
+    preferences = appearances[:, None] - ordered.T
+    np.fill_diagonal(preferences, 0)
+
+    paths = np.where(preferences > preferences.T, preferences, 0)
+    for middle in range(count):
+        paths = np.maximum(paths, np.minimum(paths[:, middle:middle + 1],
+                                             paths[middle:middle + 1, :]))
+    wins = (paths > paths.T).sum(axis=1).astype(float)
+    order = np.argsort(-wins, kind="stable")
+    return [(candidates[index], float(wins[index])) for index in order]
+
+
+RULES: dict[str, Callable[[Ballots], list[tuple[int, float]]]] = {
+    "borda": borda,
+    "plurality": plurality,
+    "instant_runoff": instant_runoff,
+    "schulze": schulze,
+}
+
+
+_rankings: dict[tuple[int, str], tuple[int, list[tuple[int, float]]]] = {}
+
+
+async def load_ballots(voting_id: int) -> Ballots:
+    """Read a voting's ballots straight from the storage"""
+    rows = await get_storage().get_ballots(voting_id)
+    return Ballots.from_rows(row[1:] for row in rows)
+
+
+def rank(tally: Tally, rule: str | None = None) -> list[tuple[int, float]]:
+    """(book_id, score) pairs of a loaded tally ordered by config.VOTE_RULE.
+
+    The ranking is recounted only after new ballots reach the tally, from
+    the ballot matrix the tally keeps up to date."""
+    if rule is None:
+        rule = config.VOTE_RULE
+    key = (tally.voting_id, rule)
+    cached = _rankings.get(key)
+    if cached is not None and cached[0] == tally.revision:
+        return cached[1]
+    ballots = Ballots.from_indexes(*tally.get_ranks())
+    ranking = RULES[rule](ballots)
+    _rankings[key] = (tally.revision, ranking)
+    return ranking
+
+
+def _borda_scores(ballots: Ballots, weights: Iterable[float]) -> np.ndarray:
+    scores = np.zeros(ballots.candidates_count)
+    for rank, weight in zip(range(ballots.ranks.shape[1]), weights):
+        column = ballots.ranks[:, rank]
+        scores += weight * np.bincount(column[column >= 0],
+                                       minlength=ballots.candidates_count)
+    return scores
+
+
+def _ranking(ballots: Ballots, scores: np.ndarray) -> list[tuple[int, float]]:
+    order = np.argsort(-scores, kind="stable")
+    order = order[scores[order] > 0]
+    return [(int(ballots.book_ids[index]), float(scores[index])) for index in order]
+
@@ -0,0 +1,85 @@
+import asyncio
+from dataclasses import dataclass
+import sys
+from typing import Any, Awaitable, Hashable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+@dataclass
+class UpdateProcessorStats:
+    processed: int = 0
+    # updates that had to wait for an earlier update of their user or chat
+    ordered_waits: int = 0
+    in_flight: int = 0
+
+
+_stats = UpdateProcessorStats()
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but each user's and each chat's
+    updates strictly in the order they arrived.
+
+    Every update waits for the previous update sharing its user or chat
+    before it takes one of max_concurrent_updates slots, so waiting
+    updates never hold a slot that an unrelated user could use. The slots
+    are taken in do_process_update, PTB's own limit in process_update is
+    left unbounded so that every update gets there in arrival order."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # the last update of every busy user or chat, finished when it is
+        self._tails: dict[Hashable, asyncio.Future] = {}
+
+    async def do_process_update(self, update: object,
+                                coroutine: Awaitable[Any]) -> None:
+        # Everything up to the first await runs in arrival order, since
+        # the application starts one task per update in that order
+        keys = _get_order_keys(update)
+        previous = [self._tails[key] for key in keys if key in self._tails]
+        done = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._tails[key] = done
+        _stats.in_flight += 1
+        try:
+            if previous:
+                _stats.ordered_waits += 1
+                for tail in previous:
+                    # shielded, a cancelled waiter must not cancel the tail
+                    # other updates wait for
+                    await asyncio.shield(tail)
+            async with self._slots:
+                await coroutine
+        finally:
+            done.set_result(None)
+            for key in keys:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+            _stats.in_flight -= 1
+            _stats.processed += 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def get_update_processor_stats() -> UpdateProcessorStats:
+    return _stats
+
+
+def _get_order_keys(update: object) -> tuple[Hashable, ...]:
+    if not isinstance(update, Update):
+        return ()
+    keys = []
+    if update.effective_user is not None:
+        keys.append(("user", update.effective_user.id))
+    if update.effective_chat is not None:
+        keys.append(("chat", update.effective_chat.id))
+    return tuple(keys)
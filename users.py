@@ -1,8 +1,9 @@
-import aiosqlite
-import config
+from typing import Iterable
+
+from storage import get_storage
 
 async def _insert_user(telegram_user_id: int) -> None:
-    async with aiosqlite.connect(config.SQLITE_DB_FILE) as db:
-        await db.execute("insert or ignore into bot_user(telegram_id) values(:telegram_id)",
-                         {"telegram_id": telegram_user_id})
-        await db.commit()
\ No newline at end of file
+    await _insert_users((telegram_user_id,))
+
+async def _insert_users(telegram_user_ids: Iterable[int]) -> None:
+    await get_storage().save_users(telegram_user_ids)
@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+import logging
+import time
+
+import config
+import db
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VoteModeStats:
+    entered: int = 0
+    # text messages dropped without any database or network work
+    fast_path: int = 0
+    # text messages parsed as ballots
+    vote_mode: int = 0
+
+
+_expires_at: dict[int, float] = {}
+_stats = VoteModeStats()
+
+
+def is_active(user_id: int) -> bool:
+    """Whether the user's text messages should be read as ballots"""
+    expires_at = _expires_at.get(user_id)
+    if expires_at is not None and expires_at < time.time():
+        del _expires_at[user_id]
+        expires_at = None
+    if expires_at is None:
+        _stats.fast_path += 1
+        return False
+    _stats.vote_mode += 1
+    return True
+
+
+async def enter(user_id: int) -> None:
+    expires_at = time.time() + config.VOTE_MODE_TIMEOUT
+    _expires_at[user_id] = expires_at
+    _stats.entered += 1
+    if config.VOTE_MODE_PERSIST:
+        async with db.writer() as connection:
+            await connection.execute(
+                """insert or replace into bot_user_in_vote_mode (user_id, expires_at)
+                   values (:user_id, :expires_at)""",
+                {"user_id": user_id, "expires_at": int(expires_at)})
+
+
+async def leave(user_id: int) -> None:
+    if _expires_at.pop(user_id, None) is None:
+        return
+    if config.VOTE_MODE_PERSIST:
+        async with db.writer() as connection:
+            await connection.execute(
+                "delete from bot_user_in_vote_mode where user_id=:user_id",
+                {"user_id": user_id})
+
+
+async def load() -> None:
+    """Restore users still in vote mode after a restart"""
+    if not config.VOTE_MODE_PERSIST:
+        return
+    now = int(time.time())
+    async with db.writer() as connection:
+        await connection.execute(
+            "delete from bot_user_in_vote_mode where expires_at < :now", {"now": now})
+    rows = await db.fetchall("select user_id, expires_at from bot_user_in_vote_mode")
+    for row in rows:
+        _expires_at[row["user_id"]] = row["expires_at"]
+    logger.info("Restored %s users in vote mode", len(rows))
+
+
+def get_vote_mode_stats() -> VoteModeStats:
+    return _stats
@@ -0,0 +1,120 @@
+import asyncio
+from dataclasses import dataclass, field
+import functools
+import logging
+import time
+from typing import Iterable
+
+import config
+import leaderboard
+from storage import get_storage
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Ballot:
+    voting_id: int
+    user_id: int
+    book_ids: tuple[int, ...]
+    done: asyncio.Future = field(repr=False)
+
+
+@dataclass
+class VoteWriterStats:
+    ballots: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    busy_time: float = 0.0
+
+    @property
+    def ballots_per_second(self) -> float:
+        return self.ballots / self.busy_time if self.busy_time else 0.0
+
+
+_queue: asyncio.Queue | None = None
+_task: asyncio.Task | None = None
+_stats = VoteWriterStats()
+
+
+async def start() -> None:
+    global _queue, _task
+    if _task is not None:
+        return
+    _queue = asyncio.Queue(maxsize=config.VOTE_QUEUE_SIZE)
+    _task = asyncio.create_task(_run(_queue))
+
+
+async def stop() -> None:
+    """Write out everything already queued and stop the writer task"""
+    global _queue, _task
+    if _task is None:
+        return
+    await _queue.put(None)
+    await _task
+    _queue, _task = None, None
+    logger.info("Vote writer stopped: %s ballots in %s batches, %.0f ballots/sec",
+                _stats.ballots, _stats.batches, _stats.ballots_per_second)
+
+
+async def submit(voting_id: int, user_id: int, book_ids: Iterable[int]) -> None:
+    """Queue a ballot and wait until it is committed.
+
+    Waits for free space when the queue is full, so callers are slowed down
+    instead of piling up unbounded work."""
+    if _task is None:
+        await start()
+    done = asyncio.get_running_loop().create_future()
+    await _queue.put(Ballot(voting_id, user_id, tuple(book_ids), done))
+    await done
+
+
+def get_vote_writer_stats() -> VoteWriterStats:
+    return _stats
+
+
+async def _run(queue: asyncio.Queue) -> None:
+    stopping = False
+    while not stopping:
+        batch = [await queue.get()]
+        while len(batch) < config.VOTE_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        if None in batch:
+            stopping = True
+            batch = [ballot for ballot in batch if ballot is not None]
+        if batch:
+            await _write_batch(batch)
+
+
+async def _write_batch(batch: list[Ballot]) -> None:
+    started = time.perf_counter()
+    try:
+        rows = [(ballot.voting_id, ballot.user_id, ballot.book_ids) for ballot in batch]
+        await get_storage().save_ballots(
+            rows, functools.partial(leaderboard.apply_ballots, rows))
+    except Exception as error:
+        # tallies may already contain ballots that were rolled back
+        for voting_id in {ballot.voting_id for ballot in batch}:
+            leaderboard.discard(voting_id)
+        if len(batch) > 1:
+            # one bad ballot, e.g. for a book deleted since the catalog was
+            # cached, must not fail everybody else's
+            logger.warning("Failed to write batch of %s ballots, writing them one by one: %s",
+                           len(batch), error)
+            for ballot in batch:
+                await _write_batch([ballot])
+            return
+        logger.exception("Failed to write ballot of user %s", batch[0].user_id)
+        _stats.failed_batches += 1
+        for ballot in batch:
+            if not ballot.done.done():
+                ballot.done.set_exception(error)
+        return
+    _stats.ballots += len(batch)
+    _stats.batches += 1
+    _stats.busy_time += time.perf_counter() - started
+    for ballot in batch:
+        if not ballot.done.done():
+            ballot.done.set_result(None)
+
@@ -1,36 +1,40 @@
-from datetime import datetime
+from datetime import date, timedelta
 from dataclasses import dataclass
 import logging
-import aiosqlite
-from books import Book
+from books import Book, get_catalog
 import config
+from dates import format_day
+import db
+from storage import get_storage
 
 from typing import Iterable
-from users import _insert_user
+from leaderboard import get_tally, verify
+import tally as tally_engine
+import vote_writer
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BookVoteResult:
     book_name: str
-    score: int
+    score: float
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Voting:
     id: int
-    voting_start: str
-    voting_finish: str
-
-    def __post_init__(self):
-        """Set up read_start and read_finish to needed string format"""
-        for field in ("voting_start", "voting_finish"):
-            value = getattr(self, field)
-            if value is None: continue
-            try:
-                value = datetime.strptime(value, "%Y-%m-%d").strftime(config.DATE_FORMAT)
-            except ValueError:
-                continue
-            setattr(self, field, value)
+    # date ordinals, formatted only when a voting is displayed
+    voting_start_day: int
+    voting_finish_day: int
 
-@dataclass
+    @property
+    def voting_start(self) -> str:
+        """voting_start in config.DATE_FORMAT"""
+        return format_day(self.voting_start_day)
+
+    @property
+    def voting_finish(self) -> str:
+        """voting_finish in config.DATE_FORMAT"""
+        return format_day(self.voting_finish_day)
+
+@dataclass(frozen=True, slots=True)
 class VoteResult:
     voting: Voting
     leaders: list[BookVoteResult]
@@ -39,102 +43,85 @@ class VoteResult:
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class _ActualVotingCache:
+    voting: Voting | None
+    # first date on which another voting may be the actual one
+    valid_until: date
+
+
+_actual_voting_cache: _ActualVotingCache | None = None
+
+
 async def get_actual_voting() -> Voting | None:
-    sql = """
-        select id, voting_start, voting_finish
-        from voting
-        where voting_start <= current_date
-        and voting_finish >= current_date
-        order by voting_start
-        limit 1"""
-    async with aiosqlite.connect(config.SQLITE_DB_FILE) as db:
-        db.row_factory=aiosqlite.Row
-        async with db.execute(sql) as cursor:
-            row = await cursor.fetchone()
-            if row is None: return None
-            return Voting (
-                id = row["id"],
-                voting_start = row["voting_start"],
-                voting_finish = row["voting_finish"]
-            )
-
-
-async def save_vote(telegram_user_id: int, books: Iterable[Book]) -> None:
-    await _insert_user(telegram_user_id)
+    """Return actual voting, cached until the next voting start or finish"""
+    global _actual_voting_cache
+    today = db.current_date()
+    cache = _actual_voting_cache
+    if cache is not None and today < cache.valid_until:
+        return cache.voting
+    storage = get_storage()
+    row = await storage.get_actual_voting(today)
+    valid_until = await storage.get_next_voting_start(today) or date.max
+    voting = None
+    if row is not None:
+        voting_id, voting_start, voting_finish = row
+        valid_until = min(valid_until, voting_finish + timedelta(days=1))
+        voting = Voting (
+            id = voting_id,
+            voting_start_day = voting_start.toordinal(),
+            voting_finish_day = voting_finish.toordinal()
+        )
+    _actual_voting_cache = _ActualVotingCache(voting, valid_until)
+    return voting
+
+
+def invalidate_actual_voting() -> None:
+    global _actual_voting_cache
+    _actual_voting_cache = None
+
+
+async def verify_actual_tally() -> bool:
+    """Rebuild the actual voting's tally if it drifted from the vote table"""
     actual_voting = await get_actual_voting()
+    if actual_voting is None:
+        return True
+    return await verify(actual_voting.id)
+
+
+async def save_vote(telegram_user_id: int,
+                    books: Iterable[Book],
+                    actual_voting: Voting | None = None) -> None:
+    if actual_voting is None:
+        actual_voting = await get_actual_voting()
     if actual_voting is None:
         logger.warning("No actual voting in save_vote()")
         return
-    sql = """
-        insert or replace into vote (
-                        vote_id,
-                        user_id,
-                        first_book_id,
-                        second_book_id,
-                        third_book_id)
-                    values (:vote_id,
-                            :user_id,
-                            :first_book_id,
-                            :second_book_id,
-                            :third_book_id)"""
-    books = tuple(books)
-    async with aiosqlite.connect(config.SQLITE_DB_FILE) as db:
-        await db.execute(sql, {
-            "vote_id": actual_voting.id,
-            "user_id": telegram_user_id,
-            "first_book_id": books[0].id,
-            "second_book_id": books[1].id,
-            "third_book_id": books[2].id
-        })
-        await db.commit()
-
-async def get_leaders() -> VoteResult | None:
-    actual_voting = await get_actual_voting()
+    await vote_writer.submit(
+        actual_voting.id,
+        telegram_user_id,
+        (book.id for book in books))
+
+async def get_leaders(actual_voting: Voting | None = None) -> VoteResult | None:
+    if actual_voting is None:
+        actual_voting = await get_actual_voting()
     if actual_voting is None: return None
     vote_results = VoteResult(
-            voting = Voting(
-            voting_start=actual_voting.voting_start,
-            voting_finish=actual_voting.voting_finish,
-            id=actual_voting.id
-        ),
+        voting = actual_voting,
         leaders = []
     )
-    sql = """
-    select t2.*, b.name as book_name 
-    from (select t.book_id, sum(t.score) as score
-    from (
-        select first_book_id as book_id, 3*count(*) as score
-        from vote v
-        where vote_id=(:voting_id)
-        group by first_book_id
-        
-        union
-        
-        select second_book_id as book_id, 2*count(*) as score
-        from vote v
-        where vote_id=(:voting_id)
-        group by second_book_id
-        
-        union
-        
-        select third_book_id as book_id, 2*count(*) as score
-        from vote v
-        where vote_id=(:voting_id)
-        group by third_book_id
-    ) t
-    group by t.book_id
-    order by sum(t.score) desc
-    limit 10) t2
-    left join book b 
-      on b.id=t2.book_id
-    """
-    async with aiosqlite.connect(config.SQLITE_DB_FILE) as db:
-        db.row_factory=aiosqlite.Row
-        async with db.execute(sql, {"voting_id": actual_voting.id}) as cursor:
-            rows = await cursor.fetchall()
-            for row in rows:
-                vote_results.leaders.append(BookVoteResult(
-                    book_name = row["book_name"],
-                    score = row["score"]
-                ))
+    tally = await get_tally(actual_voting.id)
+    if config.VOTE_RULE == "borda":
+        # the incremental tally already keeps Borda scores up to date
+        top = tally.top(10)
+    else:
+        top = tally_engine.rank(tally)[:10]
+    catalog = await get_catalog()
+    for book_id, score in top:
+        book = catalog.books_by_id.get(book_id)
+        vote_results.leaders.append(BookVoteResult(
+            book_name = book.name if book else None,
+            score = score
+        ))
     return vote_results
+
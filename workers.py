@@ -0,0 +1,570 @@
+"""Multi-process mode: one dispatcher, worker processes and one writer.
+
+The dispatcher process long polls for updates and hands each one to the
+worker process picked by its user id, so one user's updates are always
+handled by the same worker, in order. Every worker runs the whole
+application with its own catalog, render and tally caches and reads the
+database itself. Saving ballots and users goes through the writer
+process, which also freezes and announces votings and keeps the live
+results messages, so sqlite never has more than one writer.
+
+The writer forwards every saved batch of ballots to the other workers to
+keep their tallies current, and /reload to make them drop their cached
+catalog and voting. Updates of one group chat sent by different
+users may be handled by different workers at the same time."""
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import struct
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Sequence
+
+import telegram
+from telegram import Update
+from telegram.error import InvalidToken, RetryAfter, TelegramError
+
+import books
+import config
+import db
+import leaderboard
+import storage
+from storage import BallotRow, SnapshotBook, SnapshotRow, Storage
+import votings
+
+
+logger = logging.getLogger(__name__)
+
+# seconds a getUpdates request waits for new updates
+_POLL_TIMEOUT = 10
+# longest wait between failed getUpdates requests
+_MAX_POLL_DELAY = 30
+_HEADER = struct.Struct("!I")
+
+
+class WriterError(Exception):
+    """A request failed in the writer process"""
+
+
+class ProcessExitedError(Exception):
+    """The writer or a worker process exited while the dispatcher runs"""
+
+
+class WriterClientStorage(Storage):
+    """Storage of a worker process: reads go to the local storage, writes
+    and ballots to the writer process.
+
+    Ballots are read through the writer too, so a loaded tally and the
+    ballots forwarded from other workers arrive in commit order. on_saved
+    runs after the commit, under the lock every ballot read takes."""
+
+    def __init__(self, path: str, local: Storage):
+        self.path = path
+        self.local = local
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._replies: dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count(1)
+        self._forwarded: asyncio.Queue | None = None
+        # the same guarantee sqlite's single writer connection gives
+        self._ballots_lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        if self._writer is not None:
+            return
+        await self.local.connect()
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._forwarded = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._receive()),
+                       asyncio.create_task(self._apply_forwarded())]
+
+    async def close(self) -> None:
+        if self._writer is None:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._writer, self._tasks = None, []
+        await self.local.close()
+
+    async def get_catalog_version(self) -> int:
+        return await self.local.get_catalog_version()
+
+    async def get_books(self) -> list[tuple]:
+        return await self.local.get_books()
+
+    async def get_already_read_books(self, today: date) -> list[tuple]:
+        return await self.local.get_already_read_books(today)
+
+    async def get_now_reading_books(self, today: date) -> list[tuple]:
+        return await self.local.get_now_reading_books(today)
+
+    async def search_books(self, trigrams: set[str], limit: int) -> list[tuple[int, str, str]]:
+        return await self.local.search_books(trigrams, limit)
+
+    async def get_actual_voting(self, today: date) -> tuple[int, date, date] | None:
+        return await self.local.get_actual_voting(today)
+
+    async def get_next_voting_start(self, today: date) -> date | None:
+        return await self.local.get_next_voting_start(today)
+
+    async def save_users(self, user_ids: Iterable[int]) -> None:
+        await self._call("save_users", list(user_ids))
+
+    async def save_ballots(self, ballots: Sequence[BallotRow],
+                           on_saved: Callable[[], None] | None = None) -> None:
+        async with self._ballots_lock:
+            await self._call("save_ballots", list(ballots))
+            if on_saved is not None:
+                on_saved()
+
+    async def get_ballots(self, voting_id: int) -> list[tuple[int, ...]]:
+        async with self._ballots_lock:
+            return await self._call("get_ballots", voting_id)
+
+    async def get_scores(self, voting_id: int, weights: Sequence[int]) -> dict[int, int]:
+        async with self._ballots_lock:
+            return await self._call("get_scores", voting_id, tuple(weights))
+
+    async def get_unfrozen_votings(self, today: date) -> list[int]:
+        return await self.local.get_unfrozen_votings(today)
+
+    async def get_snapshots(self, count: int) -> list[SnapshotRow]:
+        return await self.local.get_snapshots(count)
+
+    async def get_snapshot(self, voting_id: int) -> list[SnapshotRow]:
+        return await self.local.get_snapshot(voting_id)
+
+    async def save_snapshot(self, voting_id: int, rule: str, ballots: int,
+                            frozen_at: datetime, books: Sequence[SnapshotBook]) -> None:
+        await self._call("save_snapshot", voting_id, rule, ballots, frozen_at, list(books))
+
+    async def notify_reload(self) -> None:
+        await self._call("reload")
+
+    async def _call(self, method: str, *args):
+        if self._writer is None:
+            await self.connect()
+        request_id = next(self._request_ids)
+        reply = asyncio.get_running_loop().create_future()
+        self._replies[request_id] = reply
+        try:
+            _write_message(self._writer, (request_id, method, args))
+            await self._writer.drain()
+            return await reply
+        finally:
+            self._replies.pop(request_id, None)
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                kind, *payload = await _read_message(self._reader)
+                if kind != "reply":
+                    self._forwarded.put_nowait((kind, payload[0]))
+                    continue
+                request_id, result, error = payload
+                reply = self._replies.get(request_id)
+                if reply is None or reply.done():
+                    continue
+                if error is None:
+                    reply.set_result(result)
+                else:
+                    reply.set_exception(WriterError(error))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.error("Lost connection to the writer process")
+            for reply in self._replies.values():
+                if not reply.done():
+                    reply.set_exception(WriterError("writer process is gone"))
+
+    async def _apply_forwarded(self) -> None:
+        while True:
+            messages = [await self._forwarded.get()]
+            while not self._forwarded.empty():
+                messages.append(self._forwarded.get_nowait())
+            async with self._ballots_lock:
+                for kind, payload in messages:
+                    if kind == "ballots":
+                        leaderboard.apply_ballots(payload)
+                    elif kind == "discard":
+                        for voting_id in payload:
+                            leaderboard.discard(voting_id)
+                    elif kind == "reload":
+                        books.invalidate_catalog()
+                        votings.invalidate_actual_voting()
+
+
+class Dispatcher:
+    """Starts the writer and worker processes and routes updates to workers"""
+
+    def __init__(self, token: str, base_url: str | None = None,
+                 workers: int = config.WORKER_PROCESSES):
+        self.token = token
+        self.base_url = base_url
+        self.workers = max(workers, 1)
+        self._context = multiprocessing.get_context("spawn")
+        self._directory: str | None = None
+        self._queues: list[multiprocessing.Queue] = []
+        self._processes: list[multiprocessing.Process] = []
+        self._writer_process: multiprocessing.Process | None = None
+        self._writer_stopping = self._context.Event()
+
+    async def start(self) -> None:
+        """Start the writer, then the workers, and wait until all are ready"""
+        self._directory = tempfile.mkdtemp(prefix="book-club-")
+        path = os.path.join(self._directory, "writer.sock")
+        # spawned processes start from the config module as it is on disk
+        settings = {name: value for name, value in vars(config).items() if name.isupper()}
+        ready = self._context.Event()
+        self._writer_process = self._context.Process(
+            target=_run_writer, name="writer", daemon=True,
+            args=(settings, self.token, self.base_url, path, ready, self._writer_stopping))
+        self._writer_process.start()
+        await _wait_ready(ready, self._writer_process)
+        readies = []
+        for index in range(self.workers):
+            queue = self._context.Queue()
+            ready = self._context.Event()
+            process = self._context.Process(
+                target=_run_worker, name=f"worker-{index}", daemon=True,
+                args=(settings, index, self.token, self.base_url, path, queue, ready))
+            process.start()
+            self._queues.append(queue)
+            self._processes.append(process)
+            readies.append(ready)
+        for ready, process in zip(readies, self._processes):
+            await _wait_ready(ready, process)
+        logger.info("Started %s worker processes", self.workers)
+
+    async def stop(self) -> None:
+        """Let the workers finish queued updates, then stop the writer"""
+        loop = asyncio.get_running_loop()
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join)
+        if self._writer_process is not None:
+            # setting the event waits for its waiters, a killed writer is
+            # never going to wake up
+            if self._writer_process.is_alive():
+                self._writer_stopping.set()
+            await loop.run_in_executor(None, self._writer_process.join)
+        for queue in self._queues:
+            queue.close()
+        self._queues, self._processes, self._writer_process = [], [], None
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+        logger.info("Worker processes stopped")
+
+    def check_processes(self) -> None:
+        """Raise ProcessExitedError if the writer or a worker has exited"""
+        for process in (self._writer_process, *self._processes):
+            if process is not None:
+                _check_alive(process)
+
+    def dispatch(self, update: Update) -> None:
+        """Queue the update for its worker, ProcessExitedError if it exited"""
+        index = _get_worker_key(update) % len(self._queues)
+        # an update queued for a dead worker would be lost
+        _check_alive(self._processes[index])
+        self._queues[index].put(update.to_dict())
+
+    async def poll(self, bot: telegram.Bot) -> None:
+        """Long poll for updates and dispatch them until cancelled.
+
+        Failed requests are retried with a growing delay, like
+        python-telegram-bot's own polling does. When cancelled, the
+        dispatched updates are confirmed to Telegram, so a restart does
+        not get them again. Raises ProcessExitedError once the writer or a
+        worker is gone, leaving the updates it got since unconfirmed."""
+        offset = None
+        delay = 0.0
+        try:
+            while True:
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset, timeout=_POLL_TIMEOUT,
+                        allowed_updates=Update.ALL_TYPES)
+                except RetryAfter as error:
+                    await asyncio.sleep(_get_seconds(error.retry_after))
+                    continue
+                except InvalidToken:
+                    raise
+                except TelegramError as error:
+                    # a network error, or Conflict while another bot polls
+                    delay = min(max(delay * 1.5, 1.0), _MAX_POLL_DELAY)
+                    logger.error("Failed to get updates, retrying in %.1f s: %s", delay, error)
+                    await asyncio.sleep(delay)
+                    continue
+                delay = 0.0
+                self.check_processes()
+                for update in updates:
+                    self.dispatch(update)
+                    offset = update.update_id + 1
+        finally:
+            if offset is not None:
+                await _confirm_updates(bot, offset)
+
+
+def run(token: str, base_url: str | None = None,
+        workers: int = config.WORKER_PROCESSES) -> None:
+    """Run the dispatcher with its workers and writer until SIGINT or SIGTERM"""
+    asyncio.run(_run(token, base_url, workers))
+
+
+async def _run(token: str, base_url: str | None, workers: int) -> None:
+    dispatcher = Dispatcher(token, base_url, workers)
+    await dispatcher.start()
+    try:
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+        async with _make_bot(token, base_url) as bot:
+            await bot.delete_webhook()
+            polling = asyncio.create_task(dispatcher.poll(bot))
+            waiting = asyncio.create_task(stopping.wait())
+            # polling only ends by itself when a process died
+            await asyncio.wait((polling, waiting), return_when=asyncio.FIRST_COMPLETED)
+            waiting.cancel()
+            polling.cancel()
+            try:
+                await polling
+            except asyncio.CancelledError:
+                pass
+    finally:
+        await dispatcher.stop()
+
+
+def _get_worker_key(update: Update) -> int:
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return 0
+
+
+class _WriterServer:
+    """Serves the workers' writes and ballot reads one request at a time
+    per worker, forwarding saved ballots and /reload to the other workers"""
+
+    def __init__(self, on_ballots: Callable[[], None]):
+        # called after every saved batch
+        self.on_ballots = on_ballots
+        self._clients: set[asyncio.StreamWriter] = set()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            while True:
+                try:
+                    request_id, method, args = await _read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                result, error = None, None
+                try:
+                    result = await self._call(writer, method, args)
+                except Exception as exception:
+                    logger.exception("Writer request %s failed", method)
+                    error = f"{type(exception).__name__}: {exception}"
+                _write_message(writer, ("reply", request_id, result, error))
+                await writer.drain()
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _call(self, client: asyncio.StreamWriter, method: str, args: tuple):
+        backend = storage.get_storage()
+        if method == "save_users":
+            await backend.save_users(*args)
+        elif method == "save_ballots":
+            ballots, = args
+            try:
+                await backend.save_ballots(
+                    ballots, functools.partial(self._saved, client, ballots))
+            except Exception:
+                # forwarded ballots may have been rolled back
+                voting_ids = {voting_id for voting_id, _, _ in ballots}
+                for voting_id in voting_ids:
+                    leaderboard.discard(voting_id)
+                self._forward(None, ("discard", voting_ids))
+                raise
+            self.on_ballots()
+        elif method == "get_ballots":
+            return await backend.get_ballots(*args)
+        elif method == "get_scores":
+            return await backend.get_scores(*args)
+        elif method == "save_snapshot":
+            await backend.save_snapshot(*args)
+        elif method == "reload":
+            books.invalidate_catalog()
+            votings.invalidate_actual_voting()
+            self._forward(client, ("reload", None))
+        else:
+            raise ValueError(f"Unknown writer request: {method}")
+
+    def _saved(self, origin: asyncio.StreamWriter, ballots: list[BallotRow]) -> None:
+        leaderboard.apply_ballots(ballots)
+        self._forward(origin, ("ballots", ballots))
+
+    def _forward(self, origin: asyncio.StreamWriter | None, message: tuple) -> None:
+        for client in self._clients:
+            if client is not origin:
+                _write_message(client, message)
+
+
+def _run_writer(settings: dict, token: str, base_url: str | None, path: str,
+                ready, stopping) -> None:
+    _init_process(settings)
+    asyncio.run(_serve_writer(token, base_url, path, ready, stopping))
+
+
+async def _serve_writer(token: str, base_url: str | None, path: str,
+                        ready, stopping) -> None:
+    import announcements
+    import live_results
+    import metrics_server
+
+    await storage.connect()
+    bot = _make_bot(token, base_url)
+    await bot.initialize()
+    server = await asyncio.start_unix_server(_WriterServer(
+        functools.partial(live_results.notify, bot)).handle, path)
+    await metrics_server.start()
+    live_results.notify(bot)
+    updating = asyncio.create_task(update_votings_periodically(bot))
+    ready.set()
+    logger.info("Writer process ready")
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, stopping.wait)
+    finally:
+        updating.cancel()
+        server.close()
+        await server.wait_closed()
+        await announcements.stop()
+        await live_results.stop()
+        await metrics_server.stop()
+        await storage.close()
+        await db.close()
+        await bot.shutdown()
+
+
+async def update_votings_periodically(bot: telegram.Bot) -> None:
+    """Freeze, announce and verify votings every config.SNAPSHOT_INTERVAL
+    seconds until cancelled, what main.update_votings does as a job"""
+    import announcements
+    import live_results
+    import snapshots
+
+    while True:
+        try:
+            await snapshots.freeze_closed_votings()
+            await announcements.announce_votings(bot)
+            await votings.verify_actual_tally()
+        except Exception:
+            logger.exception("Failed to update votings")
+        # a voting that just opened gets its live results message
+        live_results.notify(bot)
+        await asyncio.sleep(config.SNAPSHOT_INTERVAL)
+
+
+def _run_worker(settings: dict, index: int, token: str, base_url: str | None,
+                path: str, updates: multiprocessing.Queue, ready) -> None:
+    _init_process(settings)
+    asyncio.run(_serve_worker(index, token, base_url, path, updates, ready))
+
+
+async def _serve_worker(index: int, token: str, base_url: str | None, path: str,
+                        updates: multiprocessing.Queue, ready) -> None:
+    import main
+    import metrics_server
+    import responses
+    import vote_mode
+    import vote_writer
+
+    # the writer process keeps the live results messages
+    config.LIVE_RESULTS_CHAT_IDS = ()
+    if config.VOTE_MODE_PERSIST:
+        logger.warning("Vote mode is not persisted with worker processes")
+        config.VOTE_MODE_PERSIST = False
+    if config.METRICS_PORT is not None:
+        config.METRICS_PORT += 1 + index
+    storage.set_storage(WriterClientStorage(path, storage.get_storage()))
+    await storage.connect()
+    await responses.warm_up()
+    await vote_writer.start()
+    await vote_mode.load()
+    await metrics_server.start()
+    application = main.build_application(token, base_url)
+    await application.initialize()
+    await application.start()
+    ready.set()
+    loop = asyncio.get_running_loop()
+    try:
+        while (data := await loop.run_in_executor(None, updates.get)) is not None:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.update_queue.join()
+    finally:
+        await application.stop()
+        await main.post_shutdown(application)
+        await application.shutdown()
+
+
+def _init_process(settings: dict) -> None:
+    """Take over the dispatcher's config.
+
+    Modules sending messages are imported only after this, as sender sizes
+    its rate limits on import."""
+    # the dispatcher stops its processes itself on Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    vars(config).update(settings)
+
+
+def _check_alive(process: multiprocessing.Process) -> None:
+    if not process.is_alive():
+        raise ProcessExitedError(f"{process.name} process exited with code {process.exitcode}")
+
+
+async def _wait_ready(ready, process: multiprocessing.Process) -> None:
+    loop = asyncio.get_running_loop()
+    while not await loop.run_in_executor(None, ready.wait, 1):
+        _check_alive(process)
+
+
+def _make_bot(token: str, base_url: str | None) -> telegram.Bot:
+    if base_url:
+        return telegram.Bot(token, base_url=base_url)
+    return telegram.Bot(token)
+
+
+async def _confirm_updates(bot: telegram.Bot, offset: int) -> None:
+    try:
+        await bot.get_updates(offset=offset, timeout=0, limit=1)
+    except TelegramError as error:
+        logger.warning("Failed to confirm updates before %s: %s", offset, error)
+
+
+def _get_seconds(retry_after: int | timedelta) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+def _write_message(writer: asyncio.StreamWriter, message) -> None:
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+async def _read_message(reader: asyncio.StreamReader):
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))